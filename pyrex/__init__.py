@@ -6,14 +6,17 @@ import os.path
 from .__about__ import __version__, __long_description__
 __doc__ = __long_description__
 
-from .signals import (Signal, EmptySignal, FunctionSignal,
-                      AskaryanSignal, ThermalNoise)
+from .signals import (Signal, EmptySignal, WindowedSignal, LazySignal,
+                      DigitizedSignal, FunctionSignal, AskaryanSignal,
+                      ThermalNoise, SignalBatch, UniformTimes,
+                      StreamingFilter, StreamingEnvelope, NoiseBuffer)
 from .antenna import Antenna, DipoleAntenna
 from .detector import AntennaSystem, Detector
 from .ice_model import IceModel
 from .earth_model import prem_density, slant_depth
 from .particle import Particle, ShadowGenerator
-from .ray_tracing import PathFinder, ReflectedPathFinder
+from .ray_tracing import (PathFinder, ReflectedPathFinder,
+                          PathBatch, ReflectedPathBatch)
 from .kernel import EventKernel
 
 
@@ -1,13 +1,132 @@
 """Module containing antenna class capable of receiving signals"""
 
+import collections
+import functools
 import numpy as np
 import scipy.fftpack
 import scipy.signal
-from pyrex.internal_functions import normalize
-from pyrex.signals import Signal, ThermalNoise, EmptySignal
+from pyrex.internal_functions import normalize, truncate_stale
+from pyrex.signals import Signal, EmptySignal, NoiseBuffer
 from pyrex.ice_model import IceModel
 
 
+class FrequencyResponse:
+    """Class for a frequency response function which caches its values on FFT
+    frequency grids. Calling the object evaluates the response at the given
+    frequencies (Hz), while on_grid(n, dt) returns the response at the FFT
+    frequencies of n samples with time step dt (s). Only the most recently
+    used cache_size grids are kept."""
+    def __init__(self, function, cache_size=8):
+        self.function = function
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+
+    def __call__(self, frequencies):
+        return self.function(frequencies)
+
+    def on_grid(self, n, dt):
+        """Returns the (cached) response at the FFT frequencies of n samples
+        with time step dt. The returned array is read-only since it is shared
+        by every caller using the same grid."""
+        key = (n, dt)
+        try:
+            response = self._cache[key]
+        except KeyError:
+            frequencies = scipy.fftpack.fftfreq(n=n, d=dt)
+            response = np.array(self(frequencies), dtype="complex128")
+            response.flags.writeable = False
+            self._cache[key] = response
+            while len(self._cache)>self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return response
+
+    def clear_cache(self):
+        """Remove all cached grid responses."""
+        self._cache.clear()
+
+
+class ButterworthResponse(FrequencyResponse):
+    """Analog butterworth filter response of the given order for the given
+    frequency range (Hz). Use ButterworthResponse.shared to get a single
+    response object shared by all antennas with the same filter."""
+    def __init__(self, order, freq_range, btype='bandpass', cache_size=8):
+        self.freq_range = freq_range
+        self.btype = btype
+        b, a  = scipy.signal.butter(order, 2*np.pi*np.array(freq_range),
+                                    btype=btype, analog=True)
+        self.coeffs = (b, a)
+        self._sos_cache = {}
+        super().__init__(function=self.evaluate, cache_size=cache_size)
+
+    def evaluate(self, frequencies):
+        """Butterworth filter response at the given frequencies (Hz)."""
+        angular_freqs = np.array(frequencies) * 2*np.pi
+        w, h = scipy.signal.freqs(self.coeffs[0], self.coeffs[1],
+                                  angular_freqs)
+        return h
+
+    def sos(self, dt, method="bilinear"):
+        """Returns the filter discretized for time step dt (s) as digital
+        second-order sections, for use with Signal.filter_sos. The method may
+        be "bilinear" (bilinear transform) or "matched" (matched-z transform,
+        with gain matched to the analog filter at the center of the band).
+        Sections are cached for each time step and method.\n
+        Accuracy: for the default IREX/dipole filter (100-400 MHz) at
+        dt=0.05 ns, both methods match the analog response to within 0.1%
+        in the band and 1% up to 1 GHz, and filtered Askaryan pulses peak
+        within 1% of the FFT result when the FFT is zero-padded. Without
+        padding the FFT result itself is distorted by periodic wraparound,
+        which adds a further ~2% difference near the start of a 100 ns
+        window. Errors grow with dt as frequencies approach Nyquist (the
+        bilinear transform warps frequencies, while the matched-z transform
+        forces the response to zero at Nyquist)."""
+        key = (dt, method)
+        if key in self._sos_cache:
+            return self._sos_cache[key]
+
+        b, a = self.coeffs
+        if method=="bilinear":
+            b_d, a_d = scipy.signal.bilinear(b, a, fs=1/dt)
+            sos = scipy.signal.tf2sos(b_d, a_d)
+        elif method=="matched" or method=="matched-z":
+            z, p, k = scipy.signal.tf2zpk(b, a)
+            z_d = np.exp(z*dt)
+            p_d = np.exp(p*dt)
+            # Zeros at infinity map to the Nyquist frequency
+            z_d = np.concatenate((z_d, -np.ones(len(p)-len(z))))
+            # Match the gain to the analog response at a reference frequency
+            if self.btype=='lowpass':
+                f_ref = 0
+            elif self.btype=='highpass':
+                f_ref = 0.5/dt
+            else:
+                f_ref = np.sqrt(np.prod(self.freq_range))
+            z_ref = np.exp(2j*np.pi*f_ref*dt)
+            digital_gain = np.abs(np.prod(z_ref - z_d) / np.prod(z_ref - p_d))
+            k_d = np.abs(self.evaluate(f_ref)) / digital_gain
+            sos = scipy.signal.zpk2sos(z_d, p_d, k_d)
+        else:
+            raise ValueError("Discretization method '"+str(method)+
+                             "' not supported")
+
+        self._sos_cache[key] = sos
+        return sos
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _shared(order, freq_range, btype):
+        return ButterworthResponse(order, freq_range, btype=btype)
+
+    @staticmethod
+    def shared(order, freq_range, btype='bandpass'):
+        """Returns the butterworth response object for the given filter,
+        creating it only if no identical filter has been requested before.
+        Lets identical antennas share one filter and one response cache."""
+        return ButterworthResponse._shared(order, tuple(freq_range), btype)
+
+
 class Antenna:
     """Base class for an antenna with a given position (m), temperature (K),
     allowable frequency range (Hz), total resistance (ohm) used for Johnson
@@ -28,8 +147,20 @@ class Antenna:
         self.noisy = noisy
 
         self.signals = []
+        self.noise_period = None
         self._noise_master = None
+        self._noise_stale = False
+        # Random stream for the noise master, if assigned before the master
+        # could be created (see Detector.generate_noise)
+        self._noise_random_state = None
         self._noises = []
+        # Times of the noise for each signal (noise values are regenerated
+        # from the noise master as needed rather than stored).
+        # Caches of the combined waveforms and trigger decisions for each
+        # signal, extended as new signals are received. The signals they
+        # were calculated from are kept to detect changes to the signals list
+        self._hits = []
+        self._all_waveforms = []
         self._triggers = []
 
     def set_orientation(self, z_axis=[0,0,1], x_axis=[1,0,0]):
@@ -42,45 +173,87 @@ class Antenna:
     @property
     def is_hit(self):
         """Test for whether the antenna has been triggered."""
-        return len(self.waveforms)>0
+        return any(self._cached_triggers())
 
     def is_hit_during(self, times):
         """Test for whether the antenna has been triggered during the given
         times array."""
         return self.trigger(self.full_waveform(times))
 
+    @property
+    def hit_probability(self):
+        """Probability that the antenna is triggered by any of its signals
+        once noise is added, calculated from the noise-free signals without
+        generating noise. Can be used as an event weight in place of
+        is_hit."""
+        p_miss = 1
+        for signal in self.signals:
+            p_miss *= 1 - self.trigger_probability(signal)
+        return 1 - p_miss
+
     def clear(self):
-        """Reset the antenna to a state of having received no signals."""
+        """Reset the antenna to a state of having received no signals.
+        Also clears the cached waveforms and trigger decisions."""
         self.signals.clear()
+        self._noise_stale = True
+        self._clear_waveforms()
+
+    def _clear_waveforms(self):
+        """Clears the cached waveforms (and their noise times) and trigger
+        decisions, e.g. when the noise changes, so they're recalculated when
+        next needed."""
         self._noises.clear()
+        self._hits.clear()
+        self._all_waveforms.clear()
         self._triggers.clear()
 
-    @property
-    def waveforms(self):
-        """Signal + noise (if noisy) at each triggered antenna hit."""
-        # Process any unprocessed triggers
-        all_waves = self.all_waveforms
+    def _cached_all_waveforms(self):
+        """Returns the cached list of waveforms for all signals, calculating
+        waveforms for any new signals. Cached waveforms (and their noise
+        times and trigger decisions) are dropped for any signals which were
+        removed or replaced in the signals list."""
+        truncate_stale(self._hits, self.signals, self._noises,
+                       self._all_waveforms, self._triggers)
+
+        # Combine signals with noise for any signals received since the last
+        # call. Only the noise times are kept, since the same noise can be
+        # regenerated from the noise master
+        while len(self._all_waveforms)<len(self.signals):
+            signal = self.signals[len(self._all_waveforms)]
+            if not(self.noisy):
+                waveform = signal
+            else:
+                self._noises.append(signal.time_grid)
+                waveform = self.make_noise(self._noises[-1])
+                waveform += signal
+            self._hits.append(signal)
+            self._all_waveforms.append(waveform)
+
+        return self._all_waveforms
+
+    def _cached_triggers(self):
+        """Returns the cached list of trigger decisions for all signals,
+        calculating decisions for any new signals."""
+        all_waves = self._cached_all_waveforms()
         while len(self._triggers)<len(all_waves):
-            waveform = all_waves[len(self._triggers)]
-            self._triggers.append(self.trigger(waveform))
+            self._triggers.append(self.trigger(all_waves[len(self._triggers)]))
+        return self._triggers
 
-        return [wave for wave, triggered in zip(all_waves, self._triggers)
-                if triggered]
+    @property
+    def waveforms(self):
+        """Signal + noise (if noisy) at each triggered antenna hit. The
+        waveforms are copies (sharing values until modified) of the cached
+        waveforms, so they may be modified freely."""
+        triggers = self._cached_triggers()
+        return [wave.copy() for wave, triggered
+                in zip(self._all_waveforms, triggers) if triggered]
 
     @property
     def all_waveforms(self):
         """Signal + noise (if noisy) at all antenna hits, even those that
-        didn't trigger."""
-        if not(self.noisy):
-            return self.signals
-
-        # Generate noise as necessary
-        while len(self._noises)<len(self.signals):
-            self._noises.append(
-                self.make_noise(self.signals[len(self._noises)].times)
-            )
-
-        return [s + n for s, n in zip(self.signals, self._noises)]
+        didn't trigger. The waveforms are copies (sharing values until
+        modified) of the cached waveforms, so they may be modified freely."""
+        return [wave.copy() for wave in self._cached_all_waveforms()]
 
     def full_waveform(self, times):
         """Signal + noise (if noisy) for the given times array."""
@@ -89,46 +262,74 @@ class Antenna:
         else:
             waveform = EmptySignal(times)
 
+        # Use the waveform's (implicit if evenly spaced) times so each signal
+        # can be shifted onto them rather than interpolated
         for signal in self.signals:
-            waveform += signal.with_times(times)
+            waveform += signal.with_times(waveform.time_grid)
         return waveform
 
-    def make_noise(self, times):
-        """Returns the noise signal generated by the antenna over
-        the given array of times. Used to add noise to signal for production
-        of the antenna's waveforms."""
-        if self._noise_master is None:
-            if self.freq_range is None:
-                raise ValueError("A frequency range is required to generate"
-                                 +" antenna noise")
-            elif (self.noise_rms is None and
-                  (self.temperature is None or self.resistance is None)):
-                raise ValueError("A noise rms value (or temperature and"
-                                 +" resistance) are required to generate"
-                                 +" antenna noise")
-
-            # Calculate recommended number of frequencies for longest
-            # signal length stored
-            duration = 1e-7 if len(self.signals)==0 else 0
+    def _noise_parameters(self, times=None):
+        """Returns the keyword arguments of the NoiseBuffer used to generate
+        the antenna's noise, with spacing based on the given times (or on the
+        first signal received if no times are given)."""
+        if self.freq_range is None:
+            raise ValueError("A frequency range is required to generate"
+                             +" antenna noise")
+        elif (self.noise_rms is None and
+              (self.temperature is None or self.resistance is None)):
+            raise ValueError("A noise rms value (or temperature and"
+                             +" resistance) are required to generate"
+                             +" antenna noise")
+
+        period = self.noise_period
+        if period is None:
+            # Calculate period from the longest signal length stored
+            # (defaulting to 100 ns)
+            duration = 0
             for signal in self.signals:
-                signal_duration = signal.times[-1] - signal.times[0]
+                signal_duration = (signal.time_grid[-1]
+                                   - signal.time_grid[0])
                 if signal_duration > duration:
                     duration = signal_duration
-            n_freqs = (self.freq_range[1] - self.freq_range[0]) * duration
-
-            # Multiply n_freqs by 100 so up to about 100 signals can be stored
+            if duration==0:
+                duration = 1e-7
+            # Multiply by 100 so up to about 100 signals can be stored
             # without the noise being obviously periodic
-            n_freqs *= 100
+            period = duration * 100
+
+        # Sample the noise with the spacing of the times if possible,
+        # dividing the spacing as needed to sample above the frequency range
+        if times is None and len(self.signals)>0:
+            times = self.signals[0].time_grid
+        if times is not None and len(times)>1:
+            dt = np.abs(times[1] - times[0])
+        else:
+            dt = 0
+        if dt<=0:
+            dt = 1 / (10*self.freq_range[1])
+        dt = NoiseBuffer.sampling_spacing(dt, self.freq_range[1])
+        n = scipy.fftpack.next_fast_len(int(np.ceil(period/dt)))
 
-            if self.noise_rms is None:
-                self._noise_master = ThermalNoise(times, f_band=self.freq_range,
-                                                  temperature=self.temperature,
-                                                  resistance=self.resistance,
-                                                  n_freqs=n_freqs)
-            else:
-                self._noise_master = ThermalNoise(times, f_band=self.freq_range,
-                                                  rms_voltage=self.noise_rms,
-                                                  n_freqs=n_freqs)
+        return dict(f_band=self.freq_range, dt=dt, n=n,
+                    rms_voltage=self.noise_rms, temperature=self.temperature,
+                    resistance=self.resistance)
+
+    def make_noise(self, times):
+        """Returns the noise signal generated by the antenna over
+        the given array of times. Used to add noise to signal for production
+        of the antenna's waveforms. Noise comes from a ring buffer of noise
+        which repeats after noise_period seconds (by default 100 times the
+        longest signal received when the buffer is first needed), and which
+        is refreshed with new noise after the antenna is cleared."""
+        if self._noise_master is None:
+            self._noise_master = NoiseBuffer(
+                random_state=self._noise_random_state,
+                **self._noise_parameters(times)
+            )
+            self._noise_stale = False
+        elif self._noise_stale:
+            self._noise_master.refresh()
+            self._noise_stale = False
 
         return self._noise_master.with_times(times)
 
@@ -138,6 +339,30 @@ class Antenna:
         the given Signal object."""
         return True
 
+    def trigger_probability(self, signal):
+        """Function to determine the probability that the antenna is
+        triggered by the given noise-free Signal object once noise is added.
+        By default gives the trigger decision for the signal itself, which
+        is only correct for triggers unaffected by noise, so antennas with
+        noise-dependent triggers should override it."""
+        return float(self.trigger(signal))
+
+    @property
+    def noise_rms_voltage(self):
+        """RMS voltage (V) of the antenna's noise, either as given or as the
+        Johnson noise of the antenna's temperature and resistance."""
+        if self.noise_rms is not None:
+            return self.noise_rms
+        elif (self.temperature is not None and self.resistance is not None
+              and self.freq_range is not None):
+            # RMS voltage = sqrt(4 * kB * T * R * bandwidth)
+            return np.sqrt(4 * 1.38e-23 * self.temperature * self.resistance
+                           * (self.freq_range[1] - self.freq_range[0]))
+        else:
+            raise ValueError("A noise rms value (or temperature, resistance,"
+                             +" and frequency range) are required to"
+                             +" calculate the noise rms voltage")
+
     def _convert_to_antenna_coordinates(self, point):
         # Get cartesian point relative to antenna position
         rel_point = np.array(point) - np.array(self.position)
@@ -172,13 +397,24 @@ class Antenna:
         the imaginary part is the phase response."""
         return np.ones(len(frequencies))
 
+    def apply_response(self, signal):
+        """Applies the antenna's frequency response to the given Signal object
+        (in place). By default filters the signal in the frequency domain."""
+        signal.filter_frequencies(self.response)
+
     def receive(self, signal, origin=None, polarization=None):
         """Process incoming signal according to the filter function and
         store it to the signals list. Subclasses may extend this fuction,
         but should end with super().receive(signal)."""
-        copy = Signal(signal.times, signal.values,
-                      value_type=Signal.ValueTypes.voltage)
-        copy.filter_frequencies(self.response)
+        # Store the hit as a lazy signal with a copy of the received signal's
+        # values, so the response and gains (and any processing still pending
+        # on the received signal) are only applied once the values are
+        # needed. The values are copied rather than shared so that any later
+        # change to the received signal (including writes to its values
+        # array) can't change the stored hit
+        copy = signal.lazy(copy=True)
+        copy.value_type = Signal.ValueTypes.voltage
+        self.apply_response(copy)
 
         if origin is None:
             d_gain = 1
@@ -202,7 +438,7 @@ class Antenna:
             raise ValueError("Signal's value type must be either "
                              +"voltage or field. Given "+str(signal.value_type))
 
-        copy.values *= signal_factor
+        copy *= signal_factor
         self.signals.append(copy)
 
 
@@ -210,12 +446,16 @@ class Antenna:
 class DipoleAntenna(Antenna):
     """Antenna with a given name, position (m), center frequency (Hz),
     bandwidth (Hz), resistance (ohm), effective height (m), polarization
-    direction, and trigger threshold (V)."""
+    direction, and trigger threshold (V). The response_method determines how
+    the antenna response is applied: "fft" (default) filters in the frequency
+    domain, while "bilinear" or "matched" apply the discretized butterworth
+    filter in the time domain (see ButterworthResponse.sos)."""
     def __init__(self, name, position, center_frequency, bandwidth, resistance,
                  orientation=[0,0,1], trigger_threshold=0,
-                 effective_height=None, noisy=True):
+                 effective_height=None, noisy=True, response_method="fft"):
         self.name = name
         self.threshold = trigger_threshold
+        self.response_method = response_method
         if effective_height is None:
             # Calculate length of half-wave dipole
             self.effective_height = 3e8 / center_frequency / 2
@@ -239,10 +479,11 @@ class DipoleAntenna(Antenna):
                          freq_range=(f_low, f_high), resistance=resistance,
                          noisy=noisy)
 
-        # Build scipy butterworth filter to speed up response function
-        b, a  = scipy.signal.butter(1, 2*np.pi*np.array(self.freq_range),
-                                    btype='bandpass', analog=True)
-        self.filter_coeffs = (b, a)
+        # Build scipy butterworth filter to speed up response function.
+        # Filter (and its cached responses) is shared between antennas
+        # with the same frequency range
+        self._response = ButterworthResponse.shared(1, self.freq_range)
+        self.filter_coeffs = self._response.coeffs
 
 
     def trigger(self, signal):
@@ -250,12 +491,32 @@ class DipoleAntenna(Antenna):
         given threshold."""
         return max(np.abs(signal.values)) > self.threshold
 
-    def response(self, frequencies):
-        """Butterworth filter response for the antenna's frequency range."""
-        angular_freqs = np.array(frequencies) * 2*np.pi
-        w, h = scipy.signal.freqs(self.filter_coeffs[0], self.filter_coeffs[1],
-                                  angular_freqs)
-        return h
+    def trigger_probability(self, signal):
+        """Probability that the maximum value of the signal plus the
+        antenna's noise is above the given threshold, calculated without
+        generating noise (see Signal.threshold_probability)."""
+        if not(self.noisy):
+            return float(self.trigger(signal))
+        return signal.threshold_probability(self.threshold,
+                                            self.noise_rms_voltage,
+                                            self.freq_range)
+
+    @property
+    def response(self):
+        """Butterworth filter response for the antenna's frequency range.
+        Callable with an array of frequencies (Hz) like any response function,
+        with responses on FFT frequency grids cached."""
+        return self._response
+
+    def apply_response(self, signal):
+        """Applies the butterworth response to the given Signal object
+        (in place), either by FFT or by time-domain IIR filtering depending
+        on the antenna's response_method."""
+        if self.response_method=="fft":
+            signal.filter_frequencies(self.response)
+        else:
+            signal.filter_sos(self.response.sos(signal.dt,
+                                                method=self.response_method))
 
     def directional_gain(self, theta, phi):
         """Power gain of dipole antenna goes as sin(theta)^2, so electric field
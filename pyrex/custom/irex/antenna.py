@@ -1,20 +1,28 @@
 """Module containing customized antenna classes for IREX"""
 
 import numpy as np
-import scipy.signal
-from pyrex.signals import Signal
-from pyrex.antenna import Antenna
+from pyrex.signals import (Signal, EmptySignal, SignalBatch, NoiseBuffer,
+                           UniformTimes, GRID_TOLERANCE)
+from pyrex.internal_functions import truncate_stale
+from pyrex.antenna import Antenna, ButterworthResponse
 from pyrex.detector import AntennaSystem, Detector
 from pyrex.ice_model import IceModel
 
-from .frontends import pyspice, spice_circuits, basic_envelope_model
+from .frontends import (pyspice, spice_circuits, basic_envelope_model,
+                        basic_envelope_model_batch, spice_transient,
+                        spice_surrogate)
 
 class IREXAntenna(Antenna):
     """Antenna to be used in IREX. Has a position (m),
     center frequency (Hz), bandwidth (Hz), resistance (ohm),
-    effective height (m), and polarization direction."""
+    effective height (m), and polarization direction. The response_method
+    determines how the antenna response is applied: "fft" (default) filters in
+    the frequency domain, while "bilinear" or "matched" apply the discretized
+    butterworth filter in the time domain (see ButterworthResponse.sos)."""
     def __init__(self, position, center_frequency, bandwidth, resistance,
-                 orientation=(0,0,1), effective_height=None, noisy=True):
+                 orientation=(0,0,1), effective_height=None, noisy=True,
+                 response_method="fft"):
+        self.response_method = response_method
         if effective_height is None:
             # Calculate length of half-wave dipole
             self.effective_height = 3e8 / center_frequency / 2
@@ -38,17 +46,28 @@ class IREXAntenna(Antenna):
                          freq_range=(f_low, f_high), resistance=resistance,
                          noisy=noisy)
 
-        # Build scipy butterworth filter to speed up response function
-        b, a  = scipy.signal.butter(1, 2*np.pi*np.array(self.freq_range),
-                                    btype='bandpass', analog=True)
-        self.filter_coeffs = (b, a)
+        # Build scipy butterworth filter to speed up response function.
+        # Filter (and its cached responses) is shared between antennas
+        # with the same frequency range
+        self._response = ButterworthResponse.shared(1, self.freq_range)
+        self.filter_coeffs = self._response.coeffs
 
-    def response(self, frequencies):
-        """Butterworth filter response for the antenna's frequency range."""
-        angular_freqs = np.array(frequencies) * 2*np.pi
-        w, h = scipy.signal.freqs(self.filter_coeffs[0], self.filter_coeffs[1],
-                                  angular_freqs)
-        return h
+    @property
+    def response(self):
+        """Butterworth filter response for the antenna's frequency range.
+        Callable with an array of frequencies (Hz) like any response function,
+        with responses on FFT frequency grids cached."""
+        return self._response
+
+    def apply_response(self, signal):
+        """Applies the butterworth response to the given Signal object
+        (in place), either by FFT or by time-domain IIR filtering depending
+        on the antenna's response_method."""
+        if self.response_method=="fft":
+            signal.filter_frequencies(self.response)
+        else:
+            signal.filter_sos(self.response.sos(signal.dt,
+                                                method=self.response_method))
 
     def directional_gain(self, theta, phi):
         """Power gain of dipole antenna goes as sin(theta)^2, so electric field
@@ -62,17 +81,88 @@ class IREXAntenna(Antenna):
 
 
 
+def _doubled_times(times):
+    """Helper function to extend the given times backwards to twice their
+    length (ending at the same time). Evenly spaced times are returned as
+    a UniformTimes object so signals can be shifted onto them."""
+    if not(isinstance(times, UniformTimes)):
+        grid = UniformTimes.from_array(times)
+        if grid is None:
+            times = np.asarray(times)
+            return np.concatenate((times-times[-1]+times[0], times[1:]))
+        times = grid
+    return UniformTimes(times.t0-(times.n-1)*times.dt, times.dt, 2*times.n-1)
+
+
+def time_over_threshold_trigger(times, values, threshold,
+                                time_over_threshold=0):
+    """Helper function to find runs of values above the threshold lasting
+    longer than time_over_threshold (s), for a 1-D values array or a 2-D
+    array of channels by samples sharing the given times. A run lasts from
+    its first sample above threshold until the next sample not above
+    threshold (or the last sample). Returns whether each channel triggers and
+    the time of the start of its first qualifying run (NaN if none)."""
+    times = np.asarray(times)
+    values = np.asarray(values)
+    channels = np.atleast_2d(values)
+    n_channels, n_samples = channels.shape
+
+    triggered = np.zeros(n_channels, dtype=bool)
+    trigger_times = np.full(n_channels, np.nan)
+    if n_samples>1:
+        # Run-length encode the mask of samples above threshold (the last
+        # sample only ends runs), padded so every run has a start and an end
+        above = np.zeros((n_channels, n_samples+1), dtype="int8")
+        above[:, 1:-1] = channels[:, :-1]>threshold
+        edges = np.diff(above, axis=1)
+        rows, starts = np.nonzero(edges==1)
+        ends = np.nonzero(edges==-1)[1]
+        qualifying = times[ends]-times[starts] > time_over_threshold
+        rows, first = np.unique(rows[qualifying], return_index=True)
+        triggered[rows] = True
+        trigger_times[rows] = times[starts[qualifying][first]]
+
+    if values.ndim<2:
+        return triggered[0], trigger_times[0]
+    return triggered, trigger_times
+
+
 class IREXAntennaSystem(AntennaSystem):
     """IREX antenna system consisting of dipole antenna, low-noise amplifier,
-    optional bandpass filter, and envelope circuit."""
+    optional bandpass filter, and envelope circuit. If a sampling_time (s) is
+    given, the envelope is digitized at that time step with adc_bits bits of
+    resolution up to adc_full_scale (V, defaults to the amplifier clipping
+    voltage, which bounds the envelope), so waveforms are stored as
+    DigitizedSignal objects.\n
+    Envelope circuits need time to settle before their output is realistic,
+    so by default the front-end is run over twice the time of each waveform
+    and the first half is discarded. With warm_start the analytic (or
+    surrogate) envelope circuit instead starts each waveform in a state
+    drawn from its steady-state distribution with noise alone. This halves
+    the front-end work, but the output then only matches the settled output
+    statistically rather than sample by sample.\n
+    Spice envelope methods are run in this process unless a spice_pool
+    (see frontends.spice_pool) is given to run them in worker processes,
+    in which case the envelopes of all unprocessed signals are simulated
+    concurrently.
+    Surrogate envelope methods (e.g. "surrogate basic") instead apply a
+    frontends.SurrogateEnvelopeModel of the spice circuit, characterized with
+    spice once per time step and cached on disk."""
+    # Steady-state envelope circuit states with noise alone for each set of
+    # front-end parameters
+    _steady_states = {}
+
     def __init__(self, name, position, trigger_threshold, time_over_threshold=0,
                  orientation=(0,0,1), amplification=1, amplifier_clipping=3,
-                 noisy=True, envelope_method="analytic"):
+                 noisy=True, envelope_method="analytic", response_method="fft",
+                 sampling_time=None, adc_bits=8, adc_full_scale=None,
+                 warm_start=False, spice_pool=None):
         super().__init__(IREXAntenna)
 
         self.name = str(name)
         self.position = position
-        self.setup_antenna(orientation=orientation, noisy=noisy)
+        self.setup_antenna(orientation=orientation, noisy=noisy,
+                           response_method=response_method)
 
         self.amplification = amplification
         self.amplifier_clipping = amplifier_clipping
@@ -81,139 +171,261 @@ class IREXAntennaSystem(AntennaSystem):
         self.time_over_threshold = time_over_threshold
 
         self.envelope_method = envelope_method
+        self.warm_start = warm_start
+        self.spice_pool = spice_pool
+
+        self.sampling_time = sampling_time
+        self.adc_bits = adc_bits
+        self.adc_full_scale = adc_full_scale
 
     def setup_antenna(self, center_frequency=250e6, bandwidth=300e6,
                       resistance=100, orientation=(0,0,1),
-                      effective_height=None, noisy=True):
+                      effective_height=None, noisy=True,
+                      response_method="fft"):
         """Sets attributes of the antenna including center frequency (Hz),
-        bandwidth (Hz), resistance (ohms), orientation, and effective
-        height (m)."""
+        bandwidth (Hz), resistance (ohms), orientation, effective
+        height (m), and method of applying the antenna response."""
         super().setup_antenna(position=self.position,
                               center_frequency=center_frequency,
                               bandwidth=bandwidth,
                               resistance=resistance,
                               orientation=orientation,
                               effective_height=effective_height,
-                              noisy=noisy)
+                              noisy=noisy,
+                              response_method=response_method)
 
-    def make_envelope(self, signal):
-        """Return the signal envelope based on the antenna's envelope_method."""
+    @property
+    def _envelope_has_state(self):
+        """Whether the envelope method accepts an initial circuit state."""
+        return (("analytic" in self.envelope_method
+                 or "surrogate" in self.envelope_method)
+                and "hilbert" not in self.envelope_method)
+
+    def _spice_circuit_name(self):
+        """Returns the name of the spice circuit (in spice_circuits) matching
+        the envelope_method."""
+        if self.envelope_method=="spice":
+            raise ValueError("Type of spice circuit to use must be "+
+                             "specified")
+        # Try to match circuit name in spice_circuits keys
+        for key in spice_circuits:
+            if key in self.envelope_method:
+                return key
+        # If circuit not matched, try manual matching of circuit name
+        if "simple" in self.envelope_method:
+            return 'basic'
+        elif ("log amp" in self.envelope_method or
+              "logarithmic amp" in self.envelope_method):
+            return 'logamp'
+        elif "rectifier" in self.envelope_method:
+            return 'bridge'
+        # If still no circuits match, raise error
+        raise ValueError("Circuit '"+self.envelope_method+
+                         "' not implemented")
+
+    def make_envelope(self, signal, state=None):
+        """Return the signal envelope based on the antenna's envelope_method.
+        The analytic model uses the tabulated basic_envelope_model_batch,
+        unless the method includes "reference" to use basic_envelope_model.
+        The initial state of the analytic or surrogate envelope circuit
+        (output voltage, in V) can be given as state, and is otherwise
+        zero."""
+        if state is None:
+            state = 0
         if "hilbert" in self.envelope_method:
-            return Signal(signal.times, signal.envelope,
+            return Signal(signal.time_grid, signal.envelope,
                           value_type=signal.value_type)
 
         elif "analytic" in self.envelope_method:
             if ("basic" in self.envelope_method or
-                    self.envelope_method=="analytic"):
-                return basic_envelope_model(signal)
+                    self.envelope_method in ["analytic",
+                                             "analytic reference"]):
+                if "reference" in self.envelope_method:
+                    return basic_envelope_model(signal, state=state)
+                batch = SignalBatch(signal.time_grid, signal.values)
+                envelope = basic_envelope_model_batch(batch,
+                                                      state=state).values[0]
+                return Signal(signal.time_grid, envelope,
+                              value_type=Signal.ValueTypes.voltage,
+                              copy=False)
             else:
                 raise ValueError("Only basic envelope circuit is modeled "+
                                  "analytically")
 
+        elif "surrogate" in self.envelope_method:
+            model = spice_surrogate(self._spice_circuit_name(), signal.dt,
+                                    pool=self.spice_pool,
+                                    max_voltage=self.amplifier_clipping)
+            return model(signal, state=state)
+
         elif "spice" in self.envelope_method:
             if not(pyspice.__available__):
                 raise ModuleNotFoundError(pyspice.__modulenotfound__)
 
-            if self.envelope_method=="spice":
-                raise ValueError("Type of spice circuit to use must be "+
-                                 "specified")
-
-            copy = Signal(signal.times-signal.times[0], signal.values)
-            ngspice_in = pyspice.SpiceSignal(copy)
-
-            circuit = None
-            # Try to match circuit name in spice_circuits keys
-            for key, val in spice_circuits.items():
-                if key in self.envelope_method:
-                    circuit = val
-                    break
-            # If circuit not matched, try manual matching of circuit name
-            if circuit is None:
-                if "simple" in self.envelope_method:
-                    circuit = spice_circuits['basic']
-                elif ("log amp" in self.envelope_method or
-                      "logarithmic amp" in self.envelope_method):
-                    circuit = spice_circuits['logamp']
-                elif "rectifier" in self.envelope_method:
-                    circuit = spice_circuits['bridge']
-            # If still no circuits match, raise error
-            if circuit is None:
-                raise ValueError("Circuit '"+self.envelope_method+
-                                 "' not implemented")
-
-            simulator = circuit.simulator(
-                temperature=25, nominal_temperature=25,
-                ngspice_shared=ngspice_in.shared
-            )
-            analysis = simulator.transient(step_time=signal.dt,
-                                           end_time=copy.times[-1])
-            return Signal(signal.times, analysis.output,
-                          value_type=signal.value_type)
+            circuit_name = self._spice_circuit_name()
+            if self.spice_pool is not None:
+                return self.spice_pool.transient(circuit_name, [signal])[0]
+            return spice_transient(circuit_name, signal)
 
         else:
             raise ValueError("No envelope method matching '"+
                              self.envelope_method+"'")
 
-    def front_end(self, signal):
+    def make_envelopes(self, signals, states=None):
+        """Return the envelopes of each of the given signals (see
+        make_envelope), in order, starting from the given envelope circuit
+        states (one for each signal, or None). Spice envelopes are simulated
+        concurrently if the antenna system has a spice_pool."""
+        if states is None:
+            states = [None] * len(signals)
+        if ("spice" in self.envelope_method
+                and "surrogate" not in self.envelope_method
+                and self.spice_pool is not None and pyspice.__available__):
+            return self.spice_pool.transient(self._spice_circuit_name(),
+                                             signals)
+        return [self.make_envelope(signal, state=state)
+                for signal, state in zip(signals, states)]
+
+    def front_end(self, signal, state=None):
         """Apply the front-end processing of the antenna signal, including
-        amplification, clipping, and envelope processing."""
-        amplified_values = np.clip(signal.values*self.amplification,
-                                   a_min=-self.amplifier_clipping,
-                                   a_max=self.amplifier_clipping)
-        copy = Signal(signal.times, amplified_values)
-        return self.make_envelope(copy)
-
-        # # Two options for downsampling:
-        # envelope = self.make_envelope(copy)
-        # time = envelope.times[-1] - envelope.times[0]
-        # sampling_time = 1e-9
-        # npts = time / sampling_time
-
-        # # Option 1
-        # downsampled_times = np.linspace(envelope.times[0], envelope.times[-1],
-        #                                 num=npts+1)
-        # return envelope.with_times()
-
-        # # Option 2
-        # envelope.resample(npts)
-        # return envelope
+        amplification, clipping, envelope processing (starting from the given
+        envelope circuit state, if any), and digitization (if the sampling
+        time is set)."""
+        return self.front_ends([signal], states=[state])[0]
+
+    def front_ends(self, signals, states=None):
+        """Apply the front-end processing (see front_end) to each of the given
+        signals, starting from the given envelope circuit states (one for
+        each signal, or None). The envelopes of all signals are made together
+        by make_envelopes, so spice envelopes are simulated concurrently if
+        the antenna system has a spice_pool."""
+        amplified = []
+        for signal in signals:
+            copy = signal * self.amplification
+            copy.clip(-self.amplifier_clipping, self.amplifier_clipping)
+            amplified.append(copy)
+        envelopes = self.make_envelopes(amplified, states=states)
+        if self.sampling_time is None:
+            return envelopes
+        full_scale = self.adc_full_scale
+        if full_scale is None:
+            full_scale = self.amplifier_clipping
+        return [envelope.digitize(self.sampling_time, bits=self.adc_bits,
+                                  full_scale=full_scale)
+                for envelope in envelopes]
+
+    def _output_times(self, long_waveform, times):
+        """Returns the times of the front-end output (long_waveform) which
+        fall within the given times. These are the given times themselves
+        unless the output has been digitized."""
+        if self.sampling_time is None:
+            return times
+        grid = long_waveform.time_grid
+        first = int(np.ceil((times[0]-grid.t0)/grid.dt - GRID_TOLERANCE))
+        last = int(np.floor((times[-1]-grid.t0)/grid.dt + GRID_TOLERANCE))
+        return UniformTimes(grid.t0+first*grid.dt, grid.dt, last-first+1)
 
     @property
-    def all_waveforms(self):
-        # Process any unprocessed antenna waveforms
-        while len(self._all_waveforms)<len(self.antenna.signals):
-            signal = self.antenna.signals[len(self._all_waveforms)]
-            t = signal.times
-            long_times = np.concatenate((t-t[-1]+t[0], t[1:]))
-            long_signal = signal.with_times(long_times)
-            long_noise = self.antenna.make_noise(long_times)
-            long_waveform = self.front_end(long_signal+long_noise)
-            self._all_waveforms.append(long_waveform.with_times(t))
+    def _warm_started(self):
+        """Whether the envelope circuit is warm started rather than settled
+        over doubled times."""
+        return self.warm_start and self._envelope_has_state
+
+    def _initial_state(self, dt):
+        """Returns the initial envelope circuit state for a waveform with time
+        step dt (s). With warm start, the state is drawn from the states of
+        the circuit with noise alone (calculated once for each set of
+        front-end parameters). Otherwise returns None."""
+        if not(self._warm_started):
+            return None
+        if not(self.antenna.noisy):
+            return 0
+
+        f_band = tuple(self.antenna.freq_range)
+        rms = self.antenna.noise_rms_voltage
+        key = (dt, f_band, rms, self.amplification, self.amplifier_clipping,
+               self.envelope_method)
+        if key not in self._steady_states:
+            # Run the front-end over noise alone, keeping the states once the
+            # circuit has settled (in the second half of the noise)
+            n = 8192
+            noise_dt = NoiseBuffer.sampling_spacing(dt, f_band[1])
+            buffer = NoiseBuffer(f_band, noise_dt, int(np.ceil(n*dt/noise_dt)),
+                                 rms_voltage=rms)
+            noise = buffer.with_times(UniformTimes(0, dt, n))
+            noise *= self.amplification
+            noise.clip(-self.amplifier_clipping, self.amplifier_clipping)
+            envelope = self.make_envelope(noise)
+            self._steady_states[key] = np.array(envelope.values[n//2:])
+        return np.random.choice(self._steady_states[key])
+
+    def _front_end_times(self, times):
+        """Returns the times over which the front-end is run to produce the
+        output over the given times."""
+        if self._warm_started:
+            return times
+        return _doubled_times(times)
+
+    def _cached_signals(self):
+        truncate_stale(self._signal_sources, self.antenna.signals,
+                       self._signals)
+        # Process all unprocessed antenna signals together
+        pending = self.antenna.signals[len(self._signals):]
+        self._signal_sources.extend(pending)
+        self._signals.extend(self.front_ends(pending))
+        return self._signals
+
+    def _cached_all_waveforms(self):
+        truncate_stale(self._hits, self.antenna.signals,
+                       self._all_waveforms, self._triggers)
+        # Process all unprocessed antenna waveforms together, so their
+        # envelopes can be made concurrently
+        pending = self.antenna.signals[len(self._all_waveforms):]
+        long_waveforms = []
+        for signal in pending:
+            long_times = self._front_end_times(signal.time_grid)
+            if self.antenna.noisy:
+                long_waveform = self.antenna.make_noise(long_times)
+            else:
+                long_waveform = EmptySignal(long_times)
+            long_waveform += signal.with_times(long_waveform.time_grid)
+            long_waveforms.append(long_waveform)
+        states = [self._initial_state(long_waveform.dt)
+                  for long_waveform in long_waveforms]
+        outputs = self.front_ends(long_waveforms, states=states)
+        for signal, output in zip(pending, outputs):
+            self._hits.append(signal)
+            self._all_waveforms.append(
+                output.with_times(self._output_times(output,
+                                                     signal.time_grid))
+            )
         # Return envelopes of antenna waveforms
         return self._all_waveforms
 
     def full_waveform(self, times):
         # Process full antenna waveform
-        # TODO: Optimize this so it doesn't have to double the amount of time
-        # And same for the similar method above in all_waveforms
-        long_times = np.concatenate((times-times[-1]+times[0], times[1:]))
+        long_times = self._front_end_times(times)
         preprocessed = self.antenna.full_waveform(long_times)
-        long_waveform = self.front_end(preprocessed)
-        return long_waveform.with_times(times)
+        long_waveform = self.front_end(
+            preprocessed, state=self._initial_state(preprocessed.dt)
+        )
+        return long_waveform.with_times(self._output_times(long_waveform,
+                                                           times))
 
     def trigger(self, signal):
-        imax = len(signal.times)
-        i = 0
-        while i<imax:
-            j = i
-            while i<imax-1 and signal.values[i]>self.trigger_threshold:
-                i += 1
-            if i!=j:
-                time = signal.times[i]-signal.times[j]
-                if time>self.time_over_threshold:
-                    return True
-            i += 1
-        return False
+        """Trigger on the signal if the envelope is above the trigger
+        threshold for longer than the time over threshold."""
+        return self.trigger_time(signal) is not None
+
+    def trigger_time(self, signal):
+        """Returns the time at which the first run of the signal above the
+        trigger threshold longer than the time over threshold begins, or None
+        if the signal doesn't trigger."""
+        triggered, time = time_over_threshold_trigger(
+            np.asarray(signal.time_grid), signal.values,
+            self.trigger_threshold, self.time_over_threshold
+        )
+        return time if triggered else None
 
 
 
@@ -1,33 +1,50 @@
 """Module containing IREX front-end circuit models"""
 
+import functools
+import hashlib
+import math
+import os
 import os.path
+import tempfile
 import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+import scipy.special
 from scipy.special import lambertw
-from pyrex.signals import Signal
+from pyrex.signals import Signal, SignalBatch, NoiseBuffer, UniformTimes
 
 import warnings
 
 import pyrex.custom.pyspice as pyspice
 
-spice_circuits = {}
+spice_library_path = os.path.join(os.path.dirname(pyspice.__file__),
+                                  'spice_models')
 
-if pyspice.__available__:
-    spice_library_path = os.path.join(os.path.dirname(pyspice.__file__),
-                                      'spice_models')
-    spice_library = pyspice.SpiceLibrary(spice_library_path)
-
-    # Basic envelope circuit:
-    #
-    #   Vin---D1>---+---+---out
-    #               |   |
-    #              C1   R1
-    #               |   |
-    #               +---+
-    #               |
-    #              gnd
-    #
+def _spice_library():
+    """Returns the pyspice.SpiceLibrary of the spice models directory."""
+    if not(pyspice.__available__):
+        raise ModuleNotFoundError(pyspice.__modulenotfound__)
+    return pyspice.SpiceLibrary(spice_library_path)
+
+# SpiceLibrary of the spice models directory, which is only parsed the first
+# time it's needed. Calling it returns the library, and it can also be
+# indexed directly like the library
+spice_library = pyspice.LazyObject(_spice_library)
+
+
+# Basic envelope circuit:
+#
+#   Vin---D1>---+---+---out
+#               |   |
+#              C1   R1
+#               |   |
+#               +---+
+#               |
+#              gnd
+#
+def _basic_envelope_circuit():
     basic_envelope_circuit = pyspice.Circuit('Basic Envelope Circuit')
-    basic_envelope_circuit.include(spice_library['hsms'])
+    basic_envelope_circuit.include(spice_library()['hsms'])
 
     basic_envelope_circuit.V('in', 'input', basic_envelope_circuit.gnd,
                              'dc 0 external')
@@ -36,24 +53,25 @@ if pyspice.__available__:
                              pyspice.u_pF(20))
     basic_envelope_circuit.R(1, 'output', basic_envelope_circuit.gnd,
                              pyspice.u_Ohm(500))
-    
-    spice_circuits['basic'] = basic_envelope_circuit
-
-    # Biased envelope circuit:
-    #
-    #     Vin---C2---+---D1>---+---+---out
-    #                |         |   |
-    #               R2        C1   R1
-    #                |         |   |
-    #   Vbias---R3---+         +---+
-    #                |         |
-    #               D2        gnd
-    #                v
-    #                |
-    #               gnd
-    #
+
+    return basic_envelope_circuit
+
+# Biased envelope circuit:
+#
+#     Vin---C2---+---D1>---+---+---out
+#                |         |   |
+#               R2        C1   R1
+#                |         |   |
+#   Vbias---R3---+         +---+
+#                |         |
+#               D2        gnd
+#                v
+#                |
+#               gnd
+#
+def _biased_envelope_circuit():
     biased_envelope_circuit = pyspice.Circuit('Biased Envelope Circuit')
-    biased_envelope_circuit.include(spice_library['hsms'])
+    biased_envelope_circuit.include(spice_library()['hsms'])
 
     biased_envelope_circuit.V('in', 'input', biased_envelope_circuit.gnd,
                        'dc 0 external')
@@ -74,23 +92,24 @@ if pyspice.__available__:
     biased_envelope_circuit.R(1, 'output', biased_envelope_circuit.gnd,
                        pyspice.u_Ohm(500))
 
-    spice_circuits['biased'] = biased_envelope_circuit
-
-    # Voltage doubler envelope circuit:
-    #
-    #                       Isrc
-    #                        |
-    #   Vin---C1---+---D1>---+---C3---out
-    #              |         |
-    #              ^         |
-    #             D2         C2
-    #              |         |
-    #              +----+----+
-    #                   |
-    #                  gnd
-    #
+    return biased_envelope_circuit
+
+# Voltage doubler envelope circuit:
+#
+#                       Isrc
+#                        |
+#   Vin---C1---+---D1>---+---C3---out
+#              |         |
+#              ^         |
+#             D2         C2
+#              |         |
+#              +----+----+
+#                   |
+#                  gnd
+#
+def _doubler_envelope_circuit():
     doubler_envelope_circuit = pyspice.Circuit('Voltage Doubler Envelope Circuit')
-    doubler_envelope_circuit.include(spice_library['hsms'])
+    doubler_envelope_circuit.include(spice_library()['hsms'])
 
     doubler_envelope_circuit.V('in', 'input', doubler_envelope_circuit.gnd,
                                'dc 0 external')
@@ -109,61 +128,63 @@ if pyspice.__available__:
     doubler_envelope_circuit.R(1, 'output', doubler_envelope_circuit.gnd,
                                pyspice.u_Ohm(500))
 
-    spice_circuits['doubler'] = doubler_envelope_circuit
-
-    # # Log amplifier envelope circuit:
-    # #
-    # #   Vin---+---C1---+   +-------+-----Vs
-    # #         |        |   |       |
-    # #         |        8   7   6   5
-    # #         |     +--+---+---+---+--+
-    # #        R1     |      AD8310     |
-    # #         |     +--+---+---+---+--+
-    # #         |        1   2   3   4
-    # #         |        |   |       |
-    # #         +---C2---+  gnd      +-----Vout
-    # #         |
-    # #        gnd
-    # #
-    # log_amp_envelope_circuit = pyspice.Circuit('Log Amplifier Envelope Circuit')
-    # log_amp_envelope_circuit.include(spice_library['AD8310_MODEL'])
-
-    # log_amp_envelope_circuit.V('in', 'input', log_amp_envelope_circuit.gnd,
-    #                            'dc 0 external')
-    # log_amp_envelope_circuit.R(1, 'input', log_amp_envelope_circuit.gnd,
-    #                            pyspice.u_Ohm(52.3))
-    # log_amp_envelope_circuit.C(1, 'input', 'pin8',
-    #                            pyspice.u_nF(10))
-    # log_amp_envelope_circuit.C(2, log_amp_envelope_circuit.gnd, 'pin1',
-    #                            pyspice.u_nF(10))
-    # log_amp_envelope_circuit.X('AD8310', 'AD8310_MODEL', 'pin8', 'pin1',
-    #                            'pin5/7', 'pin3', 'output', 'pin6', 'pin5/7')
-    # log_amp_envelope_circuit.V('s', 'pin5/7', log_amp_envelope_circuit.gnd,
-    #                            pyspice.u_V(5))
-
-    # spice_circuits['logamp'] = log_amp_envelope_circuit
-
-
-    # Bridge rectifier envelope circuit:
-    #
-    #   +-----------+
-    #   |           |
-    #   |       +---+---+
-    #   |       |       |
-    #   |       ^       D1
-    #   |      D3       v
-    #   |       |       |
-    #  Vin      +--gnd  +-----+---+---out
-    #   |       |       |     |   |
-    #   |      D4       ^
-    #   |       v       D2   C1   R1
-    #   |       |       |     |   |
-    #   |       +---+---+     +---+
-    #   |           |         |
-    #   +-----------+        gnd
-    #
+    return doubler_envelope_circuit
+
+# # Log amplifier envelope circuit:
+# #
+# #   Vin---+---C1---+   +-------+-----Vs
+# #         |        |   |       |
+# #         |        8   7   6   5
+# #         |     +--+---+---+---+--+
+# #        R1     |      AD8310     |
+# #         |     +--+---+---+---+--+
+# #         |        1   2   3   4
+# #         |        |   |       |
+# #         +---C2---+  gnd      +-----Vout
+# #         |
+# #        gnd
+# #
+# def _log_amp_envelope_circuit():
+#     log_amp_envelope_circuit = pyspice.Circuit('Log Amplifier Envelope Circuit')
+#     log_amp_envelope_circuit.include(spice_library()['AD8310_MODEL'])
+
+#     log_amp_envelope_circuit.V('in', 'input', log_amp_envelope_circuit.gnd,
+#                                'dc 0 external')
+#     log_amp_envelope_circuit.R(1, 'input', log_amp_envelope_circuit.gnd,
+#                                pyspice.u_Ohm(52.3))
+#     log_amp_envelope_circuit.C(1, 'input', 'pin8',
+#                                pyspice.u_nF(10))
+#     log_amp_envelope_circuit.C(2, log_amp_envelope_circuit.gnd, 'pin1',
+#                                pyspice.u_nF(10))
+#     log_amp_envelope_circuit.X('AD8310', 'AD8310_MODEL', 'pin8', 'pin1',
+#                                'pin5/7', 'pin3', 'output', 'pin6', 'pin5/7')
+#     log_amp_envelope_circuit.V('s', 'pin5/7', log_amp_envelope_circuit.gnd,
+#                                pyspice.u_V(5))
+
+#     return log_amp_envelope_circuit
+
+
+# Bridge rectifier envelope circuit:
+#
+#   +-----------+
+#   |           |
+#   |       +---+---+
+#   |       |       |
+#   |       ^       D1
+#   |      D3       v
+#   |       |       |
+#  Vin      +--gnd  +-----+---+---out
+#   |       |       |     |   |
+#   |      D4       ^
+#   |       v       D2   C1   R1
+#   |       |       |     |   |
+#   |       +---+---+     +---+
+#   |           |         |
+#   +-----------+        gnd
+#
+def _bridge_envelope_circuit():
     bridge_envelope_circuit = pyspice.Circuit('Bridge Rectifier Envelope Circuit')
-    bridge_envelope_circuit.include(spice_library['hsms'])
+    bridge_envelope_circuit.include(spice_library()['hsms'])
 
     bridge_envelope_circuit.V('in', 'input', 'neg',
                               'dc 0 external')
@@ -171,13 +192,66 @@ if pyspice.__available__:
     bridge_envelope_circuit.X('D2', 'hsms', 'neg', 'output')
     bridge_envelope_circuit.X('D3', 'hsms', bridge_envelope_circuit.gnd, 'input')
     bridge_envelope_circuit.X('D4', 'hsms', bridge_envelope_circuit.gnd, 'neg')
-    bridge_envelope_circuit.C(1, 'output', basic_envelope_circuit.gnd,
+    bridge_envelope_circuit.C(1, 'output', bridge_envelope_circuit.gnd,
                               pyspice.u_pF(20))
-    bridge_envelope_circuit.R(1, 'output', basic_envelope_circuit.gnd,
+    bridge_envelope_circuit.R(1, 'output', bridge_envelope_circuit.gnd,
                               pyspice.u_Ohm(500))
 
-    spice_circuits['bridge'] = bridge_envelope_circuit
+    return bridge_envelope_circuit
+
+
+# Spice circuits by name, each built the first time it's used
+if pyspice.__available__:
+    spice_circuits = pyspice.SpiceCircuits({
+        'basic': _basic_envelope_circuit,
+        'biased': _biased_envelope_circuit,
+        'doubler': _doubler_envelope_circuit,
+        # 'logamp': _log_amp_envelope_circuit,
+        'bridge': _bridge_envelope_circuit,
+    })
+    # Previous names of the circuits, which were built on import
+    basic_envelope_circuit = pyspice.LazyObject(
+        lambda: spice_circuits['basic']
+    )
+    biased_envelope_circuit = pyspice.LazyObject(
+        lambda: spice_circuits['biased']
+    )
+    doubler_envelope_circuit = pyspice.LazyObject(
+        lambda: spice_circuits['doubler']
+    )
+    bridge_envelope_circuit = pyspice.LazyObject(
+        lambda: spice_circuits['bridge']
+    )
+else:
+    spice_circuits = pyspice.SpiceCircuits()
+
+
+def spice_pool(processes=None):
+    """Returns a pyspice.SpicePool of the given number of worker processes
+    (defaults to the number of CPUs) which can simulate any of the spice
+    circuits, for running spice envelopes concurrently."""
+    if not(pyspice.__available__):
+        raise ModuleNotFoundError(pyspice.__modulenotfound__)
+    return pyspice.SpicePool(spice_circuits, processes=processes)
+
 
+def spice_transient(circuit_name, signal):
+    """Simulates the named spice circuit (in spice_circuits) in this process
+    with the given signal as the input voltage. Returns the output voltage
+    signal."""
+    if not(pyspice.__available__):
+        raise ModuleNotFoundError(pyspice.__modulenotfound__)
+    times = np.asarray(signal.time_grid)
+    copy = Signal(times-times[0], signal.values)
+    ngspice_in = pyspice.SpiceSignal(copy)
+    simulator = spice_circuits[circuit_name].simulator(
+        temperature=25, nominal_temperature=25,
+        ngspice_shared=ngspice_in.shared
+    )
+    analysis = simulator.transient(step_time=signal.dt,
+                                   end_time=times[-1]-times[0])
+    return Signal(signal.time_grid, analysis.output,
+                  value_type=signal.value_type)
 
 
 # Basic envelope circuit:
@@ -190,11 +264,12 @@ if pyspice.__available__:
 #              |
 #             gnd
 #
-def basic_envelope_model(signal, cap=20e-12, res=500):
+def basic_envelope_model(signal, cap=20e-12, res=500, state=0):
     """Model of a basic diode-capacitor-resistor envelope circuit. Takes a
     signal object as the input voltage and returns the output voltage signal
-    object."""
-    v_c = 0
+    object. The state of the circuit is the capacitor voltage (V), which
+    starts at the given state and ends at the last output voltage."""
+    v_c = state
     v_out = []
 
     r_d = 25
@@ -231,4 +306,417 @@ def basic_envelope_model(signal, cap=20e-12, res=500):
         v_c = v_c*charge_exp - discharge + lambert_factor*lambert_term
         v_out.append(v_c)
 
-    return Signal(signal.times, v_out, value_type=Signal.ValueTypes.voltage)
+    return Signal(signal.time_grid, v_out, value_type=Signal.ValueTypes.voltage)
+
+
+
+# Lowest argument and step size of the tabulated Wright omega function
+# (below the lowest argument the function is less than 5e-18, so is treated
+# as constant), and the tabulated values
+_OMEGA_MIN = -40
+_OMEGA_STEP = 2**-10
+_omega_table = np.zeros(0)
+
+def _wright_omega_table(a_max):
+    """Helper function returning the Wright omega function W(exp(a))
+    tabulated from _OMEGA_MIN in steps of _OMEGA_STEP to at least a_max.
+    The second derivative of the function is at most 4/27, so linear
+    interpolation of the table has an absolute error of at most
+    _OMEGA_STEP**2/8 * 4/27 (about 2e-8)."""
+    global _omega_table
+    n = int(np.ceil((a_max-_OMEGA_MIN)/_OMEGA_STEP)) + 2
+    if len(_omega_table)<n:
+        # Extend well past the requested argument so the table is rarely
+        # recalculated
+        n = max(n, 2*len(_omega_table), int(150/_OMEGA_STEP))
+        grid = _OMEGA_MIN + _OMEGA_STEP*np.arange(n)
+        _omega_table = np.real(scipy.special.wrightomega(grid))
+    return _omega_table
+
+@functools.lru_cache(maxsize=8)
+def _envelope_increments(discharge, lambert_factor, n):
+    """Helper function returning the capacitor voltage change (less its decay)
+    in one time step of the basic envelope model at each of the first n
+    positions of the Wright omega table, and the slopes to the next
+    positions, both as arrays and as lists (for fast scalar indexing)."""
+    table = lambert_factor * _wright_omega_table(0)[:n+1]
+    increments = table[:-1] - discharge
+    slopes = np.diff(table)
+    return increments, slopes, increments.tolist(), slopes.tolist()
+
+# Number of channels above which the batch envelope model steps through
+# time with array operations instead of stepping through each channel
+_VECTORIZED_CHANNELS = 8
+
+def basic_envelope_model_batch(batch, cap=20e-12, res=500, state=0):
+    """Model of a basic diode-capacitor-resistor envelope circuit applied to
+    every signal of a SignalBatch at once. Equivalent to basic_envelope_model,
+    but with the Lambert W term interpolated from a table (absolute error
+    below 2e-8 of the term in each time step) and the circuit stepped
+    through time for all signals together. The initial capacitor voltage
+    (V) of the circuit can be given as state, either for all signals or as
+    an array with one element per signal. Returns the batch of output
+    voltage signals."""
+    r_d = 25
+    i_s = 3e-6
+    n = 1.06
+    v_t = 26e-3
+
+    # Terms which can be calculated ahead of time to save time in the loop
+    charge_exp = np.exp(-batch.dt/(res*cap))
+    discharge = i_s*res*(1-charge_exp)
+    lambert_factor = n*v_t*res/r_d*(1-charge_exp)
+    frac = i_s*r_d/n/v_t
+    lambert_exponent = np.log(frac) + frac
+
+    states = np.broadcast_to(np.asarray(state, dtype="float64"),
+                             (len(batch),))
+
+    # Position in the omega table of the exponent of the exponential in the
+    # lambert function for each input voltage, which is then shifted by the
+    # capacitor voltage in each step. The capacitor voltage can't drop below
+    # -i_s*res (or its initial value), which bounds the largest position
+    positions = ((lambert_exponent + batch.values/n/v_t - _OMEGA_MIN)
+                 / _OMEGA_STEP)
+    shift = 1/(n*v_t*_OMEGA_STEP)
+    v_c_min = min(np.min(states) if len(states)>0 else 0, -i_s*res)
+    v_in_max = np.max(batch.values) if batch.values.size>0 else 0
+    a_max = lambert_exponent + (v_in_max - v_c_min) / n/v_t
+    n_table = len(_wright_omega_table(a_max)) - 1
+    increments, slopes, increment_list, slope_list = _envelope_increments(
+        discharge, lambert_factor, n_table
+    )
+
+    v_out = np.empty(positions.shape)
+    if len(positions)<=_VECTORIZED_CHANNELS:
+        for channel, channel_out, v_c in zip(positions, v_out,
+                                             states.tolist()):
+            values = []
+            for position in channel.tolist():
+                position -= v_c*shift
+                if position<0:
+                    position = 0
+                i = int(position)
+                # Calculate voltage across capacitor after time dt
+                v_c = (v_c*charge_exp + increment_list[i]
+                       + slope_list[i]*(position-i))
+                values.append(v_c)
+            channel_out[:] = values
+
+    else:
+        v_c = np.array(states)
+        for step_positions, step_out in zip(positions.T, v_out.T):
+            position = step_positions - v_c*shift
+            np.maximum(position, 0, out=position)
+            i = position.astype(np.intp)
+            position -= i
+            # Calculate voltage across capacitor after time dt
+            v_c = v_c*charge_exp + increments[i] + slopes[i]*position
+            step_out[:] = v_c
+
+    return SignalBatch(batch.times, v_out,
+                       value_type=Signal.ValueTypes.voltage)
+
+
+class SurrogateEnvelopeModel:
+    """Behavioral model of an envelope circuit for a fixed time step dt (s),
+    where the output voltage in each time step is a function of the output
+    voltage in the previous step and the current input voltage. The function
+    is tabulated on a grid of previous output voltages (y_range, in V) by
+    drive voltages (input less previous output) and bilinearly interpolated.
+    Drive voltages are gridded evenly in asinh(drive/scale) over w_range,
+    giving fine resolution for drives smaller than the scale (V) as well as
+    a wide range of large drives. Values outside of the grid are clipped to
+    it. Models are fit to the responses of a circuit to a set of input
+    waveforms using the fit method, and saved to and loaded from .npz
+    files. A source string (e.g. a hash of the circuit netlist) can be
+    stored with the model to identify what it was fit to."""
+    # Version of the saved file format, increased when it changes
+    format_version = 1
+
+    def __init__(self, table, y_range, w_range, dt, scale=0.05, source=""):
+        self.table = np.array(table, dtype="float64")
+        self.y_range = tuple(y_range)
+        self.w_range = tuple(w_range)
+        self.dt = dt
+        self.scale = scale
+        self.source = source
+
+    @property
+    def _steps(self):
+        """Grid spacing of the output voltages and warped drive voltages."""
+        n_y, n_w = self.table.shape
+        return ((self.y_range[1]-self.y_range[0]) / (n_y-1),
+                (self.w_range[1]-self.w_range[0]) / (n_w-1))
+
+    @classmethod
+    def fit(cls, inputs, outputs, dt, shape=(129, 257), scale=0.05,
+            smoothing=1e-6):
+        """Fits a model to the given input and output voltage arrays (2-D,
+        one row per waveform) of a circuit with time step dt (s), where the
+        outputs start from zero voltage before the first sample. The table
+        has the given shape (output by drive voltages) and drive scale (V),
+        and is fit by least squares with the given smoothing weight on its
+        second differences to fill parts of the grid which the waveforms
+        don't reach."""
+        inputs = np.atleast_2d(inputs)
+        outputs = np.atleast_2d(outputs)
+        previous = np.zeros(outputs.shape)
+        previous[:, 1:] = outputs[:, :-1]
+        y = previous.ravel()
+        w = np.arcsinh((inputs.ravel()-y)/scale)
+        margin = 0.05 * (np.max(y)-np.min(y))
+        model = cls(np.zeros(shape), (np.min(y)-margin, np.max(y)+margin),
+                    (np.min(w), np.max(w)), dt, scale=scale)
+        n_y, n_w = shape
+        dy, dw = model._steps
+
+        # Each output is a bilinear combination of four table elements
+        y = (y-model.y_range[0]) / dy
+        w = (w-model.w_range[0]) / dw
+        j = np.clip(np.floor(y).astype(int), 0, n_y-2)
+        i = np.clip(np.floor(w).astype(int), 0, n_w-2)
+        fy = y - j
+        fw = w - i
+        rows = np.tile(np.arange(len(y)), 4)
+        columns = np.concatenate((j*n_w+i, j*n_w+i+1,
+                                  (j+1)*n_w+i, (j+1)*n_w+i+1))
+        weights = np.concatenate(((1-fy)*(1-fw), (1-fy)*fw,
+                                  fy*(1-fw), fy*fw))
+        design = scipy.sparse.csr_matrix((weights, (rows, columns)),
+                                         shape=(len(y), n_y*n_w))
+
+        # Second differences of the table along each axis
+        def second_differences(n):
+            return scipy.sparse.diags([1, -2, 1], [0, 1, 2],
+                                      shape=(n-2, n))
+        smooth = scipy.sparse.vstack((
+            scipy.sparse.kron(scipy.sparse.identity(n_y),
+                              second_differences(n_w)),
+            scipy.sparse.kron(second_differences(n_y),
+                              scipy.sparse.identity(n_w)),
+        ))
+
+        weight = smoothing * len(y) / (n_y*n_w)
+        normal = (design.T.dot(design) + weight*smooth.T.dot(smooth)).tocsc()
+        table = scipy.sparse.linalg.spsolve(
+            normal, design.T.dot(outputs.ravel())
+        )
+        model.table = table.reshape(shape)
+        return model
+
+    def save(self, filename):
+        """Saves the model to the given .npz file. The file is written under
+        a temporary name and then renamed, so other processes never see a
+        partially written file."""
+        directory = os.path.dirname(os.path.abspath(filename))
+        handle, temp_name = tempfile.mkstemp(suffix=".npz", dir=directory)
+        try:
+            with os.fdopen(handle, "wb") as f:
+                np.savez(f, table=self.table, y_range=self.y_range,
+                         w_range=self.w_range, dt=self.dt, scale=self.scale,
+                         source=self.source, version=self.format_version)
+            os.replace(temp_name, filename)
+        except BaseException:
+            os.remove(temp_name)
+            raise
+
+    @classmethod
+    def load(cls, filename):
+        """Loads a model from the given .npz file."""
+        with np.load(filename) as data:
+            version = int(data['version']) if 'version' in data else 0
+            if version!=cls.format_version:
+                raise ValueError("Surrogate model file format version "+
+                                 str(version)+" is not supported (expected "+
+                                 str(cls.format_version)+")")
+            return cls(data['table'], data['y_range'], data['w_range'],
+                       float(data['dt']), scale=float(data['scale']),
+                       source=str(data['source']))
+
+    def batch(self, batch, state=0):
+        """Applies the model to every signal of a SignalBatch, starting from
+        the given output voltage state (V) for all signals or from an array
+        with one element per signal. Returns the batch of output voltage
+        signals."""
+        if not(np.isclose(batch.dt, self.dt)):
+            raise ValueError("Surrogate model time step "+str(self.dt)+
+                             " doesn't match signal time step "+
+                             str(batch.dt))
+        n_y, n_w = self.table.shape
+        dy, dw = self._steps
+        y_min = self.y_range[0]
+        w_min = self.w_range[0]
+        states = np.broadcast_to(np.asarray(state, dtype="float64"),
+                                 (len(batch),))
+
+        v_out = np.empty(batch.values.shape)
+        if len(v_out)<=_VECTORIZED_CHANNELS:
+            table = self.table.ravel().tolist()
+            for channel, channel_out, v in zip(batch.values, v_out,
+                                               states.tolist()):
+                values = []
+                for v_in in channel.tolist():
+                    y = min(max((v-y_min)/dy, 0), n_y-1)
+                    w = (math.asinh((v_in-v)/self.scale)-w_min) / dw
+                    w = min(max(w, 0), n_w-1)
+                    j = min(int(y), n_y-2)
+                    i = min(int(w), n_w-2)
+                    y -= j
+                    w -= i
+                    k = j*n_w + i
+                    low = table[k] + (table[k+1]-table[k])*w
+                    k += n_w
+                    high = table[k] + (table[k+1]-table[k])*w
+                    v = low + (high-low)*y
+                    values.append(v)
+                channel_out[:] = values
+
+        else:
+            table = self.table.ravel()
+            v = np.array(states)
+            for step_in, step_out in zip(batch.values.T, v_out.T):
+                y = np.clip((v-y_min)/dy, 0, n_y-1)
+                w = np.arcsinh((step_in-v)/self.scale)
+                w -= w_min
+                w /= dw
+                np.clip(w, 0, n_w-1, out=w)
+                j = np.minimum(y.astype(int), n_y-2)
+                i = np.minimum(w.astype(int), n_w-2)
+                y -= j
+                w -= i
+                k = j*n_w + i
+                low = table[k] + (table[k+1]-table[k])*w
+                k += n_w
+                high = table[k] + (table[k+1]-table[k])*w
+                v = low + (high-low)*y
+                step_out[:] = v
+
+        return SignalBatch(batch.times, v_out,
+                           value_type=Signal.ValueTypes.voltage)
+
+    def __call__(self, signal, state=0):
+        """Applies the model to the given signal, starting from the given
+        output voltage state (V). Returns the output voltage signal."""
+        batch = SignalBatch(signal.time_grid, signal.values)
+        envelope = self.batch(batch, state=state).values[0]
+        return Signal(signal.time_grid, envelope,
+                      value_type=Signal.ValueTypes.voltage, copy=False)
+
+
+def surrogate_training_signals(dt, n=4096, max_voltage=3,
+                               f_band=(100e6, 400e6), count=32):
+    """Returns the designed set of input waveforms used to characterize
+    envelope circuits with time step dt (s): count signals of n samples,
+    half band-limited noise in the frequency band f_band (Hz) and half tone
+    bursts at the center of the band, with amplitudes spaced logarithmically
+    up to max_voltage (V) and clipped to it. The waveforms are the same for
+    every call with the same arguments."""
+    random_state = np.random.RandomState(0)
+    times = UniformTimes(0, dt, n)
+    t = np.asarray(times)
+    amplitudes = max_voltage * np.logspace(-3, 0, count//2)
+    signals = []
+    for amplitude in amplitudes:
+        # Noise buffer sampled at least as finely as needed by the band
+        noise_dt = NoiseBuffer.sampling_spacing(dt, f_band[1])
+        buffer = NoiseBuffer(f_band, noise_dt, int(np.ceil(n*dt/noise_dt)),
+                             rms_voltage=amplitude,
+                             random_state=random_state)
+        noise = buffer.with_times(times)
+        noise.clip(-max_voltage, max_voltage)
+        signals.append(noise)
+    center = np.mean(f_band)
+    for amplitude in amplitudes:
+        # Bursts of different lengths separated by silence, so the circuit
+        # both charges and discharges. Smooth bursts are interleaved with
+        # abruptly switched bursts of random phase, which reach the largest
+        # drive voltages
+        values = np.zeros(n)
+        for start, width in zip(np.linspace(0, 0.8, 4), [2, 5, 10, 20]):
+            t0 = t[0] + start*(t[-1]-t[0])
+            values += (amplitude*np.sin(2*np.pi*center*t)
+                       * np.exp(-((t-t0-3*width*1e-9)/(width*1e-9))**2))
+        for start in np.linspace(0, 0.9, 8):
+            t0 = t[0] + (start+0.06)*(t[-1]-t[0])
+            phase = random_state.uniform(0, 2*np.pi)
+            window = (t>=t0) & (t<t0+5e-9)
+            values[window] = amplitude*np.sin(2*np.pi*center*(t[window]-t0)
+                                              + phase)
+        signals.append(Signal(times, np.clip(values, -max_voltage,
+                                             max_voltage)))
+    return signals
+
+
+# Directory of cached surrogate models of spice circuits
+SURROGATE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".pyrex-cache",
+                                   "surrogates")
+
+# Surrogate models loaded in this process, by cache file name
+_surrogate_models = {}
+
+@functools.lru_cache(maxsize=None)
+def surrogate_filename(circuit_name, dt, max_voltage=3, shape=(129, 257),
+                       scale=0.05, smoothing=1e-6,
+                       cache_dir=SURROGATE_CACHE_DIR):
+    """Returns the cache file name of the surrogate model of the named
+    circuit for time step dt (s), fit to the surrogate training signals up
+    to max_voltage (V) with the given table shape, drive scale (V), and
+    smoothing (see SurrogateEnvelopeModel.fit). The name includes a hash of
+    these parameters, the training signals, and the file format version,
+    and is only calculated once for each set of arguments."""
+    signals = surrogate_training_signals(dt, max_voltage=max_voltage)
+    key = hashlib.sha1(repr((SurrogateEnvelopeModel.format_version,
+                             circuit_name, float(dt), float(max_voltage),
+                             tuple(shape), float(scale),
+                             float(smoothing))).encode())
+    for signal in signals:
+        key.update(np.ascontiguousarray(signal.values).tobytes())
+    return os.path.join(cache_dir, circuit_name+"_"+key.hexdigest()+".npz")
+
+def spice_surrogate(circuit_name, dt, pool=None, max_voltage=3,
+                    shape=(129, 257), scale=0.05, smoothing=1e-6,
+                    cache_dir=SURROGATE_CACHE_DIR):
+    """Returns a SurrogateEnvelopeModel of the named spice circuit (in
+    spice_circuits) for time step dt (s), fit to the surrogate training
+    signals up to max_voltage (V) with the given table shape, drive scale
+    (V), and smoothing. Models are cached in the cache directory (see
+    surrogate_filename), so the circuit is only characterized with spice (in
+    the given SpicePool if any) the first time. Cached models can be loaded
+    without PySpice. When PySpice is available, models cached for a
+    different circuit netlist are fit again."""
+    filename = surrogate_filename(circuit_name, dt, max_voltage=max_voltage,
+                                  shape=shape, scale=scale,
+                                  smoothing=smoothing, cache_dir=cache_dir)
+    if filename in _surrogate_models:
+        return _surrogate_models[filename]
+
+    model = None
+    if os.path.exists(filename):
+        model = SurrogateEnvelopeModel.load(filename)
+    if pyspice.__available__:
+        netlist = str(spice_circuits[circuit_name])
+        source = hashlib.sha1(netlist.encode()).hexdigest()
+        if model is not None and model.source!=source:
+            model = None
+    elif model is None:
+        raise ModuleNotFoundError(pyspice.__modulenotfound__)
+
+    if model is None:
+        signals = surrogate_training_signals(dt, max_voltage=max_voltage)
+        if pool is None:
+            outputs = [spice_transient(circuit_name, signal)
+                       for signal in signals]
+        else:
+            outputs = pool.transient(circuit_name, signals)
+        model = SurrogateEnvelopeModel.fit(
+            [signal.values for signal in signals],
+            [output.values for output in outputs], dt,
+            shape=shape, scale=scale, smoothing=smoothing
+        )
+        model.source = source
+        os.makedirs(cache_dir, exist_ok=True)
+        model.save(filename)
+
+    _surrogate_models[filename] = model
+    return model
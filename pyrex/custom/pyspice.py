@@ -1,7 +1,11 @@
 """Module containing setup and wrappers for PySpice module into PyREx"""
 
+import bisect
+import collections.abc
 import importlib.util
+import multiprocessing
 import numpy as np
+from pyrex.signals import UniformTimes
 
 # Check if PySpice can be imported on the current system
 # This variable can be checked before using PySpice in other modules
@@ -11,28 +15,250 @@ __modulenotfound__ = ("PySpice could not be imported. "+
                       "For details on installing PySpice, see "+
                       "https://pyspice.fabrice-salvaire.fr/installation.html")
 
+class _InputLookup:
+    """Helper class for looking up the value of a signal at any time by
+    linear interpolation (holding the first and last values outside of the
+    signal times), like np.interp but for one time at a time. Evenly spaced
+    signal times are found by index arithmetic on plain python floats, while
+    other times are found by bisection."""
+    def __init__(self, signal):
+        self.values = [float(value) for value in signal.values]
+        if hasattr(signal, "time_grid"):
+            times = signal.time_grid
+        else:
+            times = signal.times
+        grid = times
+        if not(isinstance(grid, UniformTimes)):
+            grid = UniformTimes.from_array(np.asarray(times))
+        if grid is not None and len(grid)>1:
+            self.t0 = float(grid.t0)
+            self.dt = float(grid.dt)
+            self.times = None
+        else:
+            self.times = [float(time) for time in np.asarray(times)]
+
+    def __call__(self, time):
+        values = self.values
+        if self.times is None:
+            x = (time - self.t0) / self.dt
+            if x<=0:
+                return values[0]
+            elif x>=len(values)-1:
+                return values[-1]
+            i = int(x)
+            return values[i] + (values[i+1]-values[i])*(x-i)
+
+        times = self.times
+        if len(times)==0:
+            return 0.
+        elif time<=times[0]:
+            return values[0]
+        elif time>=times[-1]:
+            return values[-1]
+        i = bisect.bisect_right(times, time) - 1
+        return values[i] + ((values[i+1]-values[i])
+                             * (time-times[i]) / (times[i+1]-times[i]))
+
+
+class SpiceCircuits(collections.abc.Mapping):
+    """Mapping of names to PySpice circuits, where each circuit is built by
+    calling its builder function (with no arguments) the first time it is
+    accessed and is cached afterwards. Takes a dictionary of builder
+    functions by name. Iterating over the names doesn't build any circuits.
+    Only the builders are pickled (e.g. when passed to worker processes), so
+    circuits already built are rebuilt as needed after unpickling."""
+    def __init__(self, builders=None):
+        self._builders = dict(builders) if builders is not None else {}
+        self._circuits = {}
+
+    def __getitem__(self, name):
+        if name not in self._circuits:
+            self._circuits[name] = self._builders[name]()
+        return self._circuits[name]
+
+    def __iter__(self):
+        return iter(self._builders)
+
+    def __len__(self):
+        return len(self._builders)
+
+    def __contains__(self, name):
+        return name in self._builders
+
+    def __getstate__(self):
+        return {"_builders": self._builders}
+
+    def __setstate__(self, state):
+        self._builders = state["_builders"]
+        self._circuits = {}
+
+
+class LazyObject:
+    """Proxy for an object which is only created, by calling the given
+    function with no arguments, the first time it's used. Calling the proxy
+    returns the object, while attribute access and assignment, item access,
+    iteration, and membership tests are passed on to the object. Keeps names
+    which used to hold eagerly created objects working."""
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_object", None)
+        object.__setattr__(self, "_created", False)
+
+    def __call__(self):
+        if not(self._created):
+            object.__setattr__(self, "_object", self._factory())
+            object.__setattr__(self, "_created", True)
+        return self._object
+
+    def __getattr__(self, name):
+        return getattr(self(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self(), name, value)
+
+    def __getitem__(self, key):
+        return self()[key]
+
+    def __iter__(self):
+        return iter(self())
+
+    def __len__(self):
+        return len(self())
+
+    def __contains__(self, item):
+        return item in self()
+
+    def __str__(self):
+        return str(self())
+
+
 if __available__:
     from PySpice.Spice.NgSpice.Shared import NgSpiceShared
     from PySpice.Spice.Netlist import Circuit
     from PySpice.Spice.Library import SpiceLibrary
     from PySpice.Unit import *
+    from pyrex.signals import Signal
 
     class NgSpiceSharedSignal(NgSpiceShared):
         """Helper class for bridging gap between PyREx Signal and
-        PySpice NgSpiceShared classes"""
+        PySpice NgSpiceShared classes. The input voltage source follows the
+        signal, which is prepared for fast lookups when it is set."""
         def __init__(self, **kwargs):
             super().__init__(**kwargs)
             self._signal = None
+            self._lookup = None
+
+        @property
+        def signal(self):
+            """Signal followed by the input voltage source."""
+            return self._signal
+
+        @signal.setter
+        def signal(self, signal):
+            self._signal = signal
+            self._lookup = _InputLookup(signal)
 
         def get_vsrc_data(self, voltage, time, node, ngspice_id):
-            self._logger.debug('ngspice_id-{} get_vsrc_data @{} node {}'.format(ngspice_id, time, node))
-            voltage[0] = np.interp(time, self._signal.times, self._signal.values)
+            self._logger.debug('ngspice_id-%s get_vsrc_data @%s node %s',
+                               ngspice_id, time, node)
+            voltage[0] = self._lookup(time)
             return 0
 
-    NGSPICE_SHARED_MASTER = NgSpiceSharedSignal()
+    _ngspice_shared = None
+
+    def ngspice_shared():
+        """Returns the NgSpiceSharedSignal instance of this process, which is
+        only created the first time it's needed."""
+        global _ngspice_shared
+        if _ngspice_shared is None:
+            _ngspice_shared = NgSpiceSharedSignal()
+        return _ngspice_shared
+
+    # Previous name of the shared instance, which was created on import
+    NGSPICE_SHARED_MASTER = LazyObject(ngspice_shared)
 
     class SpiceSignal:
-        """Class for passing PyREx Signal object into PySpice"""
-        def __init__(self, signal, shared=NGSPICE_SHARED_MASTER):
+        """Class for passing PyREx Signal object into PySpice. Uses the
+        shared ngspice instance of this process unless another is given."""
+        def __init__(self, signal, shared=None):
+            if shared is None:
+                shared = ngspice_shared()
             self.shared = shared
-            self.shared._signal = signal
+            self.shared.signal = signal
+
+
+    # Circuits and simulators of a SpicePool worker process. Each worker
+    # (started fresh, not forked) has its own ngspice_shared instance
+    _worker_circuits = {}
+    _worker_simulators = {}
+
+    def _initialize_worker(circuits):
+        """Stores the circuits available to a SpicePool worker process."""
+        global _worker_circuits
+        _worker_circuits = circuits
+        _worker_simulators.clear()
+
+    def _transient_worker(task):
+        """Runs a transient simulation of a circuit in a SpicePool worker
+        process, with the input voltage source following the given values.
+        Simulators are only created the first time each circuit is used by
+        the worker. Returns the voltage at the given node."""
+        name, times, values, node, temperature, nominal_temperature = task
+        key = (name, temperature, nominal_temperature)
+        if key not in _worker_simulators:
+            _worker_simulators[key] = _worker_circuits[name].simulator(
+                temperature=temperature,
+                nominal_temperature=nominal_temperature,
+                ngspice_shared=ngspice_shared()
+            )
+        simulator = _worker_simulators[key]
+        SpiceSignal(Signal(times-times[0], values))
+        analysis = simulator.transient(step_time=times[1]-times[0],
+                                       end_time=times[-1]-times[0])
+        return np.array(analysis.nodes[node], dtype="float64")
+
+    class SpicePool:
+        """Class for running transient simulations of circuits for many
+        signals concurrently across a pool of worker processes. Each worker
+        has its own NgSpiceSharedSignal instance and creates the simulator
+        for each circuit only once. Takes a mapping of named circuits
+        (which must be picklable, and may be a SpiceCircuits mapping so that
+        workers only build the circuits they use) and the number of worker
+        processes (defaults to the number of CPUs). Can be used as a context
+        manager to close the pool when done."""
+        def __init__(self, circuits, processes=None):
+            self.circuits = circuits
+            # Workers are spawned rather than forked so that no ngspice
+            # state is shared with the parent process
+            context = multiprocessing.get_context("spawn")
+            self._pool = context.Pool(processes,
+                                      initializer=_initialize_worker,
+                                      initargs=(self.circuits,))
+
+        def transient(self, circuit, signals, node='output', temperature=25,
+                      nominal_temperature=25):
+            """Simulates the named circuit with each of the given signals as
+            the input voltage, over the times of each signal. Returns a list
+            of the output voltage signals at the given node, in the same
+            order as the input signals."""
+            if circuit not in self.circuits:
+                raise ValueError("Circuit '"+str(circuit)+
+                                 "' not available in the pool")
+            tasks = [(circuit, np.array(signal.times), signal.values, node,
+                      temperature, nominal_temperature)
+                     for signal in signals]
+            outputs = self._pool.map(_transient_worker, tasks, chunksize=1)
+            return [Signal(signal.time_grid, output,
+                           value_type=signal.value_type, copy=False)
+                    for signal, output in zip(signals, outputs)]
+
+        def close(self):
+            """Stops the worker processes of the pool."""
+            self._pool.close()
+            self._pool.join()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            self.close()
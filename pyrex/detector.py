@@ -1,6 +1,9 @@
 """Module containing higher-level AntennaSystem and Detector classes"""
 
 import inspect
+import numpy as np
+from pyrex.internal_functions import truncate_stale
+from pyrex.signals import NoiseBuffer
 
 
 class AntennaSystem:
@@ -13,7 +16,13 @@ class AntennaSystem:
             self.antenna = antenna
             self._antenna_class = antenna.__class__
 
+        # Caches of the front-end output and trigger decisions for each
+        # antenna signal, extended as new signals arrive. The antenna signals
+        # they were calculated from are kept to detect changes to the
+        # antenna's signals list
+        self._signal_sources = []
         self._signals = []
+        self._hits = []
         self._all_waveforms = []
         self._triggers = []
 
@@ -31,39 +40,80 @@ class AntennaSystem:
 
     @property
     def is_hit(self):
-        return len(self.waveforms)>0
+        return any(self._cached_triggers())
 
     def is_hit_during(self, times):
         return self.trigger(self.full_waveform(times))
 
     @property
-    def signals(self):
+    def hit_probability(self):
+        """Probability that the antenna system is triggered by any of its
+        (front-end processed) signals once noise is added, calculated without
+        generating noise. Can be used as an event weight in place of
+        is_hit."""
+        p_miss = 1
+        for signal in self._cached_signals():
+            p_miss *= 1 - self.trigger_probability(signal)
+        return 1 - p_miss
+
+    def _cached_signals(self):
+        """Returns the cached list of front-end processed antenna signals,
+        processing any new signals and dropping any whose antenna signals
+        were removed or replaced."""
+        truncate_stale(self._signal_sources, self.antenna.signals,
+                       self._signals)
         # Process any unprocessed antenna signals
         while len(self._signals)<len(self.antenna.signals):
             signal = self.antenna.signals[len(self._signals)]
+            self._signal_sources.append(signal)
             self._signals.append(self.front_end(signal))
-        # Return envelopes of antenna signals
         return self._signals
 
-    @property
-    def waveforms(self):
-        # Process any unprocessed triggers
-        all_waves = self.all_waveforms
+    def _cached_all_waveforms(self):
+        """Returns the cached list of front-end processed antenna waveforms,
+        processing any new waveforms and dropping any (and their trigger
+        decisions) whose antenna signals were removed or replaced."""
+        truncate_stale(self._hits, self.antenna.signals,
+                       self._all_waveforms, self._triggers)
+        # Process any unprocessed antenna waveforms
+        if len(self._all_waveforms)<len(self.antenna.signals):
+            antenna_waves = self.antenna._cached_all_waveforms()
+            while len(self._all_waveforms)<len(antenna_waves):
+                i = len(self._all_waveforms)
+                self._hits.append(self.antenna.signals[i])
+                self._all_waveforms.append(self.front_end(antenna_waves[i]))
+        return self._all_waveforms
+
+    def _cached_triggers(self):
+        """Returns the cached list of trigger decisions for all antenna
+        waveforms, calculating decisions for any new waveforms."""
+        all_waves = self._cached_all_waveforms()
         while len(self._triggers)<len(all_waves):
-            waveform = all_waves[len(self._triggers)]
-            self._triggers.append(self.trigger(waveform))
+            self._triggers.append(self.trigger(all_waves[len(self._triggers)]))
+        return self._triggers
+
+    @property
+    def signals(self):
+        """Front-end processed antenna signals. The signals are copies
+        (sharing values until modified) of the cached signals, so they may be
+        modified freely."""
+        return [signal.copy() for signal in self._cached_signals()]
 
-        return [wave for wave, triggered in zip(all_waves, self._triggers)
-                if triggered]
+    @property
+    def waveforms(self):
+        """Front-end processed waveforms at each triggered antenna hit. The
+        waveforms are copies (sharing values until modified) of the cached
+        waveforms, so they may be modified freely."""
+        triggers = self._cached_triggers()
+        return [wave.copy() for wave, triggered
+                in zip(self._all_waveforms, triggers) if triggered]
 
     @property
     def all_waveforms(self):
-        # Process any unprocessed antenna waveforms
-        while len(self._all_waveforms)<len(self.antenna.signals):
-            wave = self.antenna.all_waveforms[len(self._all_waveforms)]
-            self._all_waveforms.append(self.front_end(wave))
-        # Return envelopes of antenna waveforms
-        return self._all_waveforms
+        """Front-end processed waveforms at all antenna hits, even those that
+        didn't trigger. The waveforms are copies (sharing values until
+        modified) of the cached waveforms, so they may be modified freely."""
+        return [wave.copy() for wave in self._cached_all_waveforms()]
 
     def full_waveform(self, times):
         # Process full antenna waveform
@@ -75,11 +125,22 @@ class AntennaSystem:
                                     polarization=polarization)
 
     def clear(self):
-        """Reset the antenna system to a state of having received no signals."""
+        """Reset the antenna system to a state of having received no signals.
+        Also clears the cached waveforms and trigger decisions."""
+        self._signal_sources.clear()
         self._signals.clear()
+        self._clear_waveforms()
+        self.antenna.clear()
+
+    def _clear_waveforms(self):
+        """Clears the cached waveforms and trigger decisions of the antenna
+        system and its antenna, e.g. when the noise changes, so they're
+        recalculated when next needed. The processed signals don't include
+        noise, so they're kept."""
+        self._hits.clear()
         self._all_waveforms.clear()
         self._triggers.clear()
-        self.antenna.clear()
+        self.antenna._clear_waveforms()
 
     def trigger(self, signal):
         """Antenna system trigger. Should return True or False for whether the
@@ -87,6 +148,14 @@ class AntennaSystem:
         the antenna's trigger."""
         return self.antenna.trigger(signal)
 
+    def trigger_probability(self, signal):
+        """Probability that the antenna system is triggered by the given
+        noise-free signal (after the front-end) once noise is added. By
+        default matches the antenna's trigger probability, which assumes the
+        front-end leaves the noise unchanged, so systems whose front-end
+        scales or otherwise changes the noise should override it."""
+        return self.antenna.trigger_probability(signal)
+
 
 
 class Detector:
@@ -124,6 +193,44 @@ class Detector:
         for pos in self.antenna_positions:
             self.antennas.append(antenna_class(position=pos, **kwargs))
 
+    def generate_noise(self, times=None):
+        """Generates new noise for all noisy antennas in the detector at once,
+        e.g. at the start of each event. Antennas whose noise buffers have the
+        same frequency band, spacing, and period are generated together in a
+        single 2-D inverse FFT, each with its own random stream seeded from
+        numpy.random (so seeding numpy.random reproduces it). The spacing
+        of the noise is based on the given times (which should have the
+        spacing of the signals to be received), or else on the first signal
+        received by each antenna. Antennas with neither get their random
+        stream now, but their noise is generated once the spacing of the
+        times it is needed for is known. Cached waveforms and trigger
+        decisions of the noisy antennas are cleared, so they include the new
+        noise."""
+        buffers = []
+        for ant in self.antennas:
+            # Antenna systems hold their antenna as an attribute
+            antenna = getattr(ant, "antenna", ant)
+            if not(antenna.noisy):
+                continue
+            ant._clear_waveforms()
+            # Seed each stream from numpy.random, so seeding numpy.random
+            # reproduces the noise of each call
+            seed = np.random.randint(2**32, dtype="int64")
+            random_state = np.random.RandomState(seed)
+            antenna._noise_stale = False
+            if antenna._noise_master is None:
+                if times is None and len(antenna.signals)==0:
+                    antenna._noise_random_state = random_state
+                    continue
+                antenna._noise_master = NoiseBuffer(
+                    random_state=random_state, generate=False,
+                    **antenna._noise_parameters(times)
+                )
+            else:
+                antenna._noise_master.random_state = random_state
+            buffers.append(antenna._noise_master)
+        NoiseBuffer.refresh_all(buffers)
+
     def __iter__(self):
         self._iter_counter = 0
         self._iter_max = len(self.antennas)
@@ -10,3 +10,25 @@ def normalize(vector):
         return v
     else:
         return v / mag
+
+def normalize_rows(vectors):
+    """Returns the normalized form of each row of the given 2-D array of
+    vectors. Rows with zero magnitude are left as zeros."""
+    v = np.array(vectors, dtype="float64")
+    mags = np.linalg.norm(v, axis=-1)
+    nonzero = mags!=0
+    v[nonzero] /= mags[nonzero, np.newaxis]
+    return v
+
+def truncate_stale(sources, current, *caches):
+    """Truncates the list of sources (the objects from which cached results
+    were calculated) and each of the given cache lists to the longest prefix
+    of sources which are still the same objects as the current list. Used to
+    drop results whose source objects were removed or replaced."""
+    n = 0
+    for source, obj in zip(sources, current):
+        if source is not obj:
+            break
+        n += 1
+    for cache in (sources,) + caches:
+        del cache[n:]
@@ -9,24 +9,52 @@ from pyrex.ray_tracing import PathFinder, ReflectedPathFinder
 
 class EventKernel:
     """Kernel for generation of events with a given particle generator,
-    ice model, and list of antennas."""
-    def __init__(self, generator, ice_model, antennas):
+    ice model, and list of antennas. Antennas whose paths from the event
+    vertex have the same geometry (horizontal distance, source depth, and
+    receiver depth, all within geometry_tolerance in meters) share their path
+    calculations and propagated pulses within each event. Setting
+    geometry_tolerance to None calculates every path separately."""
+    def __init__(self, generator, ice_model, antennas, geometry_tolerance=1e-6):
         self.gen = generator
         self.ice = ice_model
         self.ant_array = antennas
+        self.geometry_tolerance = geometry_tolerance
+
+    def _quantize(self, *values):
+        """Returns a hashable key for the given lengths (m), binned by the
+        geometry tolerance. Returns None if geometries shouldn't be shared."""
+        if self.geometry_tolerance is None:
+            return None
+        return tuple(int(np.round(val/self.geometry_tolerance))
+                     for val in values)
 
     def event(self):
         """Generate particle, propagate signal through ice to antennas,
         process signal at antennas, and return the original particle."""
         p = self.gen.create_particle()
         n = self.ice.index(p.vertex[2])
+        # Path existence and propagated pulses for each geometry seen so far
+        # in this event, keyed by path type and quantized geometry
+        existences = {}
+        pulses = {}
         for ant in self.ant_array:
-            pf = PathFinder(self.ice, p.vertex, ant.position)
-            rpf = ReflectedPathFinder(self.ice, p.vertex, ant.position)
+            u = np.array(ant.position) - p.vertex
+            geometry = self._quantize(np.sqrt(u[0]**2 + u[1]**2),
+                                      p.vertex[2], ant.position[2])
+
+            for path_class in [PathFinder, ReflectedPathFinder]:
+                path = path_class(self.ice, p.vertex, ant.position)
+                path_key = None if geometry is None else (path_class, geometry)
 
-            for path in [pf, rpf]:
                 # If path is invalid, skip it
-                if not(path.exists):
+                if path_key is None:
+                    exists = path.exists
+                elif path_key in existences:
+                    exists = existences[path_key]
+                else:
+                    exists = path.exists
+                    existences[path_key] = exists
+                if not(exists):
                     continue
 
                 # p.direction and k should both be unit vectors
@@ -41,14 +69,31 @@ class EventKernel:
                 if psi>np.pi/2:
                     continue
 
-                times = np.linspace(-20e-9, 80e-9, 2048, endpoint=False)
-                pulse = AskaryanSignal(times=times, energy=p.energy,
-                                       theta=psi, n=n)
+                # Rotated geometries only share a pulse if they also share the
+                # emission angle. Angle is binned by the arc length it sweeps
+                # at the antenna so the tolerance stays in meters
+                if path_key is None:
+                    pulse_key = None
+                else:
+                    pulse_key = (path_key,
+                                 self._quantize(psi*path.path_length))
+
+                if pulse_key is not None and pulse_key in pulses:
+                    pulse = pulses[pulse_key]
+                else:
+                    times = np.linspace(-20e-9, 80e-9, 2048, endpoint=False)
+                    pulse = AskaryanSignal(times=times, energy=p.energy,
+                                           theta=psi, n=n)
+
+                    path.propagate(pulse)
+                    # Dividing by path length scales Askaryan pulse properly
+                    pulse *= 1/path.path_length
 
-                path.propagate(pulse)
-                # Dividing by path length scales Askaryan pulse properly
-                pulse.values /= path.path_length
+                    if pulse_key is not None:
+                        pulses[pulse_key] = pulse
 
+                # Antennas copy the pulse when receiving, so the same pulse
+                # can be passed to each antenna sharing the geometry
                 ant.receive(pulse, origin=p.vertex, polarization=epol)
 
         return p
@@ -2,7 +2,55 @@
 Ray tracing not yet implemented."""
 
 import numpy as np
-from pyrex.internal_functions import normalize
+import scipy.fftpack
+from pyrex.internal_functions import normalize, normalize_rows
+
+
+def _adaptive_integral(integrand, tolerance, max_steps=10000):
+    """Helper function to integrate the given function over the interval
+    [0, 1] to within the given absolute tolerance. Intervals are bisected only
+    where their trapezoid and Simpson estimates disagree, so steps are
+    concentrated where the integrand changes. Supports integrands which return
+    a 2-D array (one row per point). Returns the integral and the number of
+    integrand evaluations used."""
+    edges = np.linspace(0, 1, 5)
+    values = integrand(edges)
+    lows, highs = edges[:-1], edges[1:]
+    f_lows, f_highs = values[:-1], values[1:]
+    n_evals = len(edges)
+    total = 0
+    while len(lows)>0:
+        mids = (lows + highs) / 2
+        f_mids = integrand(mids)
+        n_evals += len(mids)
+
+        widths = highs - lows
+        if np.ndim(f_mids)>1:
+            widths = widths[:,np.newaxis]
+        trapezoid = widths/2 * (f_lows + f_highs)
+        simpson = widths/6 * (f_lows + 4*f_mids + f_highs)
+        errors = np.abs(simpson - trapezoid)
+        if np.ndim(errors)>1:
+            errors = np.max(errors, axis=1)
+
+        # Accept intervals whose error is within their share of the
+        # tolerance (or all intervals once the step limit is reached)
+        done = errors <= tolerance * (highs - lows)
+        if n_evals>=max_steps:
+            done[:] = True
+        total = total + np.sum(simpson[done], axis=0)
+
+        # Split remaining intervals in half
+        split = ~done
+        lows, mids, highs = lows[split], mids[split], highs[split]
+        f_lows, f_mids, f_highs = f_lows[split], f_mids[split], f_highs[split]
+        lows = np.concatenate((lows, mids))
+        highs = np.concatenate((mids, highs))
+        f_lows = np.concatenate((f_lows, f_mids))
+        f_highs = np.concatenate((f_mids, f_highs))
+
+    return total, n_evals
+
 
 class PathFinder:
     """Class for ray tracking."""
@@ -74,13 +122,49 @@ class PathFinder:
         attens = np.exp(-dp/alens)
         return np.prod(attens, axis=0)
 
+    def adaptive_time_of_flight(self, rel_tol=1e-4, max_steps=10000):
+        """Time of flight (s) for a particle along the path, integrated with
+        steps concentrated where the index of refraction changes until the
+        relative tolerance is met. Returns the time of flight and the number
+        of steps used."""
+        z0 = self.from_point[2]
+        z1 = self.to_point[2]
+        # Index of refraction is at least 1, so the integral over the path
+        # fraction is at least the smaller endpoint index
+        tolerance = rel_tol * min(self.ice.index(z0), self.ice.index(z1))
+        integral, n_steps = _adaptive_integral(
+            lambda s: self.ice.index(z0 + s*(z1-z0)),
+            tolerance=tolerance, max_steps=max_steps
+        )
+        return integral * self.path_length / 3e8, n_steps
+
+    def adaptive_attenuation(self, f, rel_tol=1e-4, max_steps=10000):
+        """Returns the attenuation factor for a signal of frequency f (Hz)
+        traveling along the path, integrated with steps concentrated where
+        the attenuation length changes until the relative tolerance is met.
+        Supports passing a list of frequencies. Returns the attenuation and
+        the number of steps used."""
+        fa = np.abs(f)
+        z0 = self.from_point[2]
+        z1 = self.to_point[2]
+        length = self.path_length
+        if length==0:
+            return np.ones(np.shape(fa)), 0
+        # Relative error of the attenuation factor is the absolute error of
+        # its exponent (path length times the integral over the path fraction)
+        integral, n_steps = _adaptive_integral(
+            lambda s: 1 / self.ice.attenuation_length(z0 + s*(z1-z0), fa),
+            tolerance=rel_tol/length, max_steps=max_steps
+        )
+        return np.exp(-integral * length), n_steps
+
     def propagate(self, signal):
         """Applies attenuation to the signal along the path."""
         if not self.exists:
             raise RuntimeError("Cannot propagate signal along a path that "+
                                "doesn't exist")
         signal.filter_frequencies(self.attenuation)
-        signal.times += self.tof
+        signal.shift_times(self.tof)
 
 
 class ReflectedPathFinder:
@@ -164,7 +248,264 @@ class ReflectedPathFinder:
         return (self.path_1.attenuation(f, n_steps) *
                 self.path_2.attenuation(f, n_steps))
 
+    def adaptive_time_of_flight(self, rel_tol=1e-4, max_steps=10000):
+        """Time of flight (s) for a particle along the path, integrated with
+        adaptive steps until the relative tolerance is met. Returns the time
+        of flight and the number of steps used."""
+        tof_1, steps_1 = self.path_1.adaptive_time_of_flight(rel_tol,
+                                                             max_steps)
+        tof_2, steps_2 = self.path_2.adaptive_time_of_flight(rel_tol,
+                                                             max_steps)
+        return tof_1 + tof_2, steps_1 + steps_2
+
+    def adaptive_attenuation(self, f, rel_tol=1e-4, max_steps=10000):
+        """Returns the attenuation factor for a signal of frequency f (Hz)
+        traveling along the path, integrated with adaptive steps until the
+        relative tolerance is met. Supports passing a list of frequencies.
+        Returns the attenuation and the number of steps used."""
+        atten_1, steps_1 = self.path_1.adaptive_attenuation(f, rel_tol,
+                                                            max_steps)
+        atten_2, steps_2 = self.path_2.adaptive_attenuation(f, rel_tol,
+                                                            max_steps)
+        return atten_1 * atten_2, steps_1 + steps_2
+
     def propagate(self, signal):
         """Applies attenuation to the signal along the path."""
         self.path_1.propagate(signal)
         self.path_2.propagate(signal)
+
+
+
+def _broadcast_points(from_points, to_points):
+    """Helper function to broadcast arrays of from-points and to-points
+    against each other, so a single point may be shared by all paths."""
+    from_points = np.atleast_2d(np.array(from_points, dtype="float64"))
+    to_points = np.atleast_2d(np.array(to_points, dtype="float64"))
+    from_points, to_points = np.broadcast_arrays(from_points, to_points)
+    return np.array(from_points), np.array(to_points)
+
+def _propagate_batch(paths, signals):
+    """Helper function to apply the attenuation and time of flight of a batch
+    of paths to the corresponding list of signals in one set of FFTs."""
+    if not np.all(paths.exists):
+        raise RuntimeError("Cannot propagate signal along a path that "+
+                           "doesn't exist")
+    if len(signals)!=len(paths):
+        raise ValueError("Number of signals must match the number of paths")
+    if len(signals)==0:
+        return
+    n = len(signals[0].values)
+    dt = signals[0].dt
+    for signal in signals:
+        if len(signal.values)!=n or signal.dt!=dt:
+            raise ValueError("Signals propagated as a batch must have the "+
+                             "same number of values and time step")
+
+    values = np.array([signal.values for signal in signals])
+    frequencies = scipy.fftpack.fftfreq(n=n, d=dt)
+    spectra = scipy.fftpack.fft(values, axis=1)
+    filtered = np.real(scipy.fftpack.ifft(paths.attenuate(spectra, frequencies),
+                                          axis=1))
+    for signal, vals, tof in zip(signals, filtered, paths.tof):
+        signal.values = vals
+        signal.shift_times(tof)
+
+
+class PathBatch:
+    """Class for ray tracking of many paths at once. Takes arrays of
+    from-points and to-points (one row per path, or a single point shared by
+    all paths) and calculates the properties of every path in vectorized form.
+    Properties are returned as arrays with one entry (or row) per path."""
+    def __init__(self, ice_model, from_points, to_points):
+        self.from_points, self.to_points = _broadcast_points(from_points,
+                                                             to_points)
+        self.ice = ice_model
+
+    def __len__(self):
+        return len(self.from_points)
+
+    @property
+    def exists(self):
+        """Boolean array of whether each path exists based on basic total
+        internal reflection calculation."""
+        ni = self.ice.index(self.from_points[:,2])
+        nf = self.ice.index(self.to_points[:,2])
+        nr = nf / ni
+        # Where relative index is greater than 1, total internal reflection
+        # is impossible (and the critical ray is undefined)
+        with np.errstate(invalid='ignore'):
+            tir = np.sqrt(1 - nr**2)
+        return (nr > 1) | (self.emitted_ray[:,2] > tir)
+
+    @property
+    def emitted_ray(self):
+        """Directions in which rays are emitted."""
+        return normalize_rows(self.to_points - self.from_points)
+
+    @property
+    def received_ray(self):
+        """Directions from which rays are received."""
+        return self.emitted_ray
+
+    @property
+    def path_length(self):
+        """Lengths of the paths (m)."""
+        return np.linalg.norm(self.to_points - self.from_points, axis=1)
+
+    @property
+    def tof(self):
+        """Times of flight (s) for particles along the paths.
+        Calculated using default values of self.time_of_flight()"""
+        return self.time_of_flight()
+
+    def time_of_flight(self, n_steps=100):
+        """Times of flight (s) for particles along the paths."""
+        z0 = self.from_points[:,2]
+        z1 = self.to_points[:,2]
+        steps = np.linspace(0, 1, n_steps, endpoint=True)
+        zs = z0[:,np.newaxis] + (z1 - z0)[:,np.newaxis] * steps
+        u = self.to_points - self.from_points
+        rho = np.sqrt(u[:,0]**2 + u[:,1]**2)
+        integrand = self.ice.index(zs)
+        t = (np.trapz(integrand, zs, axis=1) / 3e8
+             * np.sqrt(1 + (rho / (z1 - z0))**2))
+        return np.abs(t)
+
+    def attenuation(self, f, n_steps=100):
+        """Returns the attenuation factors for a signal of frequency f (Hz)
+        traveling along each path. Supports passing a list of frequencies,
+        in which case a 2-D array is returned where each row is a single path
+        and each column is a single frequency."""
+        fa = np.abs(f)
+        # Calculate each unique frequency only once (e.g. positive and
+        # negative FFT frequencies have the same attenuation)
+        if isinstance(fa, np.ndarray):
+            fa, inverse = np.unique(fa, return_inverse=True)
+        z0 = self.from_points[:,2]
+        z1 = self.to_points[:,2]
+        dz = (z1 - z0) / n_steps
+        u = self.to_points - self.from_points
+        rho = np.sqrt(u[:,0]**2 + u[:,1]**2)
+        dr = rho / (z1 - z0) * dz
+        dp = np.sqrt(dz**2 + dr**2)
+        if isinstance(fa, np.ndarray):
+            dp = dp[:,np.newaxis]
+        # Accumulate the exponent one step at a time so memory scales with
+        # the number of paths times the number of frequencies
+        exponent = 0
+        for i in range(n_steps):
+            alens = self.ice.attenuation_length(z0 + i*dz, fa)
+            exponent = exponent + dp/alens
+        attens = np.exp(-exponent)
+        if isinstance(fa, np.ndarray):
+            return attens[:, inverse]
+        else:
+            return attens
+
+    def attenuate(self, spectra, frequencies, n_steps=100):
+        """Returns the 2-D stack of spectra (one row per path, one column per
+        frequency in Hz) with the attenuation of each path applied."""
+        return np.asarray(spectra) * self.attenuation(frequencies, n_steps)
+
+    def propagate(self, signals):
+        """Applies attenuation to each signal in the list along its
+        corresponding path. Signals must have the same number of values and
+        time step."""
+        _propagate_batch(self, signals)
+
+
+class ReflectedPathBatch:
+    """Class for ray tracking of many rays reflected off ice surface at once.
+    Takes arrays of from-points and to-points (one row per path, or a single
+    point shared by all paths)."""
+    def __init__(self, ice_model, from_points, to_points):
+        self.from_points, self.to_points = _broadcast_points(from_points,
+                                                             to_points)
+        self.ice = ice_model
+
+        self.bounce_points = self.get_bounce_points()
+
+        self.path_1 = PathBatch(ice_model=self.ice,
+                                from_points=self.from_points,
+                                to_points=self.bounce_points)
+        self.path_2 = PathBatch(ice_model=self.ice,
+                                from_points=self.bounce_points,
+                                to_points=self.to_points)
+
+    def __len__(self):
+        return len(self.from_points)
+
+    def get_bounce_points(self):
+        """Calculation of points at which signals are reflected by the ice
+        surface (z=0)."""
+        z0 = self.from_points[:,2]
+        z1 = self.to_points[:,2]
+        u = self.to_points - self.from_points
+        # x-y distance between points
+        rho = np.sqrt(u[:,0]**2 + u[:,1]**2)
+        # x-y distance to bounce point based on geometric arguments
+        distance = z0*rho / (z0+z1)
+        # x-y direction vectors
+        u_xy = np.array(u)
+        u_xy[:,2] = 0
+        directions = normalize_rows(u_xy)
+        bounce_points = self.from_points + distance[:,np.newaxis]*directions
+        bounce_points[:,2] = 0
+        return bounce_points
+
+    @property
+    def exists(self):
+        """Boolean array of whether each path exists based on whether its
+        sub-paths exist and whether it could reflect off the ice surface."""
+        # nr = nf / ni = 1 / ni
+        nr = 1 / self.ice.index(self.from_points[:,2])
+        # Check z-component of emitted ray against normalized z-component
+        # of critical ray for total internal reflection
+        # (for completeness, ice index less than 1 can't reflect)
+        with np.errstate(invalid='ignore'):
+            tir = np.sqrt(1 - nr**2)
+        surface_reflection = (nr <= 1) & (self.emitted_ray[:,2] < tir)
+        return self.path_1.exists & self.path_2.exists & surface_reflection
+
+    @property
+    def emitted_ray(self):
+        """Directions in which rays are emitted."""
+        return normalize_rows(self.bounce_points - self.from_points)
+
+    @property
+    def received_ray(self):
+        """Directions from which rays are received."""
+        return normalize_rows(self.to_points - self.bounce_points)
+
+    @property
+    def path_length(self):
+        """Lengths of the paths (m)."""
+        return self.path_1.path_length + self.path_2.path_length
+
+    @property
+    def tof(self):
+        """Times of flight (s) for particles along the paths.
+        Calculated using default values of self.time_of_flight()"""
+        return self.path_1.tof + self.path_2.tof
+
+    def time_of_flight(self, n_steps=100):
+        """Times of flight (s) for particles along the paths."""
+        return (self.path_1.time_of_flight(n_steps) +
+                self.path_2.time_of_flight(n_steps))
+
+    def attenuation(self, f, n_steps=100):
+        """Returns the attenuation factors for a signal of frequency f (Hz)
+        traveling along each path. Supports passing a list of frequencies."""
+        return (self.path_1.attenuation(f, n_steps) *
+                self.path_2.attenuation(f, n_steps))
+
+    def attenuate(self, spectra, frequencies, n_steps=100):
+        """Returns the 2-D stack of spectra (one row per path, one column per
+        frequency in Hz) with the attenuation of each path applied."""
+        return np.asarray(spectra) * self.attenuation(frequencies, n_steps)
+
+    def propagate(self, signals):
+        """Applies attenuation to each signal in the list along its
+        corresponding path. Signals must have the same number of values and
+        time step."""
+        _propagate_batch(self, signals)
@@ -1,16 +1,307 @@
 """Module containing classes for digital signal processing"""
 
+import collections
+import copy
 from enum import Enum
+from fractions import Fraction
 import numpy as np
 import scipy.signal
 import scipy.fftpack
+import scipy.special
+
+
+# Relative tolerance (in units of the time step) for treating times as evenly
+# spaced, or two evenly spaced time grids as equal
+GRID_TOLERANCE = 1e-6
+
+# Placeholder for signal times arrays not yet checked for even spacing
+_UNCHECKED = object()
+
+class UniformTimes:
+    """Class for an implicit array of n evenly spaced times starting at t0 (s)
+    with spacing dt (s). Behaves like a read-only array of the times where
+    needed (len, indexing, conversion with numpy.array) without storing them,
+    and can be passed as the times of any signal."""
+    __slots__ = ('t0', 'dt', 'n')
+
+    def __init__(self, t0, dt, n):
+        self.t0 = t0
+        self.dt = dt
+        self.n = int(n)
+
+    @classmethod
+    def from_array(cls, times):
+        """Returns a UniformTimes object matching the given times array if its
+        times are evenly spaced (within GRID_TOLERANCE of the time step),
+        otherwise returns None."""
+        times = np.asarray(times)
+        n = len(times)
+        if times.ndim!=1 or n<2:
+            return None
+        t0 = times[0]
+        dt = (times[-1]-t0) / (n-1)
+        if dt==0 or not(np.isfinite(dt)):
+            return None
+        grid = cls(t0, dt, n)
+        if np.max(np.abs(np.asarray(grid)-times)) > GRID_TOLERANCE*abs(dt):
+            return None
+        return grid
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key<0:
+                key += self.n
+            if key<0 or key>=self.n:
+                raise IndexError("index out of range for "+str(self.n)+
+                                 " times")
+            return self.t0 + self.dt*key
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype=None, copy=None):
+        times = self.t0 + self.dt*np.arange(self.n)
+        if dtype is not None:
+            times = times.astype(dtype)
+        return times
+
+    def __eq__(self, other):
+        """Grids are equal if they have the same number of times and their
+        times agree within GRID_TOLERANCE of the time step."""
+        if not(isinstance(other, UniformTimes)):
+            return NotImplemented
+        tolerance = GRID_TOLERANCE*abs(self.dt)
+        return (self.n==other.n and abs(self.t0-other.t0)<=tolerance and
+                abs(self.dt-other.dt)*max(self.n-1, 1)<=tolerance)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not(equal)
+
+    def __hash__(self):
+        return hash((self.t0, self.dt, self.n))
+
+    def __repr__(self):
+        return ("UniformTimes(t0="+repr(self.t0)+", dt="+repr(self.dt)+
+                ", n="+repr(self.n)+")")
+
+    def shifted(self, offset):
+        """Returns the grid with all times shifted by offset (s)."""
+        return UniformTimes(self.t0+offset, self.dt, self.n)
+
+
+def _shift_values(values, offset, n, interpolation="linear", half_width=8):
+    """Helper function to sample the values array at the n fractional index
+    positions offset, offset+1, offset+2, etc. Positions outside of the values
+    array are zero, and only positions inside it are calculated. Fractional
+    positions are interpolated linearly, or by a Lanczos-windowed sinc kernel
+    with the given half width for "bandlimited" interpolation. Returns the
+    index of the first calculated position and the calculated values (all
+    other positions are zero)."""
+    k = int(np.floor(offset))
+    frac = offset - k
+    # Treat positions within rounding error of a sample as on the sample
+    if frac>1-GRID_TOLERANCE:
+        k += 1
+        frac = 0
+    elif frac<GRID_TOLERANCE:
+        frac = 0
+
+    if interpolation not in ["linear", "bandlimited"]:
+        raise ValueError("Interpolation method '"+str(interpolation)+
+                         "' not supported")
+
+    # Range of new indices i whose positions i+k+frac are inside the values
+    i_min = max(0, -k)
+    i_max = min(n-1, len(values)-1-k if frac==0 else len(values)-2-k)
+    if i_max<i_min:
+        return 0, np.zeros(0)
+    start = i_min + k
+    stop = i_max + k + 1
+
+    new_values = np.zeros(i_max-i_min+1)
+    if frac==0:
+        new_values[:] = values[start:stop]
+    elif interpolation=="linear":
+        new_values[:] = ((1-frac) * values[start:stop]
+                         + frac * values[start+1:stop+1])
+    else:
+        taps = np.arange(-half_width+1, half_width+1)
+        x = frac - taps
+        kernel = np.sinc(x) * np.sinc(x/half_width)
+        kernel /= np.sum(kernel)
+        # Zero-pad so taps may reach past the ends of the values
+        padded = np.concatenate((np.zeros(half_width), values,
+                                 np.zeros(half_width)))
+        for m, h in zip(taps, kernel):
+            new_values += h * padded[start+m+half_width:stop+m+half_width]
+    return i_min, new_values
+
+
+def _frequency_responses(freq_response, n, dt):
+    """Helper function to evaluate the frequency response function at the
+    FFT frequencies of n values with spacing dt."""
+    # Use responses cached on the FFT frequency grid if the response
+    # supports it (e.g. pyrex.antenna.FrequencyResponse objects)
+    if hasattr(freq_response, "on_grid"):
+        return freq_response.on_grid(n, dt)
+
+    frequencies = scipy.fftpack.fftfreq(n=n, d=dt)
+    # Attempt to evaluate all responses in one function call
+    try:
+        return np.array(freq_response(frequencies))
+    # Otherwise evaluate responses one at a time
+    except ValueError:
+        responses = np.zeros(n)
+        for i, f in enumerate(frequencies):
+            responses[i] = freq_response(f)
+        return responses
+
+
+class _OverlapSave:
+    """Helper class for applying an FIR kernel to a stream of values by the
+    overlap-save method. Values are processed in FFTs of at least block_size
+    plus the kernel length (padded to a fast FFT length). Outputs are delayed
+    so that the value at index delay of the kernel is zero lag, and only
+    outputs whose inputs have all been received are returned."""
+    def __init__(self, kernel, block_size, delay):
+        self.kernel_length = len(kernel)
+        n_fft = scipy.fftpack.next_fast_len(block_size+self.kernel_length-1)
+        self.step = n_fft - self.kernel_length + 1
+        self.delay = delay
+        self._kernel_spectrum = scipy.fftpack.fft(kernel, n_fft)
+        self._history = np.zeros(self.kernel_length-1)
+        self._pending = np.zeros(0)
+        # Number of (delayed) outputs still to be discarded
+        self._skip = delay
+
+    def process(self, values):
+        """Adds the values to the stream and returns the outputs for as many
+        values as are available."""
+        pending = np.concatenate((self._pending, values))
+        n_blocks = len(pending)//self.step
+        outputs = []
+        for i in range(n_blocks):
+            block = np.concatenate((self._history,
+                                    pending[i*self.step:(i+1)*self.step]))
+            spectrum = scipy.fftpack.fft(block)
+            spectrum *= self._kernel_spectrum
+            outputs.append(np.real(scipy.fftpack.ifft(spectrum))
+                           [self.kernel_length-1:])
+            self._history = block[self.step:]
+        self._pending = pending[n_blocks*self.step:]
+        if len(outputs)==0:
+            return np.zeros(0)
+        output = np.concatenate(outputs)
+        skipped = min(self._skip, len(output))
+        self._skip -= skipped
+        return output[skipped:]
+
+    def flush(self, n_remaining):
+        """Ends the stream, returning the last n_remaining outputs."""
+        output = self.process(np.zeros(self.delay+self.step))
+        return output[:n_remaining]
+
+
+class StreamingFilter:
+    """Class for applying a frequency response function to a stream of values
+    with time spacing dt (s) in blocks, so memory use doesn't depend on the
+    length of the stream. The response is applied as an FIR filter made from
+    the response at the FFT frequencies of kernel_length values, by the
+    overlap-save method with FFTs of at least block_size plus kernel_length
+    values. Away from the ends of the stream the result matches
+    Signal.filter_frequencies if the impulse response of the filter is much
+    shorter than kernel_length.
+
+    Values are passed to process in chunks of any size, which returns the
+    filtered values available so far (the outputs lag the inputs by
+    kernel_length/2 values). The flush method returns the remaining values,
+    so that the outputs line up with the inputs."""
+    def __init__(self, freq_response, dt, block_size=8192, kernel_length=1025):
+        responses = _frequency_responses(freq_response, kernel_length, dt)
+        kernel = np.roll(np.real(scipy.fftpack.ifft(responses)),
+                         kernel_length//2)
+        self._stream = _OverlapSave(kernel, block_size, kernel_length//2)
+        self._n_in = 0
+        self._n_out = 0
+
+    def process(self, values):
+        """Filters the next chunk of values in the stream. Returns the
+        filtered values available so far."""
+        self._n_in += len(values)
+        output = self._stream.process(values)
+        self._n_out += len(output)
+        return output
+
+    def flush(self):
+        """Returns the remaining filtered values at the end of the stream."""
+        output = self._stream.flush(self._n_in-self._n_out)
+        self._n_out += len(output)
+        return output
+
+
+class StreamingEnvelope:
+    """Class for calculating the envelope of a stream of values in blocks, so
+    memory use doesn't depend on the length of the stream. The Hilbert
+    transform is applied as a Blackman-windowed FIR filter of kernel_length
+    values by the overlap-save method (see StreamingFilter). Away from the
+    ends of the stream the result matches Signal.envelope for signals with no
+    content below about 5/kernel_length of the sampling frequency.
+
+    Used the same way as StreamingFilter, with process and flush methods
+    returning the envelope values."""
+    def __init__(self, block_size=8192, kernel_length=1025):
+        # Odd kernel length so the kernel is centered on a value
+        kernel_length += 1 - kernel_length%2
+        half = kernel_length//2
+        n = np.arange(-half, half+1)
+        kernel = np.zeros(kernel_length)
+        odd = n%2==1
+        kernel[odd] = 2 / (np.pi * n[odd])
+        kernel *= np.blackman(kernel_length)
+        self._stream = _OverlapSave(kernel, block_size, half)
+        self._inputs = np.zeros(0)
+
+    def _envelope(self, hilbert_values):
+        """Combines the Hilbert transform values with their inputs."""
+        n = len(hilbert_values)
+        envelope = np.sqrt(self._inputs[:n]**2 + hilbert_values**2)
+        self._inputs = self._inputs[n:]
+        return envelope
+
+    def process(self, values):
+        """Calculates the envelope of the next chunk of values in the stream.
+        Returns the envelope values available so far."""
+        self._inputs = np.concatenate((self._inputs, values))
+        return self._envelope(self._stream.process(values))
+
+    def flush(self):
+        """Returns the remaining envelope values at the end of the stream."""
+        return self._envelope(self._stream.flush(len(self._inputs)))
 
 
 class Signal:
     """Base class for signals. Takes arrays of times and values
     (values array forced to size of times array by zero padding or slicing).
     Supports adding between signals with the same time values,
-    resampling the signal, and calculating the signal's envelope."""
+    resampling the signal, and calculating the signal's envelope.\n
+    Evenly spaced times (or a UniformTimes object) are stored implicitly as
+    a start time, spacing, and length, and the times array is only calculated
+    when accessed. Times arrays are only checked for even spacing once the
+    spacing is needed. Once the times array has been accessed (or if it was
+    given with copy False), the signal keeps using that array rather than an
+    implicit grid, so it may be modified in place. Assign new times or use
+    shift_times to return to an implicit grid.
+
+    If copy is False and the values array already has the length of the
+    times, the signal uses the given times and values arrays without copying
+    them. The values array is then shared with the caller until it is
+    replaced (e.g. by filtering), and in-place arithmetic operators copy it
+    before writing to it (copy-on-write). Any other in-place modification
+    of the values array is seen by the caller."""
     class ValueTypes(Enum):
         """Enum containing possible types (units) for signal values."""
         undefined = 0
@@ -18,21 +309,111 @@ class Signal:
         field = 2
         power = 3
 
-    def __init__(self, times, values, value_type=ValueTypes.undefined):
-        self.times = np.array(times)
+    def __init__(self, times, values, value_type=ValueTypes.undefined,
+                 copy=True):
+        self._set_times(times, copy=copy)
         len_diff = len(times)-len(values)
+        # Values array which is shared with the caller, if any
+        self._borrowed = None
         if len_diff>0:
             self.values = np.concatenate((values, np.zeros(len_diff)))
+        elif not(copy) and len_diff==0 and isinstance(values, np.ndarray):
+            self.values = values
+            self._borrowed = values
         else:
             self.values = np.array(values[:len(times)])
         self.value_type = value_type
 
-    def __add__(self, other):
-        """Adds two signals by adding their values at each time."""
+    @property
+    def times(self):
+        """Array of the signal's times (s)."""
+        if self._times is None:
+            self._times = np.asarray(self._grid)
+        # The array may now be modified by the caller, so the implicit grid
+        # can no longer be trusted
+        self._grid_value = None
+        return self._times
+
+    @times.setter
+    def times(self, times):
+        self._set_times(times)
+
+    def _set_times(self, times, copy=True):
+        """Sets the times of the signal, copying a times array only if copy is
+        True. Uncopied times arrays are shared with the caller, so they are
+        never replaced by an implicit grid."""
+        if isinstance(times, UniformTimes):
+            self._grid_value = times
+            self._times = None
+        elif copy:
+            self._times = np.array(times)
+            self._grid_value = _UNCHECKED
+        else:
+            self._times = np.asarray(times)
+            self._grid_value = None
+
+    @property
+    def _grid(self):
+        """UniformTimes object of the signal's times if they are evenly spaced
+        (and not shared as an array), otherwise None."""
+        if self._grid_value is _UNCHECKED:
+            self._grid_value = UniformTimes.from_array(self._times)
+            # Drop evenly spaced times in favor of the implicit grid
+            if self._grid_value is not None:
+                self._times = None
+        return self._grid_value
+
+    @_grid.setter
+    def _grid(self, grid):
+        self._grid_value = grid
+
+    @property
+    def time_grid(self):
+        """UniformTimes object describing the signal's times if they are
+        evenly spaced, otherwise the times array itself. Can be passed as the
+        times of a new signal without calculating the times array."""
+        if self._grid is not None:
+            return self._grid
+        return self.times
+
+    def shift_times(self, offset):
+        """Shifts all times of the signal by offset (s). Doesn't require
+        calculating the times array for evenly spaced times."""
+        if self._grid is not None:
+            self._grid = self._grid.shifted(offset)
+            self._times = None
+        else:
+            self._set_times(self._times + offset, copy=False)
+            self._grid_value = _UNCHECKED
+
+    def _same_times(self, other):
+        """Whether this signal and the other have the same times. Evenly
+        spaced times (including exposed times arrays which are evenly spaced)
+        are compared by start, spacing and length within GRID_TOLERANCE of
+        the time step, so rounding differences between an explicit times
+        array and an implicit grid are ignored."""
+        grids = []
+        for signal in (self, other):
+            grid = signal._grid
+            if grid is None:
+                grid = UniformTimes.from_array(signal.time_grid)
+            grids.append(grid)
+        if grids[0] is not None and grids[1] is not None:
+            return grids[0]==grids[1]
+        return np.array_equal(self.time_grid, other.time_grid)
+
+    def _window(self):
+        """Returns the index of the first possibly nonzero value and the array
+        of values from that index on which may be nonzero."""
+        return 0, self.values
+
+    def _combined_value_type(self, other):
+        """Returns the value type of the sum of this signal and the other,
+        raising an error if they can't be added."""
         if not(isinstance(other, Signal)):
             raise TypeError("Can't add object with type"
                             +str(type(other))+" to a signal")
-        if not(np.array_equal(self.times, other.times)):
+        if not(self._same_times(other)):
             raise ValueError("Can't add signals with different times")
         if (self.value_type!=self.ValueTypes.undefined and
                 other.value_type!=self.ValueTypes.undefined and
@@ -40,11 +421,14 @@ class Signal:
             raise ValueError("Can't add signals with different value types")
 
         if self.value_type==self.ValueTypes.undefined:
-            value_type = other.value_type
+            return other.value_type
         else:
-            value_type = self.value_type
+            return self.value_type
 
-        return Signal(self.times, self.values+other.values,
+    def __add__(self, other):
+        """Adds two signals by adding their values at each time."""
+        value_type = self._combined_value_type(other)
+        return Signal(self.time_grid, self.values+other.values,
                       value_type=value_type)
 
     def __radd__(self, other):
@@ -56,9 +440,45 @@ class Signal:
 
         return self
 
+    def _writable_values(self, dtype):
+        """Returns the values array, copied first if it is shared with the
+        caller who created the signal or if it can't hold the given dtype."""
+        if (self.values is self._borrowed or
+                not(np.can_cast(dtype, self.values.dtype, casting="same_kind"))):
+            self.values = np.array(self.values,
+                                   dtype=np.result_type(self.values, dtype))
+            self._borrowed = None
+        return self.values
+
+    def __iadd__(self, other):
+        """Adds the values of another signal to this signal's values in place.
+        Only the window of windowed signals is added."""
+        value_type = self._combined_value_type(other)
+        start, support = other._window()
+        values = self._writable_values(np.asarray(support).dtype)
+        values[start:start+len(support)] += support
+        self.value_type = value_type
+        return self
+
+    def __mul__(self, other):
+        """Multiplies the signal's values by a number."""
+        return Signal(self.time_grid, self.values*other,
+                      value_type=self.value_type)
+
+    def __rmul__(self, other):
+        return self.__mul__(other)
+
+    def __imul__(self, other):
+        """Multiplies the signal's values by a number in place."""
+        values = self._writable_values(np.result_type(other))
+        values *= other
+        return self
+
     @property
     def dt(self):
         """Returns the spacing of the time array, or None if invalid."""
+        if self._grid is not None:
+            return self._grid.dt
         try:
             return self.times[1]-self.times[0]
         except IndexError:
@@ -70,19 +490,171 @@ class Signal:
         analytic_signal = scipy.signal.hilbert(self.values)
         return np.abs(analytic_signal)
 
+    def streamed_envelope(self, block_size=8192, kernel_length=1025):
+        """Calculates envelope of the signal in blocks by a StreamingEnvelope
+        with the given block size and kernel length."""
+        stream = StreamingEnvelope(block_size=block_size,
+                                   kernel_length=kernel_length)
+        return np.concatenate((stream.process(self.values), stream.flush()))
+
+    def threshold_probability(self, threshold, noise_rms, f_band,
+                              time_over_threshold=0, absolute=True):
+        """Returns the probability that the signal plus gaussian noise with
+        the given rms voltage (V) and flat spectrum in the frequency band
+        f_band=[f_min,f_max] (Hz) is above the threshold, without generating
+        any noise. If absolute is True the absolute value is compared to the
+        threshold. If time_over_threshold (s) is nonzero, the values must
+        stay above the threshold for longer than that time.\n
+        The probability is calculated from the expected number of threshold
+        crossings (Rice's formula), treating crossings as independent, which
+        slightly overestimates the probability when crossings are frequent.
+        For time over threshold each crossing is weighted by the smallest
+        probability of the values being above threshold at a later time in
+        the window given the noise at the crossing, which is only a rough
+        (typically overestimated) approximation."""
+        values = self.values
+        length = int(time_over_threshold/self.dt) + 2
+        if noise_rms<=0:
+            above = np.abs(values) if absolute else values
+            above = above>threshold
+            if time_over_threshold==0:
+                return float(np.any(above))
+            runs = np.convolve(above, np.ones(length), mode='valid')
+            return float(np.any(runs>=length))
+        if time_over_threshold!=0 and length>len(values):
+            return 0.
+
+        # Rms frequency of the noise spectrum sets the rms of its derivative
+        f_min, f_max = f_band
+        f_rms = np.sqrt((f_max**2 + f_max*f_min + f_min**2) / 3)
+        slope_rms = 2*np.pi * f_rms * noise_rms
+        if len(values)>1:
+            slopes = np.gradient(values, self.dt)
+        else:
+            slopes = np.zeros(len(values))
+
+        def crossings(signal_values, signal_slopes):
+            # Rate of upward crossings of the threshold by signal plus noise
+            z = (threshold-signal_values) / noise_rms
+            r = signal_slopes / slope_rms
+            return (scipy.special.ndtr(-z), np.exp(-z**2/2)/np.sqrt(2*np.pi)
+                    * slope_rms/noise_rms
+                    * (np.exp(-r**2/2)/np.sqrt(2*np.pi)
+                       + r*scipy.special.ndtr(r)))
+
+        if time_over_threshold!=0:
+            # Noise autocorrelation at each lag within the time over threshold
+            lags = np.arange(1, length) * self.dt
+            correlations = ((np.sin(2*np.pi*f_max*lags)
+                             - np.sin(2*np.pi*f_min*lags))
+                            / (2*np.pi*(f_max-f_min)*lags))
+            correlations = np.clip(correlations, -1+1e-12, 1-1e-12)
+
+        expected = 0
+        p_initial = 0
+        for sign in ([1, -1] if absolute else [1]):
+            p_above, rate = crossings(sign*values, sign*slopes)
+            if time_over_threshold!=0:
+                # Weight each crossing by the probability of staying above
+                # threshold, taken as the smallest probability of being above
+                # at each later time given the noise at the crossing
+                n_starts = len(values) - length + 1
+                crossing_noise = threshold - sign*values[:n_starts]
+                stays = np.ones(n_starts)
+                for k, rho in enumerate(correlations, start=1):
+                    later = sign*values[k:k+n_starts] + rho*crossing_noise
+                    np.minimum(stays, scipy.special.ndtr(
+                        (later-threshold) / (noise_rms*np.sqrt(1-rho**2))
+                    ), out=stays)
+                rate = rate[:n_starts] * stays
+                p_above = p_above[:1] * stays[:1]
+            expected += np.sum(rate) * self.dt
+            p_initial += p_above[0]
+
+        # Probability of at least one crossing (or of starting above)
+        return float(1 - (1-min(p_initial, 1))*np.exp(-expected))
+
     def resample(self, n):
         """Resamples the signal into n points in the same time range."""
-        if n==len(self.times):
+        if n==len(self.values):
             return
 
-        self.times = np.linspace(self.times[0], self.times[-1], n)
+        t0 = self.time_grid[0]
+        t1 = self.time_grid[-1]
+        if n>1:
+            self.times = UniformTimes(t0, (t1-t0)/(n-1), n)
+        else:
+            self.times = [t0]
         self.values = scipy.signal.resample(self.values, n)
 
-    def with_times(self, new_times):
+    def resample_poly(self, dt, max_denominator=1000):
+        """Resamples the signal to the time step dt (s) starting at the same
+        time, using polyphase filtering (scipy.signal.resample_poly). The
+        ratio of time steps is approximated by a fraction with denominator no
+        larger than max_denominator. Unlike resample, downsampling applies an
+        anti-aliasing filter and doesn't transform the full signal."""
+        ratio = Fraction(dt/self.dt).limit_denominator(max_denominator)
+        up = ratio.denominator
+        down = ratio.numerator
+        if up==down:
+            return
+        values = scipy.signal.resample_poly(self.values, up, down)
+        self.times = UniformTimes(self.time_grid[0], self.dt*down/up,
+                                  len(values))
+        self.values = values
+
+    def digitize(self, dt=None, bits=8, full_scale=None):
+        """Returns a DigitizedSignal of this signal sampled with the time step
+        dt (s) by polyphase resampling (or at the current times if dt is None)
+        and quantized to the given number of bits. Values beyond full_scale
+        are clipped. A positive full_scale is required, so that the same
+        values are always digitized to the same codes."""
+        if full_scale is None:
+            raise ValueError("A full scale value is required to digitize"
+                             +" a signal")
+        if full_scale<=0:
+            raise ValueError("Full scale value must be positive. Given "
+                             +str(full_scale))
+        signal = Signal(self.time_grid, self.values,
+                        value_type=self.value_type, copy=False)
+        if dt is not None:
+            signal.resample_poly(dt)
+        max_code = 2**(bits-1) - 1
+        scale = full_scale / max_code
+        return DigitizedSignal(signal.time_grid, np.round(signal.values/scale),
+                               scale, bits=bits, value_type=self.value_type)
+
+    def with_times(self, new_times, interpolation="linear"):
         """Returns a signal object representing this signal with a different
-        times array. Uses numpy.iterp on values by default."""
-        new_values = np.interp(new_times, self.times, self.values,
-                               left=0, right=0)
+        times array. Uses numpy.iterp on values by default.\n
+        If the new times are evenly spaced with the same spacing as this
+        signal's times (i.e. just offset), the values are shifted by index
+        instead and only the overlapping window is calculated. Fractional
+        offsets are then interpolated linearly (identical to numpy.interp) or,
+        if interpolation is "bandlimited", by a windowed-sinc fractional
+        delay. Other new times always use linear interpolation.
+
+        Shifted signals which cover only part of the new times are returned
+        as a WindowedSignal storing only the overlapping values."""
+        if isinstance(new_times, UniformTimes):
+            new_grid = new_times
+        else:
+            new_grid = UniformTimes.from_array(new_times)
+        if (self._grid is not None and new_grid is not None and
+                self._grid.dt>0 and
+                abs(new_grid.dt-self._grid.dt)*max(self._grid.n, new_grid.n)
+                <= GRID_TOLERANCE*self._grid.dt):
+            start, values = self._window()
+            offset = (new_grid.t0-self._grid.t0) / self._grid.dt - start
+            first, new_values = _shift_values(values, offset, new_grid.n,
+                                              interpolation=interpolation)
+            if len(new_values)==new_grid.n:
+                return Signal(new_grid, new_values, value_type=self.value_type)
+            return WindowedSignal(new_grid, new_values, offset=first,
+                                  value_type=self.value_type)
+
+        new_values = np.interp(new_times, np.asarray(self.time_grid),
+                               self.values, left=0, right=0)
         return Signal(new_times, new_values, value_type=self.value_type)
 
 
@@ -96,58 +668,678 @@ class Signal:
         """Returns the FFT frequencies of the signal."""
         return scipy.fftpack.fftfreq(n=len(self.values), d=self.dt)
 
-    def filter_frequencies(self, freq_response):
-        """Applies the given frequency response function to the signal."""
+    def filter_frequencies(self, freq_response, block_size=None,
+                           kernel_length=1025):
+        """Applies the given frequency response function to the signal.
+        If block_size is given, the response is applied in blocks by a
+        StreamingFilter with the given kernel_length instead of in one FFT of
+        the whole signal."""
+        if block_size is not None:
+            stream = StreamingFilter(freq_response, self.dt,
+                                     block_size=block_size,
+                                     kernel_length=kernel_length)
+            self.values = np.concatenate((stream.process(self.values),
+                                          stream.flush()))
+            return
+
         filtered_spectrum = self.spectrum
+        filtered_spectrum *= _frequency_responses(freq_response,
+                                                  len(self.values), self.dt)
+        self.values = np.real(scipy.fftpack.ifft(filtered_spectrum))
+
+    def clip(self, a_min, a_max):
+        """Clips the signal's values to the range [a_min, a_max]."""
+        values = self._writable_values(np.result_type(a_min, a_max))
+        np.clip(values, a_min, a_max, out=values)
+
+    def copy(self):
+        """Returns a copy of the signal. The copy shares the values array with
+        this signal until either signal is modified by in-place arithmetic or
+        processing, which copies the array first (copy-on-write)."""
+        new = copy.copy(self)
+        _, values = self._window()
+        self._borrowed = values
+        new._borrowed = values
+        if self._times is not None:
+            new._times = np.array(self._times)
+        return new
+
+    def lazy(self, copy=False):
+        """Returns a LazySignal with this signal's times and values, which
+        defers further processing until its values are needed. If copy is
+        True the values array is copied, otherwise it is shared until either
+        signal is modified in place (copy-on-write)."""
+        if copy:
+            return LazySignal(self.time_grid, self.values,
+                              value_type=self.value_type, copy=True)
+        values = self.values
+        self._borrowed = values
+        return LazySignal(self.time_grid, values,
+                          value_type=self.value_type, copy=False)
+
+    def filter_sos(self, sos, state=None):
+        """Applies the digital filter given as second-order sections to the
+        signal in the time domain. Unlike filter_frequencies the filter is
+        causal with no periodic wraparound. The state of the filter from the
+        end of a previous segment of a stream (the value returned by the
+        previous call) can be given to continue filtering the stream.
+        Returns the final state of the filter."""
+        if state is None:
+            state = np.zeros((len(sos), 2))
+        self.values, state = scipy.signal.sosfilt(sos, self.values, zi=state)
+        return state
+
+
+
+class SignalBatch:
+    """Class for many signals sharing the same times array. Takes an array of
+    times and a 2-D array of values with one row per signal (rows forced to
+    size of times array by zero padding or slicing). Supports the same
+    processing as Signal objects, but applied to all signals at once along
+    the second axis of the values array."""
+    ValueTypes = Signal.ValueTypes
+
+    def __init__(self, times, values, value_type=Signal.ValueTypes.undefined):
+        self.times = np.array(times)
+        values = np.array(values, dtype="float64", ndmin=2)
+        len_diff = len(self.times)-values.shape[1]
+        if len_diff>0:
+            self.values = np.concatenate(
+                (values, np.zeros((values.shape[0], len_diff))), axis=1
+            )
+        else:
+            self.values = values[:, :len(self.times)]
+        self.value_type = value_type
+
+    @classmethod
+    def from_signals(cls, signals):
+        """Creates a batch from a list of Signal objects, which must all have
+        the same times and compatible value types."""
+        if len(signals)==0:
+            raise ValueError("Can't create a batch from zero signals")
+        value_type = Signal.ValueTypes.undefined
+        for signal in signals:
+            if not(signals[0]._same_times(signal)):
+                raise ValueError("Can't batch signals with different times")
+            if signal.value_type!=Signal.ValueTypes.undefined:
+                if (value_type!=Signal.ValueTypes.undefined and
+                        signal.value_type!=value_type):
+                    raise ValueError("Can't batch signals with different "+
+                                     "value types")
+                value_type = signal.value_type
+        return cls(signals[0].time_grid,
+                   [signal.values for signal in signals],
+                   value_type=value_type)
+
+    def to_signals(self):
+        """Returns a list of Signal objects, one for each signal in the
+        batch."""
+        return [Signal(self.times, values, value_type=self.value_type)
+                for values in self.values]
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def __getitem__(self, key):
+        """Returns the signal at the given index as a Signal object."""
+        return Signal(self.times, self.values[key], value_type=self.value_type)
+
+    def _combined_value_type(self, other):
+        """Returns the value type of the combination of this batch with
+        another signal or batch, raising an error if they are incompatible."""
+        if not(np.array_equal(self.times, other.times)):
+            raise ValueError("Can't add signals with different times")
+        if (self.value_type!=self.ValueTypes.undefined and
+                other.value_type!=self.ValueTypes.undefined and
+                self.value_type!=other.value_type):
+            raise ValueError("Can't add signals with different value types")
+
+        if self.value_type==self.ValueTypes.undefined:
+            return other.value_type
+        else:
+            return self.value_type
+
+    def __add__(self, other):
+        """Adds the values of another batch (signal by signal) or of a single
+        Signal (to every signal in the batch) at each time."""
+        if isinstance(other, SignalBatch):
+            if len(other)!=len(self):
+                raise ValueError("Can't add batches with different numbers "+
+                                 "of signals")
+            other_values = other.values
+        elif isinstance(other, Signal):
+            other_values = other.values
+        else:
+            raise TypeError("Can't add object with type"
+                            +str(type(other))+" to a signal batch")
+        value_type = self._combined_value_type(other)
+        return SignalBatch(self.times, self.values+other_values,
+                           value_type=value_type)
+
+    def __radd__(self, other):
+        """Allows for adding SignalBatch object to 0 or to a Signal."""
+        if isinstance(other, Signal):
+            return self.__add__(other)
+        if other!=0:
+            raise TypeError("unsupported operand type(s) for +: '"+
+                            str(type(other))+"' and 'SignalBatch'")
+
+        return self
 
-        # Attempt to evaluate all responses in one function call
+    def __mul__(self, other):
+        """Scales the values by a number, or each signal by the corresponding
+        element of an array with one element per signal."""
+        factor = np.asarray(other)
+        if factor.ndim==1:
+            if len(factor)!=len(self):
+                raise ValueError("Scale factors must have one element per "+
+                                 "signal in the batch")
+            factor = factor[:, np.newaxis]
+        elif factor.ndim>1:
+            raise ValueError("Scale factors must be a number or a 1-D array")
+        return SignalBatch(self.times, self.values*factor,
+                           value_type=self.value_type)
+
+    def __rmul__(self, other):
+        return self.__mul__(other)
+
+    @property
+    def dt(self):
+        """Returns the spacing of the time array, or None if invalid."""
         try:
+            return self.times[1]-self.times[0]
+        except IndexError:
+            return None
+
+    @property
+    def envelope(self):
+        """Calculates envelopes of the signals by Hilbert transform. Returns a
+        2-D array with one row per signal."""
+        analytic_signals = scipy.signal.hilbert(self.values, axis=1)
+        return np.abs(analytic_signals)
+
+    def resample(self, n):
+        """Resamples the signals into n points in the same time range."""
+        if n==len(self.times):
+            return
+
+        self.times = np.linspace(self.times[0], self.times[-1], n)
+        self.values = scipy.signal.resample(self.values, n, axis=1)
+
+    def with_times(self, new_times):
+        """Returns a batch representing these signals with a different
+        times array. Linearly interpolates values (zero outside the current
+        times), finding interpolation weights once for all signals."""
+        new_times = np.array(new_times)
+        n = len(self.times)
+        if n<2:
+            return SignalBatch(new_times, np.zeros((len(self), len(new_times))),
+                               value_type=self.value_type)
+        # Index of the left neighbor of each new time and its weight
+        idx = np.clip(np.searchsorted(self.times, new_times, side='right')-1,
+                      0, n-2)
+        left = self.times[idx]
+        weight = (new_times - left) / (self.times[idx+1] - left)
+        new_values = (self.values[:, idx] * (1-weight)
+                      + self.values[:, idx+1] * weight)
+        outside = (new_times<self.times[0]) | (new_times>self.times[-1])
+        new_values[:, outside] = 0
+        return SignalBatch(new_times, new_values, value_type=self.value_type)
+
+    @property
+    def spectrum(self):
+        """Returns the FFT spectra of the signals (one row per signal)."""
+        return scipy.fftpack.fft(self.values, axis=1)
+
+    @property
+    def frequencies(self):
+        """Returns the FFT frequencies of the signals."""
+        return scipy.fftpack.fftfreq(n=self.values.shape[1], d=self.dt)
+
+    def filter_frequencies(self, freq_response):
+        """Applies the given frequency response function to the signals.
+        The function may return a 1-D array of responses applied to every
+        signal, or a 2-D array with one row of responses per signal (e.g. the
+        attenuation function of a pyrex.ray_tracing.PathBatch)."""
+        filtered_spectra = self.spectrum
+
+        # Use responses cached on the FFT frequency grid if the response
+        # supports it (e.g. pyrex.antenna.FrequencyResponse objects)
+        if hasattr(freq_response, "on_grid"):
+            responses = freq_response.on_grid(self.values.shape[1], self.dt)
+        else:
             responses = np.array(freq_response(self.frequencies))
-        # Otherwise evaluate responses one at a time
-        except ValueError:
-            responses = np.zeros(len(filtered_spectrum))
-            for i, f in enumerate(self.frequencies):
-                responses[i] = freq_response(f)
 
-        filtered_spectrum *= responses
-        self.values = np.real(scipy.fftpack.ifft(filtered_spectrum))
+        filtered_spectra *= responses
+        self.values = np.real(scipy.fftpack.ifft(filtered_spectra, axis=1))
+
+    def threshold_trigger(self, threshold):
+        """Returns a boolean array of whether the maximum absolute value of
+        each signal is above the given threshold."""
+        return np.max(np.abs(self.values), axis=1) > threshold
+
+
+
+class WindowedSignal(Signal):
+    """Class for signals which are zero except in a window of their times.
+    Takes the array of times, the values within the window, and the index of
+    the times array at which the window starts (the window is clipped to the
+    times). Only the window of values is stored, and adding windowed signals
+    to other signals only adds within the window (overlap-add).
+
+    Adding windowed signals to other signals uses only the window, so the
+    full values array isn't built. Accessing the values array (or processing
+    the signal in place) calculates and stores the full values array, after
+    which the signal behaves like any other signal."""
+    def __init__(self, times, values, offset=0,
+                 value_type=Signal.ValueTypes.undefined, copy=True):
+        self._set_times(times, copy=copy)
+        n = len(self.time_grid)
+        offset = int(offset)
+        values = np.asarray(values, dtype="float64")
+        # Clip the window to the times array
+        start = max(offset, 0)
+        stop = min(offset+len(values), n)
+        if stop<=start:
+            start = stop = 0
+        if copy:
+            self._support = np.array(values[start-offset:stop-offset])
+            self._borrowed = None
+        else:
+            self._support = values[start-offset:stop-offset]
+            self._borrowed = self._support
+        self._offset = start
+        self.value_type = value_type
+
+    @property
+    def offset(self):
+        """Index of the times array at which the window starts."""
+        return self._offset
+
+    @property
+    def support(self):
+        """Array of the signal's values within the window."""
+        return self._support
+
+    @property
+    def values(self):
+        """Array of the signal's values (calculated and stored if
+        necessary)."""
+        n = len(self.time_grid)
+        if self._offset!=0 or len(self._support)!=n:
+            values = np.zeros(n, dtype=np.result_type(self._support,
+                                                      "float64"))
+            values[self._offset:self._offset+len(self._support)] = \
+                self._support
+            self._support = values
+            self._offset = 0
+            self._borrowed = None
+        return self._support
+
+    @values.setter
+    def values(self, values):
+        self._support = values
+        self._offset = 0
+
+    def _window(self):
+        return self._offset, self._support
+
+    def __add__(self, other):
+        """Adds two signals by adding their values at each time. Only values
+        within the window are added."""
+        value_type = self._combined_value_type(other)
+        if not(isinstance(other, WindowedSignal)):
+            values = np.array(other.values, dtype="float64")
+            values[self._offset:self._offset+len(self._support)] += \
+                self._support
+            return Signal(self.time_grid, values, value_type=value_type)
+
+        # Window of the sum covers the (non-empty) windows of both signals
+        windows = [(sig._offset, sig._support) for sig in (self, other)
+                   if len(sig._support)>0]
+        if len(windows)==0:
+            return WindowedSignal(self.time_grid, [], value_type=value_type)
+        start = min(offset for offset, support in windows)
+        stop = max(offset+len(support) for offset, support in windows)
+        window = np.zeros(stop-start)
+        for offset, support in windows:
+            window[offset-start:offset-start+len(support)] += support
+        return WindowedSignal(self.time_grid, window, offset=start,
+                              value_type=value_type)
+
+    def __radd__(self, other):
+        """Allows for adding WindowedSignal object to 0 or another signal."""
+        if isinstance(other, Signal):
+            return self.__add__(other)
+        return super().__radd__(other)
+
+    def __iadd__(self, other):
+        """Adds the values of another signal to this signal's values in place.
+        Windowed signals are added only within their windows."""
+        if not(isinstance(other, WindowedSignal)):
+            return super().__iadd__(other)
+        total = self.__add__(other)
+        self._support = total._support
+        self._offset = total._offset
+        self._borrowed = None
+        self.value_type = total.value_type
+        return self
 
+    def __mul__(self, other):
+        """Multiplies the signal's values by a number."""
+        return WindowedSignal(self.time_grid, self._support*other,
+                              offset=self._offset, value_type=self.value_type)
+
+    def __imul__(self, other):
+        """Multiplies the signal's values by a number in place."""
+        if (self._support is self._borrowed or
+                not(np.can_cast(np.result_type(other), self._support.dtype,
+                                casting="same_kind"))):
+            self._support = self._support * other
+            self._borrowed = None
+        else:
+            self._support *= other
+        return self
 
 
-class EmptySignal(Signal):
-    """Class for signal with no amplitude (all values = 0)"""
+class EmptySignal(WindowedSignal):
+    """Class for signal with no amplitude (all values = 0). No values are
+    stored until the values array is accessed."""
     def __init__(self, times, value_type=Signal.ValueTypes.undefined):
-        super().__init__(times, np.zeros(len(times)), value_type=value_type)
+        super().__init__(times, [], value_type=value_type)
 
-    def with_times(self, new_times):
+    def with_times(self, new_times, interpolation="linear"):
         """Returns a signal object representing this signal with a different
-        times array. Returns EmptySignal for new times."""
+        times array. Returns EmptySignal for new times (for any
+        interpolation)."""
         return EmptySignal(new_times, value_type=self.value_type)
 
 
+class LazySignal(Signal):
+    """Class for signals whose processing is deferred. Takes the same
+    arguments as Signal. Frequency filtering, scaling, clipping, addition,
+    and with_times are recorded rather than applied, and are only evaluated
+    when the values array is accessed. Before evaluating, adjacent frequency
+    filters are merged into a single product of responses (so only one FFT
+    and inverse FFT is needed) and scale factors are folded together or into
+    the merged filter. Other processing evaluates the signal first."""
+    def __init__(self, times, values, value_type=Signal.ValueTypes.undefined,
+                 copy=True):
+        self._operations = []
+        super().__init__(times, values, value_type=value_type, copy=copy)
+
+    @property
+    def values(self):
+        """Array of the signal's values (evaluated if necessary)."""
+        if len(self._operations)>0:
+            self._values = self._evaluate()
+            self._operations = []
+        return self._values
+
+    @values.setter
+    def values(self, values):
+        self._values = values
+        self._operations = []
+
+    def lazy(self, copy=False):
+        """Returns a copy of this signal, sharing its pending operations. If
+        copy is True the values array is copied rather than shared."""
+        if not copy:
+            return self.copy()
+        new = LazySignal(self.time_grid, self._values,
+                         value_type=self.value_type, copy=True)
+        new._operations = list(self._operations)
+        return new
+
+    def copy(self):
+        """Returns a LazySignal with the same times, values, and pending
+        operations as this signal. The values array is shared until either
+        signal is modified in place (copy-on-write)."""
+        new = LazySignal(self.time_grid, self._values,
+                         value_type=self.value_type, copy=False)
+        new._operations = list(self._operations)
+        self._borrowed = self._values
+        return new
+
+    def _evaluate(self):
+        """Applies the pending operations to the values array, merging
+        adjacent frequency filters and scale factors."""
+        values = self._values
+        i = 0
+        while i<len(self._operations):
+            kind, args = self._operations[i]
+            if kind=="filter" or kind=="scale":
+                # Combine all consecutive filters and scale factors
+                responses = None
+                factor = 1
+                while (i<len(self._operations) and
+                       self._operations[i][0] in ["filter", "scale"]):
+                    kind, args = self._operations[i]
+                    if kind=="scale":
+                        factor = factor * args[0]
+                    elif responses is None:
+                        responses = _frequency_responses(*args)
+                    else:
+                        responses = responses * _frequency_responses(*args)
+                    i += 1
+                if responses is None:
+                    values = values * factor
+                else:
+                    spectrum = scipy.fftpack.fft(values)
+                    spectrum *= responses * factor
+                    values = np.real(scipy.fftpack.ifft(spectrum))
+                continue
+            elif kind=="add":
+                start, support = args
+                values = np.array(values, dtype=np.result_type(values,
+                                                               support))
+                values[start:start+len(support)] += support
+            elif kind=="clip":
+                values = np.clip(values, *args)
+            elif kind=="times":
+                times, new_times, interpolation = args
+                values = Signal(times, values, copy=False).with_times(
+                    new_times, interpolation=interpolation
+                ).values
+            i += 1
+        return values
+
+    def filter_frequencies(self, freq_response, block_size=None,
+                           kernel_length=1025):
+        """Applies the given frequency response function to the signal when
+        the signal is evaluated. Filtering in blocks (if block_size is given)
+        is applied immediately."""
+        if block_size is not None:
+            super().filter_frequencies(freq_response, block_size=block_size,
+                                       kernel_length=kernel_length)
+            return
+        self._operations.append(("filter",
+                                 (freq_response, len(self.time_grid),
+                                  self.dt)))
+
+    def clip(self, a_min, a_max):
+        """Clips the signal's values to the range [a_min, a_max] when the
+        signal is evaluated."""
+        self._operations.append(("clip", (a_min, a_max)))
+
+    def __add__(self, other):
+        """Adds two signals when the signal is evaluated."""
+        value_type = self._combined_value_type(other)
+        new = self.copy()
+        start, support = other._window()
+        new._operations.append(("add", (start, np.array(support))))
+        new.value_type = value_type
+        return new
+
+    def __radd__(self, other):
+        """Allows for adding LazySignal object to 0 or another signal."""
+        if isinstance(other, Signal):
+            return self.__add__(other)
+        return super().__radd__(other)
+
+    def __iadd__(self, other):
+        """Adds another signal to this signal when it is evaluated."""
+        self.value_type = self._combined_value_type(other)
+        start, support = other._window()
+        self._operations.append(("add", (start, np.array(support))))
+        return self
+
+    def __mul__(self, other):
+        """Multiplies the signal's values by a number when the signal is
+        evaluated."""
+        new = self.copy()
+        new._operations.append(("scale", (other,)))
+        return new
+
+    def __imul__(self, other):
+        """Multiplies the signal's values by a number when the signal is
+        evaluated."""
+        self._operations.append(("scale", (other,)))
+        return self
+
+    def with_times(self, new_times, interpolation="linear"):
+        """Returns a LazySignal representing this signal with a different
+        times array, with the same interpolation as Signal.with_times."""
+        if isinstance(new_times, UniformTimes):
+            new_grid = new_times
+        else:
+            new_grid = UniformTimes.from_array(new_times)
+        new = self.copy()
+        new._operations.append(("times", (self.time_grid, new_times,
+                                          interpolation)))
+        new._set_times(new_grid if new_grid is not None else new_times)
+        return new
+
+
+class DigitizedSignal(Signal):
+    """Class for signals quantized by a digitizer. Takes the array of times,
+    the array of integer ADC codes, and the scale factor which converts codes
+    to values (values = codes * scale), and the number of bits of the
+    digitizer. Codes beyond the range of the bits saturate at the lowest or
+    highest code. Only the codes are stored, in the smallest integer type
+    which holds the bits (e.g. int8 for 8-bit codes). The values array is
+    calculated from the codes when accessed and is read-only; assigning new
+    values quantizes them with the same scale factor and bits."""
+    def __init__(self, times, codes, scale, bits=8,
+                 value_type=Signal.ValueTypes.undefined):
+        self.times = times
+        self.scale = scale
+        self.bits = bits
+        self._borrowed = None
+        n = len(self.time_grid)
+        codes = np.asarray(codes)
+        if len(codes)<n:
+            codes = np.concatenate((codes, np.zeros(n-len(codes))))
+        self.codes = self._compact(codes[:n])
+        self.value_type = value_type
+
+    def _compact(self, codes):
+        """Returns the codes saturated to the range of the bits, in the
+        smallest integer type which holds the bits."""
+        max_code = 2**(self.bits-1) - 1
+        codes = np.clip(codes, -max_code-1, max_code)
+        for dtype in ["int8", "int16", "int32"]:
+            if max_code<=np.iinfo(dtype).max:
+                return codes.astype(dtype)
+        return codes.astype("int64")
+
+    def copy(self):
+        """Returns a copy of the signal. The codes array is shared, since it
+        is replaced rather than modified when the signal is processed."""
+        new = copy.copy(self)
+        if self._times is not None:
+            new._times = np.array(self._times)
+        return new
+
+    @property
+    def values(self):
+        """Array of the signal's values, calculated from the codes."""
+        values = self.codes * self.scale
+        values.flags.writeable = False
+        return values
+
+    @values.setter
+    def values(self, values):
+        self.codes = self._compact(np.round(np.asarray(values)/self.scale))
+
+    def __iadd__(self, other):
+        """Adds the values of another signal and quantizes the result."""
+        value_type = self._combined_value_type(other)
+        self.values = self.values + other.values
+        self.value_type = value_type
+        return self
+
+    def __imul__(self, other):
+        """Multiplies the values by a number and quantizes the result."""
+        self.values = self.values * other
+        return self
+
+    def clip(self, a_min, a_max):
+        """Clips the signal's values to the range [a_min, a_max]."""
+        self.values = np.clip(self.values, a_min, a_max)
+
+    def with_times(self, new_times, interpolation="linear"):
+        """Returns a signal object representing this signal with a different
+        times array. If the new times are these times offset by a whole
+        number of time steps, the codes are shifted and the result is still
+        a DigitizedSignal. Otherwise the same as Signal.with_times."""
+        if isinstance(new_times, UniformTimes):
+            new_grid = new_times
+        else:
+            new_grid = UniformTimes.from_array(new_times)
+        if (self._grid is not None and new_grid is not None and
+                self._grid.dt>0 and
+                abs(new_grid.dt-self._grid.dt)*max(self._grid.n, new_grid.n)
+                <= GRID_TOLERANCE*self._grid.dt):
+            offset = (new_grid.t0-self._grid.t0) / self._grid.dt
+            k = int(np.round(offset))
+            if abs(offset-k)<GRID_TOLERANCE:
+                first, codes = _shift_values(self.codes, k, new_grid.n)
+                new_codes = np.zeros(new_grid.n, dtype=self.codes.dtype)
+                new_codes[first:first+len(codes)] = codes
+                return DigitizedSignal(new_grid, new_codes, self.scale,
+                                       bits=self.bits,
+                                       value_type=self.value_type)
+        return super().with_times(new_times, interpolation=interpolation)
+
+
 class FunctionSignal(Signal):
     """Class for signals generated by a function"""
     def __init__(self, times, function, value_type=Signal.ValueTypes.undefined):
-        self.times = np.array(times)
+        self.times = times
         self.function = function
+        # Evaluate on a separate times array so the implicit grid is kept
+        times = np.asarray(self.time_grid)
         # Attempt to evaluate all values in one function call
         try:
-            values = self.function(self.times)
+            values = self.function(times)
         # Otherwise evaluate values one at a time
         except (ValueError, TypeError):
             values = []
-            for t in self.times:
+            for t in times:
                 values.append(self.function(t))
 
-        super().__init__(times, values, value_type=value_type)
+        super().__init__(self.time_grid, values, value_type=value_type)
 
-    def with_times(self, new_times):
+    def with_times(self, new_times, interpolation="linear"):
         """Returns a signal object representing this signal with a different
         times array. Leverages knowledge of the function to properly
-        interpolate and extrapolate."""
+        interpolate and extrapolate, so the interpolation is ignored."""
         return FunctionSignal(new_times, self.function,
                               value_type=self.value_type)
 
+    def __iadd__(self, other):
+        """Adds the values of another signal. The result no longer follows
+        the function, so it is returned as a new Signal object."""
+        new = Signal(self.time_grid, self.values, value_type=self.value_type)
+        new += other
+        return new
+
+    def __imul__(self, other):
+        """Multiplies the values by a number. The result no longer follows
+        the function, so it is returned as a new Signal object."""
+        return self * other
+
 
 
 class SlowAskaryanSignal(Signal):
@@ -510,3 +1702,158 @@ class ThermalNoise(FunctionSignal):
             return values
 
         super().__init__(times, function=f, value_type=self.ValueTypes.voltage)
+
+
+
+class NoiseBuffer:
+    """Class for a periodic stream of band-limited noise stored in a ring
+    buffer of n samples with time spacing dt (s), so that the noise over any
+    times is found by slicing (or interpolating) the buffer in time
+    proportional to the number of times requested. The noise has a flat
+    spectrum in the frequency band f_band=[f_min,f_max] (Hz) with random
+    phases, and the given RMS voltage (V), or the Johnson noise RMS for the
+    given temperature (K) and resistance (ohms). The noise repeats with a
+    period of n*dt, and the refresh method generates a new realization.
+    Random phases are drawn from the given numpy RandomState if provided
+    (otherwise from numpy.random), and the noise isn't generated until
+    refresh is called if generate is False.
+    Returned signal values are voltages (V)."""
+    # Number of spectrum samples transformed at once by refresh_all
+    _chunk_samples = 2**18
+
+    def __init__(self, f_band, dt, n, rms_voltage=None, temperature=None,
+                 resistance=None, random_state=None, generate=True):
+        self.f_min, self.f_max = f_band
+        self.dt = dt
+        self.n = n
+        if rms_voltage is not None:
+            self.rms = rms_voltage
+        elif temperature is not None and resistance is not None:
+            # RMS voltage = sqrt(4 * kB * T * R * bandwidth)
+            self.rms = np.sqrt(4 * 1.38e-23 * temperature * resistance
+                               * (self.f_max - self.f_min))
+        else:
+            raise ValueError("Either RMS voltage or temperature and resistance"+
+                             " must be provided to calculate noise amplitude")
+        self.random_state = random_state
+        self.values = None
+        if generate:
+            self.refresh()
+
+    @property
+    def period(self):
+        """Period (s) after which the noise repeats."""
+        return self.n * self.dt
+
+    @staticmethod
+    def sampling_spacing(dt, f_max):
+        """Returns the spacing (s) at which to sample noise up to frequency
+        f_max (Hz) for windows with spacing dt (s). The spacing divides dt a
+        whole number of times, so windows are strided slices of the buffer,
+        and samples at least 2.5 times f_max, so the band isn't aliased onto
+        the Nyquist frequency when dt is coarse."""
+        return dt / int(np.ceil(2.5*f_max*dt))
+
+    def _in_band(self):
+        """Returns a boolean array of which FFT frequencies of the buffer are
+        in the frequency band."""
+        freqs = np.fft.rfftfreq(self.n, d=self.dt)
+        return (freqs>=self.f_min) & (freqs<self.f_max) & (freqs>0)
+
+    def _phases(self, count):
+        """Returns count random phases from the buffer's random stream."""
+        rng = np.random if self.random_state is None else self.random_state
+        return rng.rand(count) * 2*np.pi
+
+    def refresh(self):
+        """Fills the buffer with a new realization of the noise."""
+        NoiseBuffer.refresh_all([self])
+
+    @staticmethod
+    def refresh_all(buffers):
+        """Fills each of the given buffers with a new realization of its
+        noise. Buffers with the same frequency band, spacing, and length are
+        generated together in a single 2-D inverse FFT, with the phases of
+        each drawn from its own random stream."""
+        groups = collections.OrderedDict()
+        for buffer in buffers:
+            key = (buffer.f_min, buffer.f_max, buffer.dt, buffer.n)
+            groups.setdefault(key, []).append(buffer)
+
+        for group in groups.values():
+            in_band = group[0]._in_band()
+            count = np.count_nonzero(in_band)
+            # Transform the group in chunks of rows so the working spectra
+            # stay small enough to remain in cache for large detectors
+            chunk = max(1, NoiseBuffer._chunk_samples // len(in_band))
+            for start in range(0, len(group), chunk):
+                rows = group[start:start+chunk]
+                phases = np.empty((len(rows), count))
+                for i, buffer in enumerate(rows):
+                    phases[i] = buffer._phases(count)
+                spectra = np.zeros((len(rows), len(in_band)),
+                                   dtype="complex128")
+                spectra[:, in_band] = np.exp(1j*phases)
+                all_values = np.fft.irfft(spectra, n=group[0].n, axis=1)
+                # Normalize each row to its rms voltage
+                rms = np.sqrt(np.einsum('ij,ij->i', all_values, all_values)
+                              / all_values.shape[1])
+                scales = np.array([buffer.rms for buffer in rows])
+                scales = np.divide(scales, rms, out=np.zeros(len(rows)),
+                                   where=rms>0)
+                all_values *= scales[:, np.newaxis]
+                for buffer, values in zip(rows, all_values):
+                    buffer.values = values
+
+    @classmethod
+    def batch(cls, count, f_band, dt, n, rms_voltage=None, temperature=None,
+              resistance=None):
+        """Returns a list of count independent noise buffers with the same
+        parameters, generated together in one 2-D inverse FFT. Each buffer
+        gets its own random stream, seeded from numpy.random."""
+        seeds = np.random.randint(2**32, size=count, dtype="int64")
+        buffers = [cls(f_band, dt, n, rms_voltage=rms_voltage,
+                       temperature=temperature, resistance=resistance,
+                       random_state=np.random.RandomState(seed),
+                       generate=False)
+                   for seed in seeds]
+        cls.refresh_all(buffers)
+        return buffers
+
+    def with_times(self, times):
+        """Returns the noise signal over the given times. Evenly spaced times
+        with a spacing which is a whole multiple of the buffer spacing are
+        sliced from the buffer (with linear interpolation for times between
+        samples), while other times are interpolated from the buffer."""
+        if isinstance(times, UniformTimes):
+            grid = times
+        else:
+            times = np.asarray(times)
+            grid = UniformTimes.from_array(times)
+        stride = 0 if grid is None else int(np.round(grid.dt/self.dt))
+        if (stride>=1 and
+                abs(grid.dt-stride*self.dt)*max(grid.n, self.n)
+                <= GRID_TOLERANCE*self.dt):
+            offset = grid.t0 / self.dt
+            k = int(np.round(offset))
+            frac = offset - k
+            if abs(frac)<GRID_TOLERANCE:
+                frac = 0
+            elif frac<0:
+                k -= 1
+                frac += 1
+            indices = k + stride*np.arange(grid.n)
+            values = np.take(self.values, indices, mode="wrap")
+            if frac!=0:
+                values = ((1-frac) * values
+                          + frac * np.take(self.values, indices+1,
+                                           mode="wrap"))
+            return Signal(grid, values, value_type=Signal.ValueTypes.voltage,
+                          copy=False)
+
+        times = np.asarray(times)
+        buffer_times = np.arange(self.n) * self.dt
+        values = np.interp(times, buffer_times, self.values,
+                           period=self.period)
+        return Signal(times if grid is None else grid, values,
+                      value_type=Signal.ValueTypes.voltage, copy=False)
@@ -1,6 +1,7 @@
 """Tests of timing performance for different pieces of the pyrex package"""
 
 import timeit
+import tracemalloc
 import numpy as np
 from scipy.special import lambertw
 import collections
@@ -916,6 +917,305 @@ def test_antenna_noise_generation():
                      use_globals={"antenna2": antenna2})
 
 
+def allocation_test(function, title):
+    print(title)
+    # Restart tracing to reset the peak (tracemalloc.reset_peak needs
+    # python 3.9)
+    tracemalloc.stop()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    function()
+    end, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("  ", round((peak-start)/1e6, 3), " MB peak, ",
+          round((end-start)/1e6, 3), " MB retained", sep="")
+    return peak-start
+
+
+def test_signal_allocations():
+    from pyrex.custom.irex import IREXAntennaSystem
+    times = np.linspace(-20e-9, 80e-9, 2048, endpoint=False)
+    pulse = pyrex.AskaryanSignal(times=times, energy=1e8, theta=np.radians(45))
+    pulse.values /= 1000
+    long_times = pyrex.UniformTimes(-1e-6, times[1]-times[0], 100000)
+    antenna = pyrex.DipoleAntenna(name="ant", position=(0,0,0),
+                                  center_frequency=250e6, bandwidth=300e6,
+                                  resistance=100, effective_height=1,
+                                  trigger_threshold=0, noisy=False)
+    front_end = IREXAntennaSystem(name="ant", position=(0,0,0),
+                                  trigger_threshold=0, noisy=False)
+
+    def copying_path():
+        # Copies made before in-place operators and no-copy construction
+        antenna.signals.clear()
+        for _ in range(10):
+            copy = pyrex.Signal(pulse.times, pulse.values,
+                                value_type=pyrex.Signal.ValueTypes.voltage)
+            antenna.apply_response(copy)
+            copy.values = copy.values * antenna.efficiency
+            antenna.signals.append(copy)
+        waveform = pyrex.Signal(np.array(long_times),
+                                np.zeros(len(long_times)))
+        for signal in antenna.signals:
+            waveform = waveform + signal.with_times(np.array(long_times))
+        amplified = np.clip(waveform.values*front_end.amplification,
+                            a_min=-front_end.amplifier_clipping,
+                            a_max=front_end.amplifier_clipping)
+        return pyrex.Signal(waveform.times, amplified)
+
+    def in_place_path():
+        antenna.signals.clear()
+        for _ in range(10):
+            antenna.receive(pulse)
+        waveform = antenna.full_waveform(long_times)
+        amplified = waveform.values*front_end.amplification
+        np.clip(amplified, a_min=-front_end.amplifier_clipping,
+                a_max=front_end.amplifier_clipping, out=amplified)
+        return pyrex.Signal(waveform.time_grid, amplified, copy=False)
+
+    allocation_test(copying_path, "receive, sum and clip with copies")
+    allocation_test(in_place_path, "receive, sum and clip in place")
+
+    performance_test("copying_path()", number=10,
+                     use_globals={"copying_path": copying_path})
+    performance_test("in_place_path()", number=10,
+                     use_globals={"in_place_path": in_place_path})
+
+
+def test_envelope_model():
+    from pyrex.custom.irex.frontends import (basic_envelope_model,
+                                             basic_envelope_model_batch)
+    times = np.linspace(0, 2048e-9, 4096, endpoint=False)
+    values = np.clip(np.random.normal(scale=0.5, size=(16, 4096)), -3, 3)
+    batch = pyrex.SignalBatch(times, values)
+    signal = batch[0]
+    single = pyrex.SignalBatch(times, values[:1])
+    performance_test("basic_envelope_model(signal)", number=10,
+                     use_globals={"basic_envelope_model":
+                                  basic_envelope_model,
+                                  "signal": signal})
+    performance_test("basic_envelope_model_batch(single)", number=10,
+                     use_globals={"basic_envelope_model_batch":
+                                  basic_envelope_model_batch,
+                                  "single": single})
+    performance_test("basic_envelope_model_batch(batch)", number=10,
+                     use_globals={"basic_envelope_model_batch":
+                                  basic_envelope_model_batch,
+                                  "batch": batch},
+                     alternate_title="basic_envelope_model_batch "
+                                     +"(16 channels)")
+
+
+def test_surrogate_envelope():
+    from pyrex.custom.irex.frontends import (basic_envelope_model,
+                                             SurrogateEnvelopeModel,
+                                             surrogate_training_signals)
+    dt = 0.5e-9
+    training = surrogate_training_signals(dt)
+    responses = [basic_envelope_model(signal) for signal in training]
+    inputs = [s.values for s in training]
+    outputs = [r.values for r in responses]
+    model = SurrogateEnvelopeModel.fit(inputs, outputs, dt)
+    performance_test("SurrogateEnvelopeModel.fit(inputs, outputs, dt)",
+                     number=1,
+                     use_globals={"SurrogateEnvelopeModel":
+                                  SurrogateEnvelopeModel,
+                                  "inputs": inputs, "outputs": outputs,
+                                  "dt": dt})
+
+    # Compare the surrogate to the model it was fit to on fresh noise
+    times = pyrex.UniformTimes(0, dt, 4096)
+    for rms in [0.01, 0.1, 0.5]:
+        noise = pyrex.NoiseBuffer((100e6, 400e6), dt/2, 8192,
+                                  rms_voltage=rms).with_times(times)
+        noise.clip(-3, 3)
+        reference = basic_envelope_model(noise).values
+        error = np.max(np.abs(model(noise).values-reference))
+        print("Noise rms", rms, "V: max error", error, "V of",
+              np.max(reference), "V")
+        assert error < 1e-2*np.max(reference)
+
+    signal = noise
+    batch = pyrex.SignalBatch(np.asarray(times),
+                              np.array([s.values for s in training]))
+    performance_test("basic_envelope_model(signal)", number=10,
+                     use_globals={"basic_envelope_model":
+                                  basic_envelope_model,
+                                  "signal": signal})
+    performance_test("model(signal)", number=10,
+                     use_globals={"model": model, "signal": signal},
+                     alternate_title="SurrogateEnvelopeModel(signal)")
+    performance_test("model.batch(batch)", number=10,
+                     use_globals={"model": model, "batch": batch},
+                     alternate_title="SurrogateEnvelopeModel.batch "
+                                     +"(32 channels)")
+
+
+def test_spice_pool(processes=4):
+    from pyrex.custom.irex import IREXAntennaSystem
+    from pyrex.custom.irex.frontends import spice_pool
+    times = np.linspace(0, 200e-9, 2001)
+    signals = [pyrex.ThermalNoise(times, f_band=(100e6, 400e6),
+                                  rms_voltage=0.1*(i+1))
+               for i in range(16)]
+    serial = IREXAntennaSystem(name="ant", position=(0,0,-100),
+                               trigger_threshold=0,
+                               envelope_method="spice basic")
+    with spice_pool(processes) as pool:
+        parallel = IREXAntennaSystem(name="ant", position=(0,0,-100),
+                                     trigger_threshold=0,
+                                     envelope_method="spice basic",
+                                     spice_pool=pool)
+        for envelope, expected in zip(parallel.make_envelopes(signals),
+                                      serial.make_envelopes(signals)):
+            assert np.allclose(envelope.values, expected.values)
+
+        performance_test("serial.make_envelopes(signals)", number=1,
+                         use_globals={"serial": serial, "signals": signals})
+        performance_test("parallel.make_envelopes(signals)", number=1,
+                         use_globals={"parallel": parallel,
+                                      "signals": signals},
+                         alternate_title="parallel.make_envelopes(signals) "
+                                         +"("+str(processes)+" processes)")
+
+
+def test_vsrc_lookup():
+    from pyrex.custom import pyspice
+    times = np.linspace(0, 200e-9, 2001)
+    noise = pyrex.ThermalNoise(times, f_band=(100e6, 400e6), rms_voltage=1)
+    signal = pyrex.Signal(times, noise.values)
+    lookup = pyspice._InputLookup(signal)
+    performance_test("np.interp(101.3e-9, signal.times, signal.values)",
+                     number=10000, setup="import numpy as np",
+                     use_globals={"signal": signal})
+    performance_test("lookup(101.3e-9)", number=10000,
+                     use_globals={"lookup": lookup})
+
+    if not(pyspice.__available__):
+        return
+    from pyrex.custom.irex.frontends import spice_circuits
+
+    class InterpNgSpiceSharedSignal(pyspice.NgSpiceShared):
+        # Previous callback interpolating over the full signal every call
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self._signal = None
+
+        def get_vsrc_data(self, voltage, time, node, ngspice_id):
+            voltage[0] = np.interp(time, self._signal.times,
+                                   self._signal.values)
+            return 0
+
+    interp_shared = InterpNgSpiceSharedSignal()
+    interp_shared._signal = signal
+    lookup_shared = pyspice.ngspice_shared()
+    lookup_shared.signal = signal
+
+    def transient(shared):
+        simulator = spice_circuits['basic'].simulator(
+            temperature=25, nominal_temperature=25, ngspice_shared=shared
+        )
+        return simulator.transient(step_time=times[1]-times[0],
+                                   end_time=times[-1])
+
+    interp_output = np.array(transient(interp_shared).output)
+    lookup_output = np.array(transient(lookup_shared).output)
+    assert np.allclose(interp_output, lookup_output)
+
+    performance_test("transient(interp_shared)", number=10,
+                     use_globals={"transient": transient,
+                                  "interp_shared": interp_shared})
+    performance_test("transient(lookup_shared)", number=10,
+                     use_globals={"transient": transient,
+                                  "lookup_shared": lookup_shared})
+
+
+def test_spice_lazy_import():
+    import subprocess
+    import sys
+    from pyrex.custom import pyspice
+    built = []
+    def builder():
+        built.append("circuit")
+        return "circuit"
+    circuits = pyspice.SpiceCircuits({"circuit": builder})
+    assert list(circuits)==["circuit"] and "circuit" in circuits
+    assert len(built)==0
+    assert circuits["circuit"]=="circuit" and circuits["circuit"]=="circuit"
+    assert len(built)==1
+
+    # Import in fresh interpreters, where nothing has been cached
+    performance_test("subprocess.check_call([sys.executable, '-c', "
+                     +"'import pyrex.custom.irex'])", number=5,
+                     use_globals={"subprocess": subprocess, "sys": sys},
+                     alternate_title="import pyrex.custom.irex")
+
+
+def test_irex_warm_start():
+    from pyrex.custom.irex import IREXAntennaSystem
+    times = np.linspace(-20e-9, 80e-9, 2048, endpoint=False)
+    pulse = pyrex.AskaryanSignal(times=times, energy=1e8,
+                                 theta=np.radians(45))
+    doubled = IREXAntennaSystem(name="ant", position=(0,0,-100),
+                                trigger_threshold=0, amplification=1000,
+                                warm_start=False)
+    warm = IREXAntennaSystem(name="ant", position=(0,0,-100),
+                             trigger_threshold=0, amplification=1000,
+                             warm_start=True)
+
+    doubled.receive(pulse)
+    warm.receive(pulse)
+
+    def process(antenna_system):
+        # Reprocess the front-end (with the same noise)
+        antenna_system._hits.clear()
+        antenna_system._all_waveforms.clear()
+        return antenna_system.all_waveforms
+
+    performance_test("process(doubled)", number=10,
+                     use_globals={"process": process, "doubled": doubled})
+    performance_test("process(warm)", number=10,
+                     use_globals={"process": process, "warm": warm})
+
+
+def test_tot_trigger():
+    from pyrex.custom.irex.antenna import time_over_threshold_trigger
+    def loop_trigger(times, values, threshold, time_over_threshold):
+        # Previous sample-by-sample implementation, for comparison
+        imax = len(times)
+        i = 0
+        while i<imax:
+            j = i
+            while i<imax-1 and values[i]>threshold:
+                i += 1
+            if i!=j:
+                time = times[i]-times[j]
+                if time>time_over_threshold:
+                    return True
+            i += 1
+        return False
+
+    times = np.linspace(0, 2048e-9, 4096, endpoint=False)
+    envelopes = np.abs(np.random.normal(size=(64, 4096)))
+    envelope = envelopes[0]
+    performance_test("loop_trigger(times, envelope, 1.5, 1.2e-9)",
+                     number=100,
+                     use_globals={"loop_trigger": loop_trigger,
+                                  "times": times, "envelope": envelope})
+    performance_test("time_over_threshold_trigger(times, envelope, "
+                     +"1.5, 1.2e-9)", number=100,
+                     use_globals={"time_over_threshold_trigger":
+                                  time_over_threshold_trigger,
+                                  "times": times, "envelope": envelope})
+    performance_test("time_over_threshold_trigger(times, envelopes, "
+                     +"1.5, 1.2e-9)", number=100,
+                     use_globals={"time_over_threshold_trigger":
+                                  time_over_threshold_trigger,
+                                  "times": times, "envelopes": envelopes},
+                     alternate_title="time_over_threshold_trigger "
+                                     +"(64 channels)")
+
+
 if __name__ == '__main__':
     # test_EventKernel_event(1e6)
     # print()
@@ -941,4 +1241,18 @@ if __name__ == '__main__':
 
     # test_noise_generation()
 
-    test_antenna_noise_generation()
+    # test_antenna_noise_generation()
+
+    # test_signal_allocations()
+
+    # test_tot_trigger()
+
+    # test_envelope_model()
+
+    # test_irex_warm_start()
+
+    # test_spice_pool()
+
+    # test_vsrc_lookup()
+    # test_surrogate_envelope()
+    test_spice_lazy_import()
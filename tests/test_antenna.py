@@ -2,11 +2,13 @@
 
 import pytest
 
-from pyrex.antenna import Antenna, DipoleAntenna
-from pyrex.signals import Signal
+from pyrex.antenna import (Antenna, DipoleAntenna, FrequencyResponse,
+                           ButterworthResponse)
+from pyrex.signals import Signal, LazySignal, UniformTimes
 from pyrex.ice_model import IceModel
 
 import numpy as np
+import scipy.signal
 
 
 
@@ -91,10 +93,91 @@ class TestAntenna:
         antenna.receive(Signal([0,1e-9,2e-9], [0,1,0], Signal.ValueTypes.voltage))
         assert len(antenna.signals) > 0
 
+    def test_receive_unmodified(self, antenna):
+        """Test that receiving a signal doesn't modify the original signal"""
+        signal = Signal([0,1e-9,2e-9], [0,1,0], Signal.ValueTypes.voltage)
+        values = signal.values
+        antenna.efficiency = 0.5
+        antenna.receive(signal)
+        antenna.receive(signal)
+        assert signal.values is values
+        assert np.array_equal(values, [0,1,0])
+        assert antenna.signals[0].values is not values
+        assert antenna.signals[0].values is not antenna.signals[1].values
+
+    def test_receive_then_modify(self, antenna):
+        """Test that modifying a signal in place after receiving it doesn't
+        change the received signal"""
+        antenna.noisy = False
+        signal = Signal([0,1e-9,2e-9], [0,1,0], Signal.ValueTypes.voltage)
+        antenna.receive(signal)
+        expected = np.array(antenna.signals[0].values)
+        antenna.signals.clear()
+        antenna.receive(signal)
+        signal *= 100
+        signal += Signal([0,1e-9,2e-9], [1,1,1], Signal.ValueTypes.voltage)
+        signal.clip(-1, 1)
+        assert np.array_equal(signal.values, [1,1,1])
+        assert np.allclose(antenna.signals[0].values, expected)
+        assert np.allclose(antenna.all_waveforms[0].values, expected)
+
+    def test_receive_then_modify_values(self, antenna):
+        """Test that writing to a signal's values array after receiving it
+        doesn't change the received signal"""
+        antenna.noisy = False
+        signal = Signal([0,1e-9,2e-9], [0,1,0], Signal.ValueTypes.voltage)
+        antenna.receive(signal)
+        expected = np.array(antenna.signals[0].values)
+        antenna.signals.clear()
+        antenna.receive(signal)
+        antenna.receive(signal.lazy())
+        signal.values *= 100
+        assert np.array_equal(signal.values, [0,100,0])
+        assert np.allclose(antenna.signals[0].values, expected)
+        assert np.allclose(antenna.signals[1].values, expected)
+        assert np.allclose(antenna.all_waveforms[0].values, expected)
+
+    def test_receive_lazy(self, antenna):
+        """Test that receiving a lazy signal matches receiving a signal"""
+        signal = Signal([0,1e-9,2e-9], [0,1,0], Signal.ValueTypes.voltage)
+        antenna.receive(signal)
+        antenna.receive(signal.lazy())
+        assert isinstance(antenna.signals[1], LazySignal)
+        assert np.allclose(antenna.signals[0].values,
+                           antenna.signals[1].values)
+
+    def test_receive_deferred(self, antenna):
+        """Test that received signals defer processing until the antenna's
+        waveforms are needed, and noise values aren't stored"""
+        signal = Signal([0,1e-9,2e-9], [0,1,0], Signal.ValueTypes.voltage)
+        antenna.receive(signal)
+        antenna.receive(signal)
+        for hit in antenna.signals:
+            assert isinstance(hit, LazySignal)
+            assert hit._operations != []
+            assert hit._values is not signal.values
+            assert np.array_equal(hit._values, signal.values)
+        expected = Signal(signal.times, signal.values)
+        expected.filter_frequencies(antenna.response)
+        waveform = antenna.all_waveforms[0]
+        noise = antenna.make_noise(signal.times)
+        assert np.allclose(waveform.values, expected.values+noise.values)
+        for noise_times in antenna._noises:
+            assert not(isinstance(noise_times, Signal))
+
     def test_no_waveforms(self, antenna):
         """Test that waveforms returns an empty list if there are no signals"""
         assert antenna.waveforms == []
 
+    def test_empty_full_waveform_writable(self, antenna):
+        """Test that the full waveform of a noiseless antenna with no signals
+        is zero and can be modified in place"""
+        antenna.noisy = False
+        waveform = antenna.full_waveform([0,1e-9,2e-9])
+        assert np.array_equal(waveform.values, [0,0,0])
+        waveform.values += 1
+        assert np.array_equal(waveform.values, [1,1,1])
+
     def test_waveforms_exist(self, antenna):
         """Test that waveforms returns a waveform when a signal has been received"""
         antenna.receive(Signal([0,1e-9,2e-9], [0,1,0], Signal.ValueTypes.voltage))
@@ -103,6 +186,58 @@ class TestAntenna:
         assert antenna._noises != []
         assert antenna._triggers == [True]
 
+    def test_waveforms_cached(self, antenna):
+        """Test that waveforms are only calculated once per signal and are
+        updated by receive and clear"""
+        antenna.receive(Signal([0,1e-9,2e-9], [0,1,0], Signal.ValueTypes.voltage))
+        all_waves = antenna.all_waveforms
+        waves = antenna.waveforms
+        cached = antenna._cached_all_waveforms()[0]
+        assert np.shares_memory(antenna.all_waveforms[0].values, cached.values)
+        assert np.array_equal(antenna.all_waveforms[0].values,
+                              all_waves[0].values)
+        assert np.array_equal(antenna.waveforms[0].values, waves[0].values)
+        antenna.receive(Signal([0,1e-9,2e-9], [0,1,0], Signal.ValueTypes.voltage))
+        assert len(antenna.all_waveforms) == 2
+        assert antenna._cached_all_waveforms()[0] is cached
+        assert len(antenna.waveforms) == 2
+        antenna.clear()
+        assert antenna.all_waveforms == []
+        assert antenna.waveforms == []
+        assert not(antenna.is_hit)
+
+    def test_waveforms_copied(self, antenna):
+        """Test that modifying the returned waveforms or lists doesn't change
+        the cached waveforms"""
+        antenna.receive(Signal([0,1e-9,2e-9], [0,1,0], Signal.ValueTypes.voltage))
+        expected = np.array(antenna.all_waveforms[0].values)
+        waves = antenna.waveforms
+        all_waves = antenna.all_waveforms
+        waves[0] *= 100
+        all_waves[0] += Signal([0,1e-9,2e-9], [1,1,1])
+        all_waves.append(all_waves[0])
+        waves.clear()
+        assert np.array_equal(antenna.all_waveforms[0].values, expected)
+        assert np.array_equal(antenna.waveforms[0].values, expected)
+        assert len(antenna.all_waveforms) == 1
+
+    def test_waveforms_signals_changed(self, antenna):
+        """Test that cached waveforms are recalculated when the signals list
+        is modified directly"""
+        antenna.noisy = False
+        antenna.signals.append(Signal([0,1e-9,2e-9], [0,1,0]))
+        antenna.signals.append(Signal([0,1e-9,2e-9], [0,2,0]))
+        assert len(antenna.all_waveforms) == 2
+        antenna.signals[0] = Signal([0,1e-9,2e-9], [0,3,0])
+        assert np.array_equal(antenna.all_waveforms[0].values, [0,3,0])
+        assert np.array_equal(antenna.all_waveforms[1].values, [0,2,0])
+        antenna.signals.pop()
+        assert len(antenna.all_waveforms) == 1
+        assert len(antenna.waveforms) == 1
+        antenna.signals.clear()
+        assert antenna.all_waveforms == []
+        assert not(antenna.is_hit)
+
     def test_delay_noise_calculation(self, antenna):
         """Test that antenna noise isn't calculated until it is needed"""
         antenna.receive(Signal([0,1e-9,2e-9], [0,1,0], Signal.ValueTypes.voltage))
@@ -138,6 +273,31 @@ class TestAntenna:
         noise = antenna.make_noise(np.linspace(0, 50e-9))
         assert antenna._noise_master == old_noise_master
 
+    def test_noise_coarse_times(self, antenna):
+        """Test that noise for times too coarse to sample the frequency range
+        is sliced from a finer buffer rather than aliased"""
+        times = UniformTimes(0, 1/1.5e9, 1000)
+        noise = antenna.make_noise(times)
+        buffer = antenna._noise_master
+        assert buffer.dt == pytest.approx(times.dt/2)
+        assert np.allclose(noise.values, buffer.values[:2000:2])
+        freqs = np.fft.rfftfreq(buffer.n, d=buffer.dt)
+        spectrum = np.abs(np.fft.rfft(buffer.values))
+        out_of_band = (freqs<500e6) | (freqs>=750e6)
+        assert np.max(spectrum[out_of_band]) < 1e-9*np.max(spectrum)
+        assert (np.sqrt(np.mean(buffer.values**2)) ==
+                pytest.approx(buffer.rms))
+
+    def test_noise_refreshed(self, antenna):
+        """Test that the same noise is returned for the same times until the
+        antenna is cleared"""
+        times = np.linspace(0, 100e-9, 101)
+        noise = antenna.make_noise(times)
+        assert np.array_equal(antenna.make_noise(times).values, noise.values)
+        antenna.clear()
+        assert not(np.allclose(antenna.make_noise(times).values,
+                               noise.values))
+
 
 
 class TestDipoleAntenna:
@@ -185,3 +345,110 @@ class TestDipoleAntenna:
         dot product of the antenna axis with the polarization direction
         (i.e. the z-component)"""
         assert dipole.polarization_gain((x,y,z)) == pytest.approx(z)
+
+    def test_shared_response(self, dipole):
+        """Test that identical dipole antennas share one response object"""
+        other = DipoleAntenna(name="other", position=[100,0,-200],
+                              center_frequency=250e6, bandwidth=300e6,
+                              resistance=100, orientation=[0,0,1],
+                              trigger_threshold=75e-6)
+        different = DipoleAntenna(name="different", position=[0,0,-250],
+                                  center_frequency=500e6, bandwidth=300e6,
+                                  resistance=100, orientation=[0,0,1],
+                                  trigger_threshold=75e-6)
+        assert other.response is dipole.response
+        assert different.response is not dipole.response
+
+    def test_trigger_probability(self, dipole):
+        """Test that the trigger probability matches the rate of triggers on
+        noisy waveforms"""
+        times = np.linspace(0, 100e-9, 2001)
+        pulse = Signal(times, 8e-5*np.exp(-((times-50e-9)/2e-9)**2)
+                       * np.sin(2*np.pi*250e6*times),
+                       value_type=Signal.ValueTypes.voltage)
+        np.random.seed(42)
+        triggers = 0
+        for _ in range(200):
+            dipole.clear()
+            dipole.receive(pulse)
+            triggers += dipole.is_hit
+        probability = dipole.hit_probability
+        assert 0 < probability < 1
+        assert probability == pytest.approx(triggers/200, abs=0.1)
+        assert dipole.trigger_probability(dipole.signals[0]) == probability
+        quiet = DipoleAntenna(name="quiet", position=[0,0,-250],
+                              center_frequency=250e6, bandwidth=300e6,
+                              resistance=100, orientation=[0,0,1],
+                              trigger_threshold=75e-6, noisy=False)
+        quiet.receive(pulse)
+        assert quiet.hit_probability == float(quiet.is_hit)
+
+
+
+class TestFrequencyResponse:
+    """Tests for FrequencyResponse class"""
+    def test_call(self):
+        """Test that the response evaluates its function when called"""
+        response = FrequencyResponse(lambda f: 2*np.ones(len(f)))
+        assert np.array_equal(response([1,2,3]), [2,2,2])
+
+    def test_on_grid_cached(self):
+        """Test that responses on an FFT grid are calculated only once"""
+        calls = []
+        def function(f):
+            calls.append(len(f))
+            return np.ones(len(f))
+        response = FrequencyResponse(function)
+        first = response.on_grid(2048, 5e-11)
+        second = response.on_grid(2048, 5e-11)
+        assert first is second
+        assert calls == [2048]
+        assert not first.flags.writeable
+
+    def test_on_grid_bounded(self):
+        """Test that the cache keeps only the most recent grids"""
+        response = FrequencyResponse(lambda f: np.ones(len(f)), cache_size=2)
+        first = response.on_grid(10, 1)
+        response.on_grid(20, 1)
+        response.on_grid(30, 1)
+        assert len(response._cache) == 2
+        assert response.on_grid(10, 1) is not first
+
+    def test_butterworth_matches_freqs(self):
+        """Test that the cached grid response matches direct evaluation"""
+        response = ButterworthResponse(1, (100e6, 400e6))
+        freqs = np.fft.fftfreq(2048, d=5e-11)
+        assert np.allclose(response.on_grid(2048, 5e-11), response(freqs))
+
+    @pytest.mark.parametrize("method", ["bilinear", "matched"])
+    def test_sos_matches_analog(self, method):
+        """Test that the discretized filter matches the analog response within
+        1% below 1 GHz"""
+        response = ButterworthResponse(1, (100e6, 400e6))
+        dt = 5e-11
+        freqs = np.linspace(20e6, 1e9, 50)
+        w, h = scipy.signal.sosfreqz(response.sos(dt, method=method),
+                                     worN=freqs, fs=1/dt)
+        assert np.allclose(h, response(freqs), rtol=0.01, atol=0)
+
+    def test_sos_cached(self):
+        """Test that the second-order sections are calculated once per dt"""
+        response = ButterworthResponse(1, (100e6, 400e6))
+        assert response.sos(5e-11) is response.sos(5e-11)
+
+    def test_time_domain_receive(self, dipole):
+        """Test that antennas applying the response in the time domain
+        receive nearly the same signal as with the FFT"""
+        iir = DipoleAntenna(name="ant", position=[0,0,-250],
+                            center_frequency=250e6, bandwidth=300e6,
+                            resistance=100, orientation=[0,0,1],
+                            trigger_threshold=75e-6, response_method="bilinear")
+        times = np.arange(8192)*5e-11
+        values = np.zeros(8192)
+        values[100:110] = 1
+        dipole.receive(Signal(times, values, Signal.ValueTypes.voltage))
+        iir.receive(Signal(times, values, Signal.ValueTypes.voltage))
+        fft_values = dipole.signals[0].values
+        iir_values = iir.signals[0].values
+        peak = np.max(np.abs(fft_values))
+        assert np.max(np.abs(fft_values-iir_values)) < 0.02*peak
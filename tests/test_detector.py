@@ -0,0 +1,173 @@
+"""File containing tests of pyrex detector module"""
+
+import pytest
+
+from pyrex.detector import AntennaSystem, Detector
+from pyrex.antenna import Antenna
+from pyrex.signals import Signal, UniformTimes
+
+import numpy as np
+
+
+
+class DoublingSystem(AntennaSystem):
+    """Antenna system whose front-end doubles the signal, counting calls"""
+    def __init__(self, antenna):
+        super().__init__(antenna)
+        self.calls = 0
+
+    def front_end(self, signal):
+        self.calls += 1
+        return signal * 2
+
+class StringDetector(Detector):
+    """Detector with antennas spaced vertically along a string"""
+    def set_positions(self, number, spacing=10):
+        self.antenna_positions = [[0, 0, -100-i*spacing]
+                                  for i in range(number)]
+
+@pytest.fixture
+def detector():
+    """Fixture for forming basic Detector object of noisy antennas"""
+    det = StringDetector(4)
+    det.build_antennas(Antenna, temperature=300, resistance=50,
+                       freq_range=[200e6, 500e6])
+    return det
+
+@pytest.fixture
+def system():
+    """Fixture for forming basic AntennaSystem object"""
+    return DoublingSystem(Antenna(position=[0,0,-250], noisy=False))
+
+
+class TestAntennaSystem:
+    """Tests for AntennaSystem class"""
+    def test_waveforms_cached(self, system):
+        """Test that front-end processing is only done once per signal"""
+        system.receive(Signal([0,1e-9,2e-9], [0,1,0],
+                              Signal.ValueTypes.voltage))
+        system.all_waveforms
+        system.waveforms
+        assert system.is_hit
+        assert system.calls == 1
+        system.receive(Signal([0,1e-9,2e-9], [0,2,0],
+                              Signal.ValueTypes.voltage))
+        assert len(system.all_waveforms) == 2
+        assert system.calls == 2
+
+    def test_waveforms_copied(self, system):
+        """Test that modifying the returned signals, waveforms, or lists
+        doesn't change the cached results"""
+        system.receive(Signal([0,1e-9,2e-9], [0,1,0],
+                              Signal.ValueTypes.voltage))
+        for name in ["signals", "waveforms", "all_waveforms"]:
+            items = getattr(system, name)
+            items[0] *= 100
+            items.append(items[0])
+            new_items = getattr(system, name)
+            assert len(new_items) == 1
+            assert np.allclose(new_items[0].values, [0,2,0])
+
+    def test_waveforms_signals_changed(self, system):
+        """Test that cached results are recalculated when the antenna's
+        signals list is modified directly"""
+        system.receive(Signal([0,1e-9,2e-9], [0,1,0],
+                              Signal.ValueTypes.voltage))
+        system.receive(Signal([0,1e-9,2e-9], [0,2,0],
+                              Signal.ValueTypes.voltage))
+        assert len(system.all_waveforms) == 2
+        system.antenna.signals[0] = Signal([0,1e-9,2e-9], [0,3,0])
+        assert np.array_equal(system.all_waveforms[0].values, [0,6,0])
+        assert np.array_equal(system.signals[0].values, [0,6,0])
+        assert np.allclose(system.all_waveforms[1].values, [0,4,0])
+        system.antenna.signals.pop()
+        assert len(system.all_waveforms) == 1
+        assert len(system.waveforms) == 1
+        assert len(system.signals) == 1
+        system.antenna.signals.clear()
+        assert system.all_waveforms == []
+        assert not(system.is_hit)
+
+
+
+class TestDetector:
+    """Tests for Detector class"""
+    def test_generate_noise_reproducible(self, detector):
+        """Test that the noise generated for a seeded random state is
+        reproducible and independent between antennas"""
+        times = UniformTimes(0, 5e-10, 1000)
+        np.random.seed(1234)
+        detector.generate_noise(times)
+        noises = [ant.make_noise(times).values for ant in detector]
+        np.random.seed(1234)
+        detector.generate_noise(times)
+        for ant, noise in zip(detector, noises):
+            assert np.array_equal(ant.make_noise(times).values, noise)
+        for i, noise in enumerate(noises):
+            for other in noises[i+1:]:
+                assert abs(np.corrcoef(noise, other)[0,1]) < 0.2
+        detector.generate_noise(times)
+        assert not(np.allclose(detector[0].make_noise(times).values,
+                               noises[0]))
+
+    def test_generate_noise_rms_band(self, detector):
+        """Test that the generated noise has the Johnson noise rms and is
+        only in the antennas' frequency range"""
+        times = UniformTimes(0, 5e-10, 1000)
+        detector.generate_noise(times)
+        rms = np.sqrt(4*1.38e-23*300*50*300e6)
+        for ant in detector:
+            buffer = ant._noise_master
+            assert times.dt/buffer.dt == pytest.approx(1)
+            assert np.sqrt(np.mean(buffer.values**2)) == pytest.approx(rms)
+            freqs = np.fft.rfftfreq(buffer.n, d=buffer.dt)
+            spectrum = np.abs(np.fft.rfft(buffer.values))
+            out_of_band = (freqs<200e6) | (freqs>=500e6)
+            assert np.max(spectrum[out_of_band]) < 1e-9*np.max(spectrum)
+
+    def test_generate_noise_before_signals(self, detector):
+        """Test that noise generated without times before any signals are
+        received is sampled for the times it's needed at, reproducibly"""
+        times = UniformTimes(0, 7e-10, 1000)
+        np.random.seed(1234)
+        detector.generate_noise()
+        noise = detector[0].make_noise(times)
+        buffer = detector[0]._noise_master
+        ratio = times.dt / buffer.dt
+        assert ratio == pytest.approx(np.round(ratio))
+        assert np.allclose(noise.values,
+                           buffer.values[:int(np.round(ratio))*1000:
+                                         int(np.round(ratio))])
+        for ant in detector:
+            ant._noise_master = None
+        np.random.seed(1234)
+        detector.generate_noise()
+        assert np.array_equal(detector[0].make_noise(times).values,
+                              noise.values)
+
+    def test_generate_noise_clears_waveforms(self, detector):
+        """Test that waveforms cached before generating new noise are
+        recalculated with the new noise, also for antenna systems"""
+        times = np.linspace(0, 5e-7, 1001)
+        signal = Signal(times, np.zeros(1001), Signal.ValueTypes.voltage)
+        detector.antennas[1] = DoublingSystem(detector[1])
+        detector.generate_noise(times)
+        for ant in detector:
+            ant.receive(signal)
+        antenna, system = detector[0], detector[1]
+        old_waveform = antenna.all_waveforms[0].values
+        old_system_waveform = system.all_waveforms[0].values
+        antenna.is_hit
+        system.is_hit
+        detector.generate_noise(times)
+        assert antenna._triggers == []
+        assert system._triggers == []
+        new_noise = antenna.make_noise(times).values
+        new_system_noise = system.antenna.make_noise(times).values
+        assert not(np.allclose(new_noise, old_waveform))
+        assert np.allclose(antenna.all_waveforms[0].values, new_noise)
+        assert np.allclose(system.all_waveforms[0].values,
+                           2*new_system_noise)
+        assert not(np.allclose(system.all_waveforms[0].values,
+                               old_system_waveform))
+        assert system.calls == 2
@@ -0,0 +1,304 @@
+"""File containing tests of pyrex custom irex module"""
+
+import pytest
+
+from pyrex.custom.irex.antenna import (IREXAntennaSystem,
+                                       time_over_threshold_trigger)
+from pyrex.custom.irex.frontends import (basic_envelope_model,
+                                         basic_envelope_model_batch,
+                                         spice_pool, spice_transient,
+                                         SurrogateEnvelopeModel,
+                                         surrogate_training_signals,
+                                         surrogate_filename, spice_surrogate)
+from pyrex.custom import pyspice
+from pyrex.signals import (Signal, SignalBatch, EmptySignal, AskaryanSignal,
+                           ThermalNoise, DigitizedSignal, NoiseBuffer,
+                           UniformTimes)
+
+import numpy as np
+
+
+
+def loop_trigger(times, values, threshold, time_over_threshold):
+    """Sample-by-sample time over threshold trigger, for comparison"""
+    imax = len(times)
+    i = 0
+    while i<imax:
+        j = i
+        while i<imax-1 and values[i]>threshold:
+            i += 1
+        if i!=j:
+            time = times[i]-times[j]
+            if time>time_over_threshold:
+                return True
+        i += 1
+    return False
+
+
+class TestTimeOverThresholdTrigger:
+    """Tests for time_over_threshold_trigger function"""
+    def test_matches_loop(self):
+        """Test that the run-length encoded trigger matches the loop over
+        samples for many channels"""
+        np.random.seed(1234)
+        times = np.linspace(0, 2048e-9, 4096, endpoint=False)
+        envelopes = np.abs(np.random.normal(size=(64, 4096)))
+        triggers, _ = time_over_threshold_trigger(times, envelopes, 2,
+                                                  1.2e-9)
+        expected = [loop_trigger(times, envelope, 2, 1.2e-9)
+                    for envelope in envelopes]
+        assert np.array_equal(triggers, expected)
+        assert 0 < np.count_nonzero(triggers) < 64
+
+    def test_single_channel(self):
+        """Test that a single envelope gives a single trigger decision and
+        the start time of the first qualifying run"""
+        times = np.arange(10) * 1e-9
+        values = np.array([0, 2, 0, 0, 2, 2, 2, 0, 2, 2])
+        triggered, trigger_time = time_over_threshold_trigger(times, values,
+                                                              1, 1.5e-9)
+        assert triggered
+        assert trigger_time == times[4]
+        triggered, trigger_time = time_over_threshold_trigger(times, values,
+                                                              1, 3.5e-9)
+        assert not(triggered)
+        assert np.isnan(trigger_time)
+
+    def test_last_sample(self):
+        """Test that the last sample only ends runs, matching the loop"""
+        times = np.arange(4) * 1e-9
+        values = np.array([0, 0, 2, 2])
+        for tot in [0, 0.5e-9, 1e-9]:
+            triggered, _ = time_over_threshold_trigger(times, values, 1, tot)
+            assert triggered == loop_trigger(times, values, 1, tot)
+
+
+
+class TestBasicEnvelopeModelBatch:
+    """Tests for basic_envelope_model_batch function"""
+    @pytest.fixture
+    def batch(self):
+        """Fixture for forming a batch of clipped noise signals"""
+        np.random.seed(1234)
+        times = np.linspace(0, 2048e-9, 4096, endpoint=False)
+        values = np.clip(np.random.normal(scale=0.5, size=(16, 4096)), -3, 3)
+        return SignalBatch(times, values)
+
+    def test_matches_reference(self, batch):
+        """Test that the tabulated model matches basic_envelope_model for
+        batches stepped both per channel and across channels"""
+        envelopes = basic_envelope_model_batch(batch)
+        few = basic_envelope_model_batch(SignalBatch(batch.times,
+                                                     batch.values[:2]))
+        assert np.allclose(few.values, envelopes.values[:2],
+                           rtol=0, atol=1e-12)
+        for signal, envelope in zip(batch.to_signals(), envelopes.values):
+            assert np.allclose(basic_envelope_model(signal).values, envelope,
+                               rtol=0, atol=1e-8)
+
+    def test_state(self, batch):
+        """Test that envelopes continue from the state at the end of the
+        previous segment"""
+        envelopes = basic_envelope_model_batch(batch)
+        first = SignalBatch(batch.times[:2048], batch.values[:, :2048])
+        second = SignalBatch(batch.times[2048:], batch.values[:, 2048:])
+        first_envelopes = basic_envelope_model_batch(first)
+        second_envelopes = basic_envelope_model_batch(
+            second, state=first_envelopes.values[:, -1]
+        )
+        assert np.allclose(second_envelopes.values, envelopes.values[:, 2048:])
+        signal = Signal(second.times, second.values[0])
+        state = first_envelopes.values[0, -1]
+        assert np.allclose(basic_envelope_model(signal, state=state).values,
+                           envelopes.values[0, 2048:], rtol=0, atol=1e-8)
+
+    def test_empty(self):
+        """Test that an empty batch gives an empty batch of envelopes"""
+        times = np.linspace(0, 10e-9, 20, endpoint=False)
+        envelopes = basic_envelope_model_batch(SignalBatch(times,
+                                                           np.zeros((0, 20))))
+        assert envelopes.values.shape == (0, 20)
+
+
+
+def irex_system(**kwargs):
+    """Returns an IREXAntennaSystem with the given options"""
+    return IREXAntennaSystem(name="ant", position=(0,0,-100),
+                             trigger_threshold=0, amplification=1000,
+                             **kwargs)
+
+
+class TestWarmStart:
+    """Tests for warm starting the IREXAntennaSystem envelope circuit"""
+    times = np.linspace(-20e-9, 80e-9, 2048, endpoint=False)
+
+    def test_default(self):
+        """Test that warm start is off by default"""
+        assert not(irex_system().warm_start)
+
+    def test_noiseless(self):
+        """Test that without noise the warm-started envelope matches the
+        envelope settled over doubled times"""
+        pulse = AskaryanSignal(times=self.times, energy=1e8,
+                               theta=np.radians(45))
+        envelopes = []
+        for warm_start in [False, True]:
+            system = irex_system(noisy=False, warm_start=warm_start)
+            system.receive(pulse)
+            envelopes.append(system.all_waveforms[0].values)
+        assert np.max(envelopes[0]) > 1
+        assert np.allclose(envelopes[1], envelopes[0], rtol=0, atol=1e-9)
+
+    def test_steady_state(self):
+        """Test that noise-only waveforms start in the same steady state
+        whether warm started or settled over doubled times"""
+        np.random.seed(1234)
+        starts = []
+        for warm_start in [False, True]:
+            system = irex_system(warm_start=warm_start)
+            values = []
+            for _ in range(20):
+                system.clear()
+                system.antenna.signals.append(EmptySignal(self.times))
+                values.extend(system.all_waveforms[0].values[:50])
+            starts.append(np.mean(values))
+        dt = self.times[1] - self.times[0]
+        states = [system._initial_state(dt) for _ in range(1000)]
+        assert starts[0] == pytest.approx(np.mean(states), rel=0.25)
+        assert starts[1] == pytest.approx(np.mean(states), rel=0.25)
+
+
+
+class TestFrontEnds:
+    """Tests for the batched IREXAntennaSystem front-end"""
+    times = np.linspace(-20e-9, 80e-9, 2048, endpoint=False)
+
+    def test_waveforms_batched(self, monkeypatch):
+        """Test that the envelopes of all new waveforms are made in one call
+        which matches processing each waveform separately"""
+        system = irex_system(noisy=False, sampling_time=1e-9)
+        calls = []
+        make_envelopes = system.make_envelopes
+        def recording(signals, states=None):
+            calls.append(len(signals))
+            return make_envelopes(signals, states=states)
+        monkeypatch.setattr(system, "make_envelopes", recording)
+        pulses = [AskaryanSignal(times=self.times, energy=energy,
+                                 theta=np.radians(45))
+                  for energy in [1e8, 2e8, 5e8]]
+        for pulse in pulses:
+            system.receive(pulse)
+        waveforms = system.all_waveforms
+        assert calls == [3]
+        assert len(system.signals) == 3
+        assert calls == [3, 3]
+        for pulse, waveform in zip(pulses, waveforms):
+            separate = irex_system(noisy=False, sampling_time=1e-9)
+            separate.receive(pulse)
+            expected = separate.full_waveform(self.times)
+            assert isinstance(waveform, DigitizedSignal)
+            assert np.any(waveform.codes!=0)
+            assert np.array_equal(waveform.codes, expected.codes)
+
+    def test_amplified_and_clipped(self):
+        """Test that the batched front-end amplifies and clips signals before
+        making their envelopes"""
+        system = irex_system(noisy=False, amplifier_clipping=0.5)
+        signal = Signal(self.times, np.sin(2*np.pi*250e6*self.times)*0.01)
+        envelope = system.front_ends([signal])[0]
+        copy = signal * 1000
+        copy.clip(-0.5, 0.5)
+        assert np.allclose(envelope.values, system.make_envelope(copy).values)
+
+    @pytest.mark.skipif(not(pyspice.__available__),
+                        reason="PySpice is not installed")
+    def test_spice_pool(self):
+        """Test that envelopes simulated in a spice pool match the serial
+        simulation of each signal"""
+        times = np.linspace(0, 200e-9, 2001)
+        signals = [ThermalNoise(times, f_band=(100e6, 400e6),
+                                rms_voltage=0.1*(i+1))
+                   for i in range(4)]
+        with spice_pool(2) as pool:
+            system = IREXAntennaSystem(name="ant", position=(0,0,-100),
+                                       trigger_threshold=0,
+                                       envelope_method="spice basic",
+                                       spice_pool=pool)
+            envelopes = system.make_envelopes(signals)
+        for signal, envelope in zip(signals, envelopes):
+            expected = spice_transient("basic", signal)
+            assert np.allclose(envelope.values, expected.values)
+
+
+
+@pytest.fixture(scope="module")
+def surrogate():
+    """Fixture for a surrogate model fit to basic_envelope_model"""
+    dt = 0.5e-9
+    signals = surrogate_training_signals(dt)
+    batch = SignalBatch(signals[0].time_grid,
+                        np.array([signal.values for signal in signals]))
+    outputs = basic_envelope_model_batch(batch).values
+    return SurrogateEnvelopeModel.fit(batch.values, outputs, dt)
+
+
+class TestSurrogateEnvelopeModel:
+    """Tests for SurrogateEnvelopeModel class"""
+    def test_tracks_model(self, surrogate):
+        """Test that the surrogate tracks the model it was fit to on new
+        noise to about 0.1% of the envelope"""
+        times = UniformTimes(0, surrogate.dt, 4096)
+        for rms in [0.01, 0.1, 0.5]:
+            buffer = NoiseBuffer((100e6, 400e6), surrogate.dt/2, 8192,
+                                 rms_voltage=rms,
+                                 random_state=np.random.RandomState(1))
+            noise = buffer.with_times(times)
+            noise.clip(-3, 3)
+            reference = basic_envelope_model(noise).values
+            error = np.max(np.abs(surrogate(noise).values-reference))
+            assert error < 2e-3*np.max(reference)
+
+    def test_save_load(self, surrogate, tmp_path):
+        """Test that saved models load identically, with no temporary files
+        left behind"""
+        filename = str(tmp_path / "model.npz")
+        original = SurrogateEnvelopeModel(surrogate.table, surrogate.y_range,
+                                          surrogate.w_range, surrogate.dt,
+                                          scale=surrogate.scale,
+                                          source="netlist hash")
+        original.save(filename)
+        assert [path.name for path in tmp_path.iterdir()] == ["model.npz"]
+        model = SurrogateEnvelopeModel.load(filename)
+        assert np.array_equal(model.table, original.table)
+        assert model.y_range == pytest.approx(original.y_range)
+        assert model.w_range == pytest.approx(original.w_range)
+        assert model.dt == original.dt
+        assert model.scale == original.scale
+        assert model.source == "netlist hash"
+
+    def test_filename(self, tmp_path):
+        """Test that cache file names depend on the fit parameters"""
+        cache_dir = str(tmp_path)
+        filename = surrogate_filename("basic", 0.5e-9, cache_dir=cache_dir)
+        assert filename == surrogate_filename("basic", 0.5e-9,
+                                              cache_dir=cache_dir)
+        for kwargs in [dict(max_voltage=2), dict(shape=(65, 129)),
+                       dict(scale=0.1), dict(smoothing=1e-5)]:
+            assert filename != surrogate_filename("basic", 0.5e-9,
+                                                  cache_dir=cache_dir,
+                                                  **kwargs)
+        assert filename != surrogate_filename("basic", 0.25e-9,
+                                              cache_dir=cache_dir)
+
+    @pytest.mark.skipif(pyspice.__available__,
+                        reason="PySpice is installed")
+    def test_cached_without_pyspice(self, surrogate, tmp_path):
+        """Test that cached surrogates are loaded without PySpice, and that
+        uncached surrogates can't be made without it"""
+        cache_dir = str(tmp_path)
+        with pytest.raises(ModuleNotFoundError):
+            spice_surrogate("basic", surrogate.dt, cache_dir=cache_dir)
+        surrogate.save(surrogate_filename("basic", surrogate.dt,
+                                          cache_dir=cache_dir))
+        model = spice_surrogate("basic", surrogate.dt, cache_dir=cache_dir)
+        assert np.array_equal(model.table, surrogate.table)
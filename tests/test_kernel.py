@@ -0,0 +1,110 @@
+"""File containing tests of pyrex kernel module"""
+
+import pytest
+
+import pyrex.kernel
+from pyrex.kernel import EventKernel
+from pyrex.particle import Particle
+from pyrex.antenna import Antenna
+from pyrex.ray_tracing import PathFinder, ReflectedPathFinder
+from pyrex.ice_model import IceModel
+
+import numpy as np
+
+
+
+class FixedGenerator:
+    """Generator which always creates the same particle"""
+    def __init__(self, vertex, direction, energy):
+        self.vertex = vertex
+        self.direction = direction
+        self.energy = energy
+
+    def create_particle(self):
+        return Particle(self.vertex, self.direction, self.energy)
+
+class RecordingAntenna(Antenna):
+    """Antenna which records the pulses it receives"""
+    def __init__(self, position):
+        super().__init__(position=position, noisy=False)
+        self.pulses = []
+
+    def receive(self, signal, origin=None, polarization=None):
+        self.pulses.append(signal)
+        super().receive(signal, origin=origin, polarization=polarization)
+
+
+@pytest.fixture
+def path_counts(monkeypatch):
+    """Fixture for counting the paths whose existence is calculated in the
+    kernel (by path class)"""
+    paths = {PathFinder: {}, ReflectedPathFinder: {}}
+    class Counts:
+        def __getitem__(self, path_class):
+            return len(paths[path_class])
+    def counting(path_class):
+        class CountingPathFinder(path_class):
+            @property
+            def exists(self):
+                paths[path_class][id(self)] = self
+                return super().exists
+        return CountingPathFinder
+    monkeypatch.setattr(pyrex.kernel, "PathFinder", counting(PathFinder))
+    monkeypatch.setattr(pyrex.kernel, "ReflectedPathFinder",
+                        counting(ReflectedPathFinder))
+    return Counts()
+
+@pytest.fixture
+def generator():
+    """Fixture for a generator of a vertical particle, so antennas at the
+    same horizontal distance see the same emission angle"""
+    return FixedGenerator(vertex=[0,0,-500], direction=[0,0,1], energy=1e8)
+
+
+class TestEventKernel:
+    """Tests for EventKernel class"""
+    def test_shared_geometry(self, generator, path_counts):
+        """Test that antennas with the same path geometry share the path
+        existence and propagated pulses"""
+        antennas = [RecordingAntenna([100,0,-200]),
+                    RecordingAntenna([0,100,-200]),
+                    RecordingAntenna([-100,0,-200])]
+        kernel = EventKernel(generator, IceModel, antennas)
+        kernel.event()
+        assert path_counts[PathFinder] == 1
+        assert path_counts[ReflectedPathFinder] == 1
+        assert len(antennas[0].pulses) > 0
+        for ant in antennas[1:]:
+            assert len(ant.pulses) == len(antennas[0].pulses)
+            for pulse, first_pulse in zip(ant.pulses, antennas[0].pulses):
+                assert pulse is first_pulse
+
+    def test_distinct_geometry(self, generator, path_counts):
+        """Test that antennas with nearby but distinct path geometries don't
+        share path existence or pulses"""
+        antennas = [RecordingAntenna([100,0,-200]),
+                    RecordingAntenna([100.001,0,-200]),
+                    RecordingAntenna([100,0,-200.001])]
+        kernel = EventKernel(generator, IceModel, antennas)
+        kernel.event()
+        assert path_counts[PathFinder] == 3
+        assert path_counts[ReflectedPathFinder] == 3
+        for ant in antennas[1:]:
+            assert len(ant.pulses) == len(antennas[0].pulses)
+            for pulse, first_pulse in zip(ant.pulses, antennas[0].pulses):
+                assert pulse is not first_pulse
+
+    def test_sharing_disabled(self, generator, path_counts):
+        """Test that geometry_tolerance of None calculates every path and
+        pulse separately, with the same results as when shared"""
+        antennas = [RecordingAntenna([100,0,-200]),
+                    RecordingAntenna([0,100,-200])]
+        kernel = EventKernel(generator, IceModel, antennas,
+                             geometry_tolerance=None)
+        kernel.event()
+        assert path_counts[PathFinder] == 2
+        assert path_counts[ReflectedPathFinder] == 2
+        assert len(antennas[1].pulses) == len(antennas[0].pulses)
+        for pulse, first_pulse in zip(antennas[1].pulses, antennas[0].pulses):
+            assert pulse is not first_pulse
+            assert np.allclose(pulse.values, first_pulse.values)
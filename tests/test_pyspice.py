@@ -0,0 +1,196 @@
+"""File containing tests of pyrex custom pyspice module"""
+
+import pytest
+
+import os.path
+import pickle
+import subprocess
+import sys
+
+import numpy as np
+
+import pyrex
+from pyrex.signals import Signal
+from pyrex.custom import pyspice
+from pyrex.custom.pyspice import SpiceCircuits, LazyObject, _InputLookup
+
+
+
+class Builder:
+    """Circuit builder which counts the circuits it builds"""
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        return {"name": "circuit", "nodes": ["input", "output"]}
+
+
+class Unpicklable:
+    """Object which can't be pickled (like a live PySpice circuit)"""
+    def __reduce__(self):
+        raise TypeError("can't pickle circuit")
+
+
+class UnpicklableBuilder(Builder):
+    """Circuit builder which builds circuits that can't be pickled"""
+    def __call__(self):
+        super().__call__()
+        return Unpicklable()
+
+
+class TestInputLookup:
+    """Tests for _InputLookup class"""
+    def check_lookup(self, times, values):
+        """Compares the lookup against np.interp at the signal times, between
+        them, and before and after them"""
+        lookup = _InputLookup(Signal(times, values))
+        times = np.asarray(times)
+        span = times[-1] - times[0]
+        check_times = np.concatenate((
+            times, (times[1:]+times[:-1])/2,
+            np.random.uniform(times[0]-span, times[-1]+span, 1000),
+            [times[0]-span, times[0], times[-1], times[-1]+span]
+        ))
+        expected = np.interp(check_times, times, values)
+        looked_up = [lookup(time) for time in check_times]
+        assert np.allclose(looked_up, expected, rtol=1e-9, atol=1e-12)
+
+    def test_uniform(self):
+        """Test that looking up evenly spaced times matches np.interp"""
+        np.random.seed(0)
+        times = np.linspace(-5e-9, 20e-9, 251)
+        lookup = _InputLookup(Signal(times, np.random.normal(size=251)))
+        assert lookup.times is None
+        for _ in range(10):
+            self.check_lookup(times, np.random.normal(size=251))
+
+    def test_irregular(self):
+        """Test that looking up unevenly spaced times matches np.interp"""
+        np.random.seed(1)
+        for _ in range(10):
+            times = np.sort(np.random.uniform(-5e-9, 20e-9, 100))
+            values = np.random.normal(size=100)
+            lookup = _InputLookup(Signal(times, values))
+            assert lookup.times is not None
+            self.check_lookup(times, values)
+
+    def test_end_points(self):
+        """Test that the first and last values are held outside the times"""
+        for times in [[0, 1, 2, 3], [0, 1, 3, 4]]:
+            lookup = _InputLookup(Signal(times, [1, 2, 4, 8]))
+            assert lookup(0) == 1
+            assert lookup(-10) == 1
+            assert lookup(times[-1]) == 8
+            assert lookup(100) == 8
+
+    def test_single_time(self):
+        """Test that a signal with one time gives its value at any time"""
+        lookup = _InputLookup(Signal([1], [5]))
+        for time in [-1, 1, 3]:
+            assert lookup(time) == 5
+
+
+class TestSpiceCircuits:
+    """Tests for SpiceCircuits class"""
+    def test_lazy(self):
+        """Test that circuits are only built the first time they're
+        accessed"""
+        builder = Builder()
+        circuits = SpiceCircuits({"circuit": builder, "other": Builder()})
+        assert list(circuits) == ["circuit", "other"]
+        assert len(circuits) == 2
+        assert "circuit" in circuits
+        assert "missing" not in circuits
+        assert builder.count == 0
+        circuit = circuits["circuit"]
+        assert circuits["circuit"] is circuit
+        assert builder.count == 1
+
+    def test_missing(self):
+        """Test that accessing a missing circuit raises a KeyError"""
+        circuits = SpiceCircuits()
+        with pytest.raises(KeyError):
+            circuits["circuit"]
+
+    def test_pickle_builders_only(self):
+        """Test that pickling only keeps the builders, not built circuits"""
+        circuits = SpiceCircuits({"circuit": UnpicklableBuilder()})
+        circuit = circuits["circuit"]
+        unpickled = pickle.loads(pickle.dumps(circuits))
+        assert unpickled._circuits == {}
+        assert list(unpickled) == ["circuit"]
+        assert unpickled._builders["circuit"].count == 1
+        assert isinstance(unpickled["circuit"], Unpicklable)
+        assert unpickled._builders["circuit"].count == 2
+        assert circuits["circuit"] is circuit
+
+    def test_import_builds_nothing(self):
+        """Test that importing the IREX front-ends (in a fresh interpreter)
+        doesn't build any circuits or parse the spice library"""
+        code = ("import pyrex.custom.irex.frontends as frontends; "
+                +"assert frontends.spice_circuits._circuits == {}; "
+                +"assert not(frontends.spice_library._created)")
+        # Run next to the tested pyrex package so it's the one imported
+        directory = os.path.dirname(os.path.dirname(pyrex.__file__))
+        subprocess.check_call([sys.executable, "-c", code], cwd=directory)
+
+
+class TestLazyObject:
+    """Tests for LazyObject class"""
+    def test_lazy(self):
+        """Test that the object is only created the first time it's used"""
+        builder = Builder()
+        lazy = LazyObject(builder)
+        assert builder.count == 0
+        obj = lazy()
+        assert lazy() is obj
+        assert builder.count == 1
+
+    def test_forwarding(self):
+        """Test that attributes, items, iteration, and membership are passed
+        to the object"""
+        class Object:
+            def __init__(self):
+                self.items = {"hsms": "model"}
+            def __getitem__(self, key):
+                return self.items[key]
+            def __iter__(self):
+                return iter(self.items)
+            def __len__(self):
+                return len(self.items)
+            def __contains__(self, key):
+                return key in self.items
+        lazy = LazyObject(Object)
+        assert lazy["hsms"] == "model"
+        assert list(lazy) == ["hsms"]
+        assert len(lazy) == 1
+        assert "hsms" in lazy
+        lazy.signal = "signal"
+        assert lazy().signal == "signal"
+        assert lazy.items is lazy().items
+
+    def test_failed_creation(self):
+        """Test that objects which fail to be created are created again on
+        the next use"""
+        calls = []
+        def factory():
+            calls.append(None)
+            if len(calls)==1:
+                raise ValueError("First call fails")
+            return "object"
+        lazy = LazyObject(factory)
+        with pytest.raises(ValueError):
+            lazy()
+        assert lazy() == "object"
+
+    @pytest.mark.skipif(pyspice.__available__,
+                        reason="PySpice is installed")
+    def test_spice_library_without_pyspice(self):
+        """Test that the spice library can't be used without PySpice, either
+        by calling it or indexing it"""
+        from pyrex.custom.irex.frontends import spice_library
+        with pytest.raises(ModuleNotFoundError):
+            spice_library()
+        with pytest.raises(ModuleNotFoundError):
+            spice_library["hsms"]
@@ -2,7 +2,9 @@
 
 import pytest
 
-from pyrex.ray_tracing import PathFinder
+from pyrex.ray_tracing import (PathFinder, ReflectedPathFinder,
+                               PathBatch, ReflectedPathBatch)
+from pyrex.signals import Signal
 from pyrex.ice_model import AntarcticIce
 
 import numpy as np
@@ -18,6 +20,18 @@ def bad_path():
     """Fixture for forming PathFinder object whose path doesn't exist"""
     return PathFinder(AntarcticIce, [100,0,-200], [0,0,-200])
 
+@pytest.fixture
+def path_batch():
+    """Fixture for forming PathBatch object from one point to many points"""
+    return PathBatch(AntarcticIce, [0,0,-100.],
+                     [[0,0,-200.], [1000,0,-50.], [50,50,-500.], [10,-20,-50.]])
+
+@pytest.fixture
+def reflected_batch():
+    """Fixture for forming ReflectedPathBatch object"""
+    return ReflectedPathBatch(AntarcticIce, [0,0,-100.],
+                              [[1000,0,-200.], [300,0,-200.], [200,150,-250.]])
+
 
 path_attenuations = [(1e3, 0.9993676), (1e4, 0.9985931), (1e5, 0.9968715),
                      (1e6, 0.9930505), (1e7, 0.9845992), (1e8, 0.9660472),
@@ -89,3 +103,117 @@ class TestPathFinder:
         """Test that attenuation returns the expected values within 1%"""
         assert (path_finder.attenuation(frequency)
                 == pytest.approx(attenuation, rel=0.01))
+
+
+    def test_adaptive_time_of_flight(self, path_finder):
+        """Test that the adaptive time of flight gives the expected value
+        within the given tolerance and reports its step count"""
+        tof, n_steps = path_finder.adaptive_time_of_flight(rel_tol=1e-6)
+        assert tof == pytest.approx(5.643462e-7, rel=1e-6)
+        assert n_steps > 0
+
+    # 10 GHz test excluded since its expected value carries the error of the
+    # fixed-step integration used to generate it
+    @pytest.mark.parametrize("frequency,attenuation", path_attenuations[:7])
+    def test_adaptive_attenuation(self, path_finder, frequency, attenuation):
+        """Test that adaptive attenuation returns the expected values within
+        0.01%"""
+        atten, n_steps = path_finder.adaptive_attenuation(frequency,
+                                                          rel_tol=1e-6)
+        assert atten == pytest.approx(attenuation, rel=0.0001)
+
+    def test_adaptive_steps(self):
+        """Test that short paths in deep ice take fewer adaptive steps than
+        long paths through the firn"""
+        deep = PathFinder(AntarcticIce, [0,0,-2000], [0,0,-2010])
+        shallow = PathFinder(AntarcticIce, [0,0,-2800], [2000,2000,-1])
+        assert (deep.adaptive_time_of_flight()[1]
+                < shallow.adaptive_time_of_flight()[1])
+        assert (deep.adaptive_attenuation([1e8, 1e9])[1]
+                < shallow.adaptive_attenuation([1e8, 1e9])[1])
+
+
+class TestPathBatch:
+    """Tests for PathBatch class"""
+    def test_creation(self, path_batch):
+        """Test that the PathBatch broadcasts its points as expected"""
+        assert len(path_batch) == 4
+        assert path_batch.from_points.shape == (4,3)
+        assert np.array_equal(path_batch.from_points[3], [0,0,-100])
+        assert np.array_equal(path_batch.to_points[1], [1000,0,-50])
+
+    def test_matches_path_finder(self, path_batch):
+        """Test that the batch properties match those of individual
+        PathFinder objects"""
+        for i in range(len(path_batch)):
+            pf = PathFinder(AntarcticIce, path_batch.from_points[i],
+                            path_batch.to_points[i])
+            assert path_batch.exists[i] == pf.exists
+            assert np.allclose(path_batch.emitted_ray[i], pf.emitted_ray)
+            assert np.allclose(path_batch.received_ray[i], pf.received_ray)
+            assert path_batch.path_length[i] == pytest.approx(pf.path_length)
+            assert path_batch.tof[i] == pytest.approx(pf.tof)
+
+    @pytest.mark.parametrize("frequency,attenuation", path_attenuations[:7])
+    def test_attenuation(self, path_batch, frequency, attenuation):
+        """Test that attenuation returns the expected values within 1%"""
+        assert (path_batch.attenuation(frequency)[0]
+                == pytest.approx(attenuation, rel=0.01))
+
+    def test_attenuation_array(self, path_batch):
+        """Test that attenuation of many frequencies returns one row per path
+        matching the PathFinder attenuation"""
+        fs = np.array([-1e9, -1e8, 0, 1e8, 1e9, 1e10])
+        attens = path_batch.attenuation(fs)
+        assert attens.shape == (4, 6)
+        for i in range(len(path_batch)):
+            pf = PathFinder(AntarcticIce, path_batch.from_points[i],
+                            path_batch.to_points[i])
+            assert np.allclose(attens[i], pf.attenuation(fs))
+
+    def test_propagate(self, path_batch):
+        """Test that propagating a list of signals matches propagating them
+        individually"""
+        times = np.linspace(0, 100e-9, 101)
+        values = np.sin(2*np.pi*200e6*times)
+        signals = [Signal(times, values) for _ in range(3)]
+        batch = PathBatch(AntarcticIce, [0,0,-100.],
+                          path_batch.to_points[[0,2,3]])
+        batch.propagate(signals)
+        for i, signal in enumerate(signals):
+            expected = Signal(times, values)
+            PathFinder(AntarcticIce, batch.from_points[i],
+                       batch.to_points[i]).propagate(expected)
+            assert np.allclose(signal.times, expected.times)
+            assert np.allclose(signal.values, expected.values)
+
+    def test_propagate_nonexistent(self, path_batch):
+        """Test that propagating along paths that don't exist fails"""
+        times = np.linspace(0, 100e-9, 101)
+        signals = [Signal(times, np.ones(101)) for _ in range(4)]
+        with pytest.raises(RuntimeError):
+            path_batch.propagate(signals)
+
+
+class TestReflectedPathBatch:
+    """Tests for ReflectedPathBatch class"""
+    def test_matches_reflected_path_finder(self, reflected_batch):
+        """Test that the batch properties match those of individual
+        ReflectedPathFinder objects"""
+        fs = np.array([1e7, 1e8, 1e9])
+        for i in range(len(reflected_batch)):
+            rpf = ReflectedPathFinder(AntarcticIce,
+                                      reflected_batch.from_points[i],
+                                      reflected_batch.to_points[i])
+            assert np.allclose(reflected_batch.bounce_points[i],
+                               rpf.bounce_point)
+            assert reflected_batch.exists[i] == rpf.exists
+            assert np.allclose(reflected_batch.emitted_ray[i],
+                               rpf.emitted_ray)
+            assert np.allclose(reflected_batch.received_ray[i],
+                               rpf.received_ray)
+            assert (reflected_batch.path_length[i]
+                    == pytest.approx(rpf.path_length))
+            assert reflected_batch.tof[i] == pytest.approx(rpf.tof)
+            assert np.allclose(reflected_batch.attenuation(fs)[i],
+                               rpf.attenuation(fs))
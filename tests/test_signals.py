@@ -2,7 +2,10 @@
 
 import pytest
 
-from pyrex.signals import Signal, EmptySignal, FunctionSignal
+from pyrex.signals import (Signal, EmptySignal, FunctionSignal, SignalBatch,
+                           UniformTimes, WindowedSignal, LazySignal,
+                           DigitizedSignal, StreamingFilter,
+                           StreamingEnvelope, NoiseBuffer)
 
 import numpy as np
 
@@ -22,6 +25,11 @@ def signals(request):
     vs = request.param[1]
     return Signal(ts, vs)
 
+@pytest.fixture
+def batch():
+    """Fixture for forming basic SignalBatch object"""
+    return SignalBatch([0,1,2,3,4], [[1,2,1,2,1], [0,1,2,1,0], [4,3,2,1,0]])
+
 
 class TestSignal:
     """Tests for Signal class"""
@@ -99,6 +107,202 @@ class TestSignal:
         for i in range(10):
             assert new.values[i] == pytest.approx(expected.values[i])
 
+    def test_filter_sos_streaming(self):
+        """Test that filtering a signal in pieces with carried filter state
+        matches filtering it all at once"""
+        sos = np.array([[0.1, 0.2, 0.1, 1, -0.5, 0.2]])
+        ts = np.arange(100)
+        vs = np.sin(ts/5)
+        whole = Signal(ts, vs)
+        whole.filter_sos(sos)
+        first = Signal(ts[:40], vs[:40])
+        second = Signal(ts[40:], vs[40:])
+        state = first.filter_sos(sos)
+        second.filter_sos(sos, state=state)
+        assert np.allclose(np.concatenate((first.values, second.values)),
+                           whole.values)
+
+    def test_uniform_times_implicit(self, signals):
+        """Test that evenly spaced times are stored implicitly"""
+        assert isinstance(signals.time_grid, UniformTimes)
+        assert signals._times is None
+        assert np.allclose(signals.times, np.array(signals.time_grid))
+
+    def test_times_modified_in_place(self, signals):
+        """Test that modifying the times array in place is reflected in the
+        signal's time grid"""
+        shifted = Signal(signals.time_grid, signals.values)
+        times = signals.times
+        times += 1
+        times[0] -= 0.5
+        assert np.array_equal(signals.time_grid, times)
+        assert signals.dt == pytest.approx(times[1]-times[0])
+        with pytest.raises(ValueError):
+            signals + shifted
+        signals.times = times
+        shifted.shift_times(1)
+        assert np.array_equal(signals.time_grid, times)
+        assert signals._same_times(signals)
+        assert not(signals._same_times(shifted))
+
+    def test_mixed_explicit_implicit_times(self):
+        """Test that signals from the same evenly spaced times can be added
+        whether or not their times arrays have been exposed"""
+        np.random.seed(1234)
+        for n in [3, 7, 101, 1001]:
+            for _ in range(50):
+                start, stop = np.sort(np.random.uniform(-1e-6, 1e-6, 2))
+                times = np.linspace(start, stop, n)
+                explicit = Signal(times, np.ones(n))
+                implicit = Signal(times, np.ones(n))
+                explicit.times
+                implicit.dt
+                assert np.array_equal((explicit+implicit).values,
+                                      2*np.ones(n))
+                assert np.array_equal((implicit+explicit).values,
+                                      2*np.ones(n))
+                explicit += implicit
+                implicit += explicit
+
+    def test_irregular_times_explicit(self):
+        """Test that unevenly spaced times are still supported"""
+        signal = Signal([0,1,3,4], [1,2,3,4])
+        assert np.array_equal(signal.time_grid, [0,1,3,4])
+        assert signal.dt == 1
+        assert np.array_equal((signal+signal).values, [2,4,6,8])
+
+    def test_shift_times(self, signals):
+        """Test that shifting times doesn't calculate the times array"""
+        original = np.array(signals.time_grid)
+        signals.shift_times(1)
+        assert isinstance(signals.time_grid, UniformTimes)
+        assert signals._times is None
+        assert np.allclose(signals.times, original+1)
+        signals.times += 1
+        assert np.allclose(signals.times, original+2)
+
+    def test_with_times_shifted_grid(self):
+        """Test that with_times on a shifted grid matches interpolation"""
+        ts = np.linspace(0, 10, 101)
+        signal = Signal(ts, np.sin(ts))
+        for shift in [0.5, 0.23, -3.07]:
+            grid = signal.time_grid.shifted(shift)
+            expected = np.interp(np.array(grid), ts, signal.values,
+                                 left=0, right=0)
+            assert np.allclose(signal.with_times(grid).values, expected)
+
+    def test_with_times_bandlimited(self):
+        """Test that bandlimited interpolation is more accurate than linear
+        interpolation for a smooth signal"""
+        ts = np.linspace(0, 20, 201)
+        signal = Signal(ts, np.sin(ts))
+        grid = UniformTimes(5.037, 0.1, 50)
+        exact = np.sin(np.array(grid))
+        linear = signal.with_times(grid).values
+        bandlimited = signal.with_times(grid,
+                                        interpolation="bandlimited").values
+        assert (np.max(np.abs(bandlimited-exact))
+                < np.max(np.abs(linear-exact)))
+        assert np.allclose(bandlimited, exact, atol=1e-3)
+        with pytest.raises(ValueError):
+            signal.with_times(grid, interpolation="cubic")
+
+    @pytest.mark.parametrize("make_signal", [
+        lambda ts: Signal(ts, np.sin(ts)),
+        lambda ts: WindowedSignal(ts, np.sin(ts[20:150]), offset=20),
+        lambda ts: EmptySignal(ts),
+        lambda ts: LazySignal(ts, np.sin(ts)),
+        lambda ts: Signal(ts, np.sin(ts)).digitize(bits=12, full_scale=1),
+        lambda ts: FunctionSignal(ts, np.sin),
+    ])
+    def test_with_times_interpolation_subclasses(self, make_signal):
+        """Test that all signal classes accept the interpolation argument of
+        with_times"""
+        ts = np.linspace(0, 20, 201)
+        signal = make_signal(ts)
+        grid = UniformTimes(5.037, 0.1, 50)
+        linear = signal.with_times(grid)
+        bandlimited = signal.with_times(grid, interpolation="bandlimited")
+        assert len(bandlimited.values) == 50
+        assert np.allclose(bandlimited.values, linear.values, atol=1e-2)
+
+    def test_no_copy(self):
+        """Test that signals can share their values arrays with the caller,
+        which are copied before in-place arithmetic"""
+        values = np.array([1.,2.,3.])
+        signal = Signal([0,1,2], values, copy=False)
+        assert signal.values is values
+        signal *= 2
+        signal += Signal([0,1,2], [1,1,1])
+        assert np.array_equal(signal.values, [3,5,7])
+        assert np.array_equal(values, [1,2,3])
+        signal = Signal([0,1,2], values)
+        assert signal.values is not values
+
+    def test_in_place_arithmetic(self, signal):
+        """Test that in-place arithmetic modifies the signal itself"""
+        original = signal
+        values = signal.values
+        signal += Signal(signal.times, [1,1,1,1,1])
+        signal *= 0.5
+        assert signal is original
+        assert signal.values is not values
+        assert np.array_equal(signal.values, [1,1.5,1,1.5,1])
+        assert np.array_equal((signal*2).values, [2,3,2,3,2])
+        assert np.array_equal((2*signal).values, [2,3,2,3,2])
+        with pytest.raises(ValueError):
+            signal += Signal([0,1,2,3,5], [1,1,1,1,1])
+        signal.value_type = Signal.ValueTypes.voltage
+        with pytest.raises(ValueError):
+            signal += Signal(signal.times, [1,1,1,1,1],
+                             value_type=Signal.ValueTypes.field)
+        with pytest.raises(TypeError):
+            signal += 1
+
+    def test_addition_different_times(self, signal):
+        """Test that signals with different times can't be added"""
+        other = Signal(signal.times, signal.values)
+        other.shift_times(0.5)
+        with pytest.raises(ValueError):
+            signal + other
+
+    def test_threshold_probability(self):
+        """Test that the probability of signal plus noise being above
+        threshold matches noise realizations"""
+        times = np.arange(400)*0.5e-9
+        signal = Signal(times, 3*np.exp(-((times-100e-9)/3e-9)**2)
+                        * np.sin(2*np.pi*250e6*times))
+        peak = np.max(signal.values)
+        assert signal.threshold_probability(peak-0.1, 0, (100e6, 400e6)) == 1
+        assert signal.threshold_probability(peak+0.1, 0, (100e6, 400e6)) == 0
+        assert signal.threshold_probability(-peak, 0, (100e6, 400e6),
+                                            absolute=False) == 1
+        assert signal.threshold_probability(peak-0.1, 0, (100e6, 400e6),
+                                            time_over_threshold=5e-9) == 0
+        np.random.seed(42)
+        noise = NoiseBuffer((100e6, 400e6), 0.5e-9, 400*1000, rms_voltage=1)
+        realizations = noise.values.reshape(1000, 400) + signal.values
+        for threshold in [3.5, 4.5]:
+            expected = np.mean(np.max(np.abs(realizations), axis=1)>threshold)
+            assert (signal.threshold_probability(threshold, 1, (100e6, 400e6))
+                    == pytest.approx(expected, abs=0.1))
+        assert (signal.threshold_probability(3, 1, (100e6, 400e6),
+                                             time_over_threshold=1e-9)
+                == pytest.approx(0, abs=0.01))
+
+
+def test_uniform_times():
+    """Test that UniformTimes behaves like the array of its times"""
+    grid = UniformTimes(1, 0.5, 5)
+    assert len(grid) == 5
+    assert grid[0] == 1
+    assert grid[-1] == 3
+    assert np.array_equal(grid, [1, 1.5, 2, 2.5, 3])
+    assert np.array_equal(grid[1:3], [1.5, 2])
+    assert UniformTimes.from_array([1, 1.5, 2, 2.5, 3]) == grid
+    assert UniformTimes.from_array([1, 1.5, 2, 2.5, 3.5]) is None
+    assert Signal(grid, [1,2,3]).dt == 0.5
+
 
 def test_empty_signal():
     """Test that an empty signal truly is empty"""
@@ -107,6 +311,289 @@ def test_empty_signal():
     for i in range(5):
         assert signal.values[i] == 0
 
+def test_empty_signal_no_storage():
+    """Test that an empty signal stores no values until they're accessed"""
+    signal = EmptySignal(UniformTimes(0, 1, 1000000))
+    assert len(signal.support) == 0
+    assert len(signal.values) == 1000000
+
+
+class TestWindowedSignal:
+    """Tests for WindowedSignal class"""
+    def test_values(self):
+        """Test that values outside the window are zero"""
+        signal = WindowedSignal([0,1,2,3,4,5], [1,2], offset=2)
+        assert np.array_equal(signal.support, [1,2])
+        assert np.array_equal(signal.values, [0,0,1,2,0,0])
+
+    def test_values_not_stored(self):
+        """Test that adding the windowed signal to another signal doesn't
+        store the full values array, while in-place processing does"""
+        signal = WindowedSignal([0,1,2,3,4,5], [1,2], offset=2)
+        full = Signal([0,1,2,3,4,5], [1,1,1,1,1,1])
+        assert np.array_equal((full+signal).values, [1,1,2,3,1,1])
+        full += signal
+        assert signal.offset == 2
+        assert np.array_equal(signal.support, [1,2])
+        signal.clip(0, 1.5)
+        assert signal.offset == 0
+        assert np.array_equal(signal.values, [0,0,1,1.5,0,0])
+
+    @pytest.mark.parametrize("make_signal", [
+        lambda ts: WindowedSignal(ts, [1,2], offset=2),
+        lambda ts: EmptySignal(ts),
+        lambda ts: Signal(ts[:3], [1,2,3]).with_times(ts),
+    ])
+    def test_values_writable(self, make_signal):
+        """Test that the values array can be modified like any other
+        signal's"""
+        ts = np.arange(6)
+        signal = make_signal(ts)
+        expected = np.array(signal.values)
+        signal.values += 1
+        assert np.array_equal(signal.values, expected+1)
+        signal.values[0] = 10
+        assert signal.values[0] == 10
+        assert np.array_equal(signal.values[1:], expected[1:]+1)
+
+    def test_clipped(self):
+        """Test that windows are clipped to the times"""
+        signal = WindowedSignal([0,1,2,3], [1,2,3], offset=-1)
+        assert signal.offset == 0
+        assert np.array_equal(signal.support, [2,3])
+        signal = WindowedSignal([0,1,2,3], [1,2,3], offset=3)
+        assert np.array_equal(signal.support, [1])
+        assert np.array_equal(signal.values, [0,0,0,1])
+
+    def test_overlap_add(self):
+        """Test that adding windowed signals only covers their windows"""
+        ts = np.arange(10)
+        first = WindowedSignal(ts, [1,2], offset=1)
+        second = WindowedSignal(ts, [3,4,5], offset=5)
+        total = first + second + EmptySignal(ts)
+        assert isinstance(total, WindowedSignal)
+        assert total.offset == 1
+        assert np.array_equal(total.values, [0,1,2,0,0,3,4,5,0,0])
+        dense = Signal(ts, np.ones(10)) + first
+        assert np.array_equal(dense.values, [1,2,3,1,1,1,1,1,1,1])
+        assert np.array_equal((first + Signal(ts, np.ones(10))).values,
+                              dense.values)
+        assert np.array_equal(sum([first, second]).values, total.values)
+
+    def test_in_place_overlap_add(self):
+        """Test that in-place addition only covers the windows"""
+        ts = np.arange(10)
+        total = EmptySignal(ts)
+        total += WindowedSignal(ts, [1,2], offset=1)
+        total += WindowedSignal(ts, [3,4], offset=5)
+        total *= 2
+        assert total.offset == 1
+        assert np.array_equal(total.values, [0,2,4,0,0,6,8,0,0,0])
+        dense = Signal(ts, np.ones(10))
+        dense += WindowedSignal(ts, [1,2], offset=8)
+        assert np.array_equal(dense.values, [1,1,1,1,1,1,1,1,2,3])
+
+    def test_with_times_window(self):
+        """Test that shifting a signal into longer times only stores the
+        overlapping window"""
+        ts = np.linspace(0, 1, 11)
+        signal = Signal(ts, np.arange(11))
+        long_times = UniformTimes(-5, 0.1, 1000)
+        new = signal.with_times(long_times)
+        assert isinstance(new, WindowedSignal)
+        assert len(new.support) == 11
+        expected = np.interp(np.array(long_times), ts, signal.values,
+                             left=0, right=0)
+        assert np.allclose(new.values, expected)
+
+
+class TestDigitizedSignal:
+    """Tests for digitizing signals"""
+    def test_resample_poly(self):
+        """Test that polyphase resampling keeps a slow signal the same"""
+        ts = np.linspace(0, 100, 2000, endpoint=False)
+        signal = Signal(ts, np.sin(2*np.pi*ts/50))
+        signal.resample_poly(1)
+        assert len(signal.values) == 100
+        assert signal.dt == pytest.approx(1)
+        assert np.allclose(signal.values[10:-10],
+                           np.sin(2*np.pi*signal.times[10:-10]/50), atol=1e-3)
+
+    def test_digitize(self):
+        """Test that digitized signals store compact codes within half a step
+        of the original values"""
+        ts = np.linspace(0, 100, 2000, endpoint=False)
+        signal = Signal(ts, 3e-3*np.sin(2*np.pi*ts/50),
+                        value_type=Signal.ValueTypes.voltage)
+        digitized = signal.digitize(dt=1, bits=8, full_scale=2e-3)
+        assert isinstance(digitized, DigitizedSignal)
+        assert digitized.codes.dtype == np.int8
+        assert len(digitized.codes) == 100
+        assert np.max(digitized.codes) == 127
+        assert np.min(digitized.codes) == -128
+        assert digitized.scale == pytest.approx(2e-3/127)
+        assert digitized.value_type == Signal.ValueTypes.voltage
+        expected = np.clip(3e-3*np.sin(2*np.pi*digitized.times/50),
+                           -2e-3, 2e-3)
+        assert np.allclose(digitized.values[10:-10], expected[10:-10],
+                           atol=digitized.scale)
+        assert (signal.digitize(bits=12, full_scale=2e-3).codes.dtype
+                == np.int16)
+        with pytest.raises(ValueError):
+            digitized.values[0] = 1
+        with pytest.raises(ValueError):
+            signal.digitize(dt=1)
+        for full_scale in [0, -1]:
+            with pytest.raises(ValueError):
+                signal.digitize(full_scale=full_scale)
+
+    def test_digitized_saturation(self):
+        """Test that processing digitized signals keeps their codes within
+        the range of their bits"""
+        ts = np.linspace(0, 100, 100, endpoint=False)
+        signal = Signal(ts, np.sin(2*np.pi*ts/50))
+        digitized = signal.digitize(bits=8, full_scale=1)
+        assert digitized.bits == 8
+        digitized *= 10
+        assert digitized.codes.dtype == np.int8
+        assert np.max(digitized.codes) == 127
+        assert np.min(digitized.codes) == -128
+        digitized += signal
+        assert np.max(digitized.codes) == 127
+        assert digitized.with_times(ts+1).bits == 8
+        saturated = DigitizedSignal([0,1,2], [-1000,0,1000], 0.5, bits=4)
+        assert np.array_equal(saturated.codes, [-8,0,7])
+
+    def test_digitized_with_times(self):
+        """Test that shifting digitized signals by whole samples keeps them
+        digitized"""
+        digitized = DigitizedSignal([0,1,2,3], [1,2,3,4], 0.5)
+        shifted = digitized.with_times([2,3,4,5])
+        assert isinstance(shifted, DigitizedSignal)
+        assert np.array_equal(shifted.codes, [3,4,0,0])
+        assert np.allclose(digitized.with_times([0.5,1.5]).values, [0.75,1.25])
+
+
+class TestStreaming:
+    """Tests for filtering and envelopes of signals in blocks"""
+    @pytest.fixture
+    def noise(self):
+        """Fixture for forming band-limited noise"""
+        np.random.seed(1)
+        signal = Signal(np.arange(20000)*1e-10, np.random.normal(size=20000))
+        signal.filter_frequencies(self.response)
+        return signal
+
+    @staticmethod
+    def response(f):
+        return np.exp(-((np.abs(f)-250e6)/80e6)**2)
+
+    def test_filter_matches(self, noise):
+        """Test that filtering in blocks matches filtering all at once away
+        from the ends"""
+        blocked = Signal(noise.times, noise.values)
+        blocked.filter_frequencies(self.response, block_size=1000)
+        noise.filter_frequencies(self.response)
+        assert len(blocked.values) == len(noise.values)
+        assert np.allclose(blocked.values[1000:-1000],
+                           noise.values[1000:-1000],
+                           atol=1e-4*np.std(noise.values))
+
+    def test_filter_chunks(self, noise):
+        """Test that the stream output doesn't depend on the chunk sizes"""
+        stream = StreamingFilter(self.response, noise.dt, block_size=500)
+        outputs = []
+        i = 0
+        for size in [1, 2000, 333, 7, 5000, 10000]:
+            outputs.append(stream.process(noise.values[i:i+size]))
+            i += size
+        outputs.append(stream.process(noise.values[i:]))
+        outputs.append(stream.flush())
+        blocked = Signal(noise.times, noise.values)
+        blocked.filter_frequencies(self.response, block_size=500)
+        assert np.allclose(np.concatenate(outputs), blocked.values)
+
+    def test_envelope_matches(self, noise):
+        """Test that envelopes calculated in blocks match the Hilbert
+        transform envelope away from the ends"""
+        blocked = noise.streamed_envelope(block_size=1000)
+        assert len(blocked) == len(noise.values)
+        assert np.allclose(blocked[1000:-1000], noise.envelope[1000:-1000],
+                           atol=1e-3*np.std(noise.values))
+        stream = StreamingEnvelope(block_size=1000)
+        chunked = np.concatenate((stream.process(noise.values[:1234]),
+                                  stream.process(noise.values[1234:]),
+                                  stream.flush()))
+        assert np.allclose(chunked, blocked)
+
+
+class TestLazySignal:
+    """Tests for LazySignal class"""
+    def test_matches_eager(self):
+        """Test that deferred processing matches processing a Signal"""
+        ts = np.linspace(0, 10, 101)
+        response = lambda f: np.exp(-np.abs(f))
+        eager = Signal(ts, np.sin(ts))
+        lazy = eager.lazy()
+        for signal in [eager, lazy]:
+            signal.filter_frequencies(response)
+            signal *= 2
+            signal.filter_frequencies(response)
+            signal += Signal(ts, np.ones(101))
+            signal.clip(-1.5, 1.5)
+        assert isinstance(lazy, Signal)
+        assert len(lazy._operations) == 5
+        assert np.allclose(lazy.values, eager.values)
+        assert len(lazy._operations) == 0
+
+    def test_lazy_copy(self):
+        """Test that lazy signals only share values when copy is False"""
+        ts = np.linspace(0, 10, 101)
+        eager = Signal(ts, np.sin(ts))
+        shared = eager.lazy()
+        copied = eager.lazy(copy=True)
+        assert shared._values is eager.values
+        assert copied._values is not eager.values
+        assert np.array_equal(copied._values, eager.values)
+        copied *= 2
+        copied_again = copied.lazy(copy=True)
+        assert copied_again._values is not copied._values
+        assert len(copied_again._operations) == 1
+        eager.values *= 3
+        assert np.allclose(copied_again.values, 2*np.sin(ts))
+
+    def test_merged_filters(self):
+        """Test that adjacent filters and scale factors are merged into one
+        set of FFTs"""
+        ts = np.linspace(0, 10, 101)
+        calls = []
+        def response(f):
+            calls.append(len(f))
+            return np.exp(-np.abs(f))
+        lazy = LazySignal(ts, np.sin(ts))
+        for _ in range(3):
+            lazy.filter_frequencies(response)
+            lazy *= 0.5
+        assert calls == []
+        expected = Signal(ts, np.sin(ts))
+        for _ in range(3):
+            expected.filter_frequencies(response)
+        assert np.allclose(lazy.values, expected.values/8)
+
+    def test_deferred_copies(self):
+        """Test that operations creating new signals don't affect the
+        original signal"""
+        ts = np.linspace(0, 10, 101)
+        lazy = LazySignal(ts, np.sin(ts))
+        scaled = lazy * 2
+        summed = lazy + scaled
+        shifted = lazy.with_times(ts+0.5)
+        assert np.allclose(lazy.values, np.sin(ts))
+        assert np.allclose(scaled.values, 2*np.sin(ts))
+        assert np.allclose(summed.values, 3*np.sin(ts))
+        assert np.allclose(shifted.values,
+                           np.interp(ts+0.5, ts, np.sin(ts), right=0))
+
 
 @pytest.mark.parametrize("func", [lambda x: x==1, np.cos])
 def test_function_signal(func):
@@ -120,3 +607,183 @@ def test_function_signal(func):
     long_signal = signal.with_times(long_ts)
     for i in range(10):
         assert long_signal.values[i] == pytest.approx(func(long_ts[i]))
+
+def test_function_signal_in_place():
+    """Test that in-place arithmetic on a function signal gives a signal which
+    no longer follows the function"""
+    ts = [0,1,2,3,4]
+    signal = FunctionSignal(ts, np.cos)
+    signal += Signal(ts, [1,1,1,1,1])
+    signal *= 2
+    assert not(isinstance(signal, FunctionSignal))
+    assert np.allclose(signal.values, 2*(np.cos(ts)+1))
+    assert np.allclose(signal.with_times([1,2]).values, 2*(np.cos([1,2])+1))
+
+
+
+class TestSignalBatch:
+    """Tests for SignalBatch class"""
+    def test_creation(self, batch):
+        """Test initialization of times and values of batch"""
+        assert np.array_equal(batch.times, [0,1,2,3,4])
+        assert batch.values.shape == (3,5)
+        assert len(batch) == 3
+
+    def test_padding(self):
+        """Test that rows are padded or sliced to the length of times"""
+        short = SignalBatch([0,1,2,3], [[1,2], [3,4]])
+        assert np.array_equal(short.values, [[1,2,0,0], [3,4,0,0]])
+        long = SignalBatch([0,1], [[1,2,3], [4,5,6]])
+        assert np.array_equal(long.values, [[1,2], [4,5]])
+
+    def test_signal_conversion(self, batch):
+        """Test that batches convert to and from lists of signals"""
+        signals = batch.to_signals()
+        assert len(signals) == 3
+        assert np.array_equal(signals[2].values, [4,3,2,1,0])
+        new = SignalBatch.from_signals(signals)
+        assert np.array_equal(new.values, batch.values)
+        assert np.array_equal(batch[1].values, [0,1,2,1,0])
+
+    def test_from_signals_different_times(self):
+        """Test that signals with different times can't be batched"""
+        with pytest.raises(ValueError):
+            SignalBatch.from_signals([Signal([0,1,2], [1,2,3]),
+                                      Signal([1,2,3], [1,2,3])])
+
+    def test_addition(self, batch, signal):
+        """Test that batches can be added to batches and signals"""
+        doubled = batch + batch
+        assert np.array_equal(doubled.values, 2*batch.values)
+        shifted = batch + signal
+        assert np.array_equal(shifted.values, batch.values+signal.values)
+        assert np.array_equal(sum([batch, batch]).values, doubled.values)
+
+    def test_scaling(self, batch):
+        """Test scaling by a number and by per-signal factors"""
+        assert np.array_equal((batch*2).values, 2*batch.values)
+        scaled = batch * np.array([1,2,3])
+        assert np.array_equal(scaled.values[2], 3*batch.values[2])
+
+    def test_envelope(self, batch, signal):
+        """Test that envelopes match the individual signal envelopes"""
+        assert np.allclose(batch.envelope[0], signal.envelope)
+
+    def test_resample(self, batch, signal):
+        """Test that resampling matches individual signal resampling"""
+        batch.resample(3)
+        signal.resample(3)
+        assert np.array_equal(batch.times, signal.times)
+        assert np.allclose(batch.values[0], signal.values)
+
+    def test_with_times(self, batch):
+        """Test that with_times matches the individual signals"""
+        times = [-2,-1,0,0.5,1,2,3,4,5,6,7]
+        new = batch.with_times(times)
+        for i, signal in enumerate(batch.to_signals()):
+            assert np.allclose(new.values[i], signal.with_times(times).values)
+
+    def test_filter_frequencies(self, batch):
+        """Test that filtering matches the individual signals, including
+        responses given per signal"""
+        expected = batch.to_signals()
+        for signal in expected:
+            signal.filter_frequencies(lambda f: np.exp(-np.abs(f)))
+        batch.filter_frequencies(lambda f: np.exp(-np.abs(f)))
+        for i, signal in enumerate(expected):
+            assert np.allclose(batch.values[i], signal.values)
+        batch.filter_frequencies(lambda f: np.zeros((3, len(f))))
+        assert np.allclose(batch.values, 0)
+
+    def test_threshold_trigger(self, batch):
+        """Test that the threshold trigger is evaluated for every signal"""
+        assert np.array_equal(batch.threshold_trigger(2.5),
+                              [False, False, True])
+
+
+
+class TestNoiseBuffer:
+    """Tests for NoiseBuffer class"""
+    @pytest.fixture
+    def buffer(self):
+        """Fixture for forming basic NoiseBuffer object"""
+        return NoiseBuffer(f_band=(100e6, 400e6), dt=1e-10, n=10000,
+                           rms_voltage=2)
+
+    def test_rms(self, buffer):
+        """Test that the noise has the given rms voltage"""
+        assert np.sqrt(np.mean(buffer.values**2)) == pytest.approx(2)
+        johnson = NoiseBuffer(f_band=(100e6, 400e6), dt=1e-10, n=10000,
+                              temperature=200, resistance=100)
+        assert (np.sqrt(np.mean(johnson.values**2)) ==
+                pytest.approx(np.sqrt(4*1.38e-23*200*100*300e6)))
+
+    def test_frequency_band(self, buffer):
+        """Test that the noise is only in the frequency band"""
+        freqs = np.fft.rfftfreq(buffer.n, d=buffer.dt)
+        spectrum = np.abs(np.fft.rfft(buffer.values))
+        out_of_band = (freqs<100e6) | (freqs>=400e6)
+        assert np.max(spectrum[out_of_band]) < 1e-9*np.max(spectrum)
+
+    def test_windows(self, buffer):
+        """Test that windows of noise are slices of the periodic buffer"""
+        window = buffer.with_times(UniformTimes(buffer.period-5e-10, 1e-10,
+                                                10))
+        assert window.value_type == Signal.ValueTypes.voltage
+        assert np.allclose(window.values,
+                           np.concatenate((buffer.values[-5:],
+                                           buffer.values[:5])))
+        times = np.linspace(3.05e-9, 5e-9, 7)
+        assert np.allclose(buffer.with_times(times).values,
+                           np.interp(times, np.arange(buffer.n)*buffer.dt,
+                                     buffer.values))
+        shifted = buffer.with_times(np.arange(20)*1e-10 + 0.5e-10)
+        assert np.allclose(shifted.values,
+                           (buffer.values[:20]+buffer.values[1:21])/2)
+
+    def test_refresh(self, buffer):
+        """Test that refreshing the buffer creates new noise"""
+        old_values = buffer.values
+        buffer.refresh()
+        assert not(np.allclose(buffer.values, old_values))
+        assert np.sqrt(np.mean(buffer.values**2)) == pytest.approx(2)
+
+    def test_batch(self):
+        """Test that batched buffers are independent with the given rms"""
+        buffers = NoiseBuffer.batch(5, f_band=(100e6, 400e6), dt=1e-10,
+                                    n=10000, rms_voltage=2)
+        assert len(buffers) == 5
+        for i, buffer in enumerate(buffers):
+            assert np.sqrt(np.mean(buffer.values**2)) == pytest.approx(2)
+            for other in buffers[i+1:]:
+                assert abs(np.corrcoef(buffer.values, other.values)[0,1]) < 0.1
+
+    def test_refresh_all_streams(self):
+        """Test that buffers refreshed together match buffers refreshed
+        separately from the same random streams"""
+        def make(seed, n):
+            return NoiseBuffer(f_band=(100e6, 400e6), dt=1e-10, n=n,
+                               rms_voltage=seed,
+                               random_state=np.random.RandomState(seed),
+                               generate=False)
+        together = [make(1, 1000), make(2, 2000), make(3, 1000)]
+        NoiseBuffer.refresh_all(together)
+        for buffer in together:
+            separate = make(buffer.rms, buffer.n)
+            separate.refresh()
+            assert np.allclose(buffer.values, separate.values)
+
+    def test_strided_windows(self, buffer):
+        """Test that windows coarser than the buffer spacing are strided
+        slices of the buffer"""
+        window = buffer.with_times(UniformTimes(1e-9, 3e-10, 10))
+        assert np.allclose(window.values, buffer.values[10:40:3])
+
+    def test_sampling_spacing(self):
+        """Test that the sampling spacing divides the window spacing and
+        samples above the frequency band"""
+        assert NoiseBuffer.sampling_spacing(1e-10, 400e6) == 1e-10
+        dt = NoiseBuffer.sampling_spacing(1.5e-9, 400e6)
+        assert 1.5e-9/dt == pytest.approx(2)
+        assert 1/dt >= 2.5*400e6
+